@@ -0,0 +1,120 @@
+""" Przepustowość kontrolera (komunikaty/s) przy pobieraniu komunikatów pojedynczo i seriami
+Sieć i UI zastąpione są atrapami, mierzony jest tylko koszt kontrolera i kodowania komunikatów.
+Uruchomienie (z katalogu głównego repozytorium): python -m benchmarks.controller
+"""
+import time
+from queue import Queue
+from threading import Event
+
+from sharedraw.cntrl.cntrl import Controller
+from sharedraw.config import config, own_id
+from sharedraw.networking.binary import WIRE_JSON, WIRE_BINARY
+from sharedraw.networking.messages import *
+from sharedraw.networking.networking import PeerPool
+
+PEERS = 4
+STROKES = 2000
+SEGMENTS = 5
+
+
+class BenchPeer:
+    """ Atrapa peera - zlicza wysłane bajty
+    """
+
+    def __init__(self, client_id: str, wire_format: str):
+        self.client_id = client_id
+        self.wire_format = wire_format
+        self.sent_bytes = 0
+
+    def is_active(self):
+        return True
+
+    def encode(self, msg: Message):
+        return msg.to_bytes()
+
+    def send(self, data, msg=None):
+        self.sent_bytes += len(data)
+
+
+class BenchPeerPool(PeerPool):
+    def __init__(self, port: int, stop_event: Event, queue_to_ui: Queue):
+        super().__init__(port, stop_event, queue_to_ui)
+        self.peers = [BenchPeer('peer%s' % i, WIRE_BINARY if i % 2 else WIRE_JSON) for i in range(PEERS)]
+
+
+class BenchUI:
+    """ Atrapa UI - sygnalizuje przetworzenie ostatniego komunikatu
+    """
+
+    def __init__(self):
+        self.done = Event()
+        self.painted = 0
+
+    def paint_batch(self, messages: []):
+        self.painted += len(messages)
+
+    def clean(self, message: Message):
+        pass
+
+    def update_clients_info(self, clients):
+        self.done.set()
+
+    def batching_stats(self):
+        return {}
+
+    def canvas_stats(self):
+        return {}
+
+
+class BenchController(Controller):
+    def create_peer_pool(self, port: int):
+        return BenchPeerPool(port, self.stop_event, self.queue_to_ui)
+
+    def create_ui(self):
+        return BenchUI()
+
+
+def workload():
+    """ Linie rysowane przez klienta peer0 w kilku komunikatach, przeplatane komunikatami sterującymi
+    """
+    sms = []
+    for stroke in range(STROKES):
+        x, y = stroke % 600, stroke % 400
+        for segment in range(SEGMENTS):
+            points = [(x + segment * 10 + i, y + segment * 10 + i) for i in range(11)]
+            msg = PaintMessage(points, 'black', 'peer0')
+            sms.append(SignedMessage('peer0', msg, msg.to_bytes()))
+        if stroke % 100 == 0:
+            sms.append(SignedMessage('peer1', CleanMessage('peer1')))
+    return sms
+
+
+def measure(batch_size: int):
+    config.controller_batch_size = batch_size
+    stop_event = Event()
+    cntrl = BenchController(stop_event, config.port)
+    cntrl.sd_ui.done.clear()
+    sms = workload()
+    for sm in sms:
+        cntrl.queue_to_ui.put(sm)
+    cntrl.queue_to_ui.put(SignedMessage(own_id, InternalReloadMessage()))
+    start = time.perf_counter()
+    cntrl.start()
+    cntrl.sd_ui.done.wait()
+    elapsed = time.perf_counter() - start
+    stop_event.set()
+    sent = sum(peer.sent_bytes for peer in cntrl.peer_pool.peers)
+    print('  batch size %4s: %8.1f ms  %9.0f msg/s  rendered messages: %5s  sent: %.1f MB' %
+          (batch_size, elapsed * 1000, len(sms) / elapsed, cntrl.sd_ui.painted, sent / 1024 / 1024))
+    return elapsed
+
+
+def main():
+    print('%s messages, %s peers' % (len(workload()), PEERS))
+    before = measure(1)
+    after = measure(256)
+    print('  speedup: %.1fx' % (before / after))
+
+
+if __name__ == '__main__':
+    main()
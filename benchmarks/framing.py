@@ -0,0 +1,59 @@
+""" Porównanie przepustowości MessageBuilder (bajt po bajcie) i MessageFramer
+Uruchomienie (z katalogu głównego repozytorium): python -m benchmarks.framing
+"""
+import os
+import time
+
+from sharedraw.networking.framing import MessageFramer
+from sharedraw.networking.messages import PaintMessage, ImageMessage
+from sharedraw.networking.networking import MessageBuilder
+
+CHUNK_SIZE = 65536
+
+
+def paint_burst(count=2000):
+    """ Strumień wielu krótkich komunikatów paint (30 punktów każdy)
+    """
+    msgs = [PaintMessage([(i % 640, (i * 7) % 480) for i in range(n, n + 30)], 'black').to_bytes()
+            for n in range(count)]
+    return b''.join(msgs), count
+
+
+def image_frames(count=3, size=2 * 1024 * 1024):
+    """ Strumień kilku dużych komunikatów image (losowe dane ~ skompresowany PNG)
+    """
+    msg = ImageMessage('bench', os.urandom(size), ['bench'], 'bench', False).to_bytes()
+    return msg * count, count
+
+
+def feed(builder, stream: bytes):
+    frames = 0
+    for i in range(0, len(stream), CHUNK_SIZE):
+        frames += len(builder.append(stream[i:i + CHUNK_SIZE]).fetch())
+    return frames
+
+
+def measure(name, factory, stream: bytes, expected: int, repeat=3):
+    best = None
+    for _ in range(repeat):
+        builder = factory()
+        start = time.perf_counter()
+        frames = feed(builder, stream)
+        elapsed = time.perf_counter() - start
+        assert frames == expected, '%s: %s frames, expected %s' % (name, frames, expected)
+        best = elapsed if best is None else min(best, elapsed)
+    mbps = len(stream) / best / 1024 / 1024
+    print('  %-16s %8.1f ms  %9.1f MB/s  %10.0f msg/s' % (name, best * 1000, mbps, expected / best))
+    return best
+
+
+def main():
+    for title, (stream, expected) in (('paint burst', paint_burst()), ('image frames', image_frames())):
+        print('%s: %s messages, %.1f MB' % (title, expected, len(stream) / 1024 / 1024))
+        old = measure('MessageBuilder', MessageBuilder, stream, expected, repeat=1)
+        new = measure('MessageFramer', MessageFramer, stream, expected)
+        print('  speedup: %.1fx' % (old / new))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+""" Przepustowość dopisywania do dziennika zmian obrazka oraz czas odtwarzania w zależności od jego rozmiaru
+Uruchomienie (z katalogu głównego repozytorium): python -m benchmarks.journal
+"""
+import random
+import tempfile
+import time
+
+from sharedraw.networking.messages import PaintMessage, CleanMessage
+from sharedraw.storage.journal import Journal, apply
+from sharedraw.ui.canvas import ImageCanvas
+
+WIDTH, HEIGHT = 640, 480
+SIZES = (1000, 10000, 100000)
+CHECKPOINT_RECORDS = 10000
+
+
+def workload(count: int):
+    """ Linie po 20 punktów, co tysięczny komunikat - czyszczenie
+    """
+    rnd = random.Random(count)
+    msgs = []
+    for i in range(count):
+        if i % 1000 == 999:
+            msgs.append(CleanMessage('bench'))
+            continue
+        x, y = rnd.randrange(WIDTH - 40), rnd.randrange(HEIGHT - 40)
+        msgs.append(PaintMessage([(x + j * 2, y + rnd.randrange(40)) for j in range(20)],
+                                 rnd.choice(('black', 'white')), 'bench'))
+    return msgs
+
+
+def measure(count: int, checkpoint_records: int):
+    msgs = workload(count)
+    canvas = ImageCanvas(WIDTH, HEIGHT)
+    with tempfile.TemporaryDirectory() as directory:
+        journal = Journal(directory, canvas.current_image, checkpoint_records=checkpoint_records)
+        start = time.perf_counter()
+        for msg in msgs:
+            # Tak jak w aplikacji - do dziennika trafiają komunikaty już narysowane
+            apply(canvas, msg)
+            journal.append(msg)
+        journal.sync()
+        elapsed = time.perf_counter() - start
+        size = journal.offset
+        journal.close()
+
+        start = time.perf_counter()
+        journal = Journal(directory)
+        recovered = journal.recover((WIDTH, HEIGHT))
+        recovery = time.perf_counter() - start
+        journal.close()
+    assert recovered.tobytes() == canvas.img.tobytes(), 'recovered image differs'
+    print('  %7s records, checkpoint every %7s: append (with drawing) %9.0f rec/s, journal tail %7.1f KB, '
+          'recovery %7.1f ms' % (count, checkpoint_records, count / elapsed, size / 1024, recovery * 1000))
+
+
+def main():
+    for count in SIZES:
+        measure(count, count + 1)
+        measure(count, CHECKPOINT_RECORDS)
+
+
+if __name__ == '__main__':
+    main()
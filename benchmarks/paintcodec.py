@@ -0,0 +1,56 @@
+""" Porównanie ogólnego kodowania JSON komunikatów paint (słowniki + json) z wyspecjalizowanym kodekiem
+Uruchomienie (z katalogu głównego repozytorium): python -m benchmarks.paintcodec
+"""
+import json
+import time
+
+from sharedraw.networking.messages import PaintMessage, from_json
+
+
+def paint_messages(count=2000, points=30):
+    """ Komunikaty paint o długości typowej dla rysowania (30 punktów każdy)
+    """
+    return [PaintMessage([(i % 640, (i * 7) % 480) for i in range(n, n + points)],
+                         'white' if n % 5 == 0 else 'black', 'client-%s' % (n % 4))
+            for n in range(count)]
+
+
+def measure(name, fn, items: [], repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in items:
+            fn(item)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print('  %-16s %8.1f ms  %10.0f msg/s' % (name, best * 1000, len(items) / best))
+    return best
+
+
+def main():
+    msgs = paint_messages()
+    # Wyjście obu koderów musi być identyczne co do bajtu
+    for msg in msgs:
+        assert msg.to_json() == msg.to_json_generic(), msg.to_json()
+    frames = [msg.to_bytes() for msg in msgs]
+    for frame, msg in zip(frames, msgs):
+        decoded = PaintMessage.from_frame(frame)
+        assert decoded.__dict__ == msg.__dict__, frame
+        assert decoded.__dict__ == from_json(frame.decode('utf-8')).__dict__, frame
+    print('paint: %s messages, %.1f MB' % (len(msgs), sum(map(len, frames)) / 1024 / 1024))
+    print('encode')
+    old = measure('generic', PaintMessage.to_json_generic, msgs)
+    new = measure('specialized', PaintMessage.to_json, msgs)
+    print('  speedup: %.1fx' % (old / new))
+    print('decode')
+    old = measure('generic', lambda frame: from_json(frame.decode('utf-8')), frames)
+    new = measure('specialized', PaintMessage.from_frame, frames)
+    print('  speedup: %.1fx' % (old / new))
+    # Ramki w innej postaci (separatory, kolejność pól) pozostają dla ogólnej ścieżki
+    data = json.loads(frames[0].decode('utf-8'))
+    assert PaintMessage.from_frame(json.dumps(data, separators=(',', ':')).encode('utf-8')) is None
+    assert PaintMessage.from_frame(json.dumps(data, sort_keys=True).encode('utf-8')) is None
+
+
+if __name__ == '__main__':
+    main()
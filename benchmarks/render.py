@@ -0,0 +1,100 @@
+""" Przepustowość rysowania komunikatów paint (odcinki/s): odcinek po odcinku, łamana po łamanej i seriami
+Na obrazku PIL (tryb 'framebuffer' i klient bez UI) oraz - jeśli jest dostępny ekran - na płótnie Tk (tryb 'items').
+Uruchomienie (z katalogu głównego repozytorium): python -m benchmarks.render
+"""
+import itertools
+import random
+import time
+
+from sharedraw.config import config
+from sharedraw.networking.messages import PaintMessage
+from sharedraw.ui.canvas import ImageCanvas
+
+
+def strokes(count: int, segments: int):
+    """ Komunikaty paint z losowymi liniami (po segments odcinków, co kilka pikseli)
+    """
+    rnd = random.Random(count)
+    messages = []
+    for i in range(count):
+        x, y = rnd.randrange(config.board_width), rnd.randrange(config.board_height)
+        points = [(x, y)]
+        for _ in range(segments):
+            x, y = x + rnd.randint(-6, 6), y + rnd.randint(-6, 6)
+            points.append((x, y))
+        messages.append(PaintMessage(points, 'white' if i % 7 == 0 else 'black', 'bench'))
+    return messages
+
+
+def per_segment(canvas: ImageCanvas, messages: []):
+    for message in messages:
+        points = message.changed_pxs
+        for i in range(1, len(points)):
+            canvas.draw(points[i - 1:i + 1], message.color)
+
+
+def per_message(canvas: ImageCanvas, messages: []):
+    for message in messages:
+        canvas.draw(message.changed_pxs, message.color)
+
+
+def batch(canvas: ImageCanvas, messages: []):
+    canvas.draw_batch(messages)
+
+
+def measure(name, draw, messages: [], segments: int, repeat=3):
+    best = None
+    for _ in range(repeat):
+        canvas = ImageCanvas()
+        start = time.perf_counter()
+        draw(canvas, messages)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print('  %-16s %8.1f ms  %12.0f segments/s' % (name, best * 1000, segments / best))
+    return best, canvas.img.tobytes()
+
+
+def measure_tk(messages: [], segments: int):
+    """ Elementy płótna Tk: jeden na odcinek (dotychczas) i jeden na łamaną
+    """
+    try:
+        from tkinter import Tk, Canvas
+        root = Tk()
+    except Exception as e:
+        print('tk canvas: skipped (%s)' % e)
+        return
+    c = Canvas(root, width=config.board_width, height=config.board_height)
+    c.pack()
+    print('tk canvas: %s messages, %s segments' % (len(messages), segments))
+    results = []
+    for name, items in (('per segment', lambda m: [(m.changed_pxs[i - 1] + m.changed_pxs[i])
+                                                   for i in range(1, len(m.changed_pxs))]),
+                        ('per message', lambda m: [tuple(itertools.chain.from_iterable(m.changed_pxs))])):
+        c.delete('all')
+        start = time.perf_counter()
+        for message in messages:
+            for coords in items(message):
+                c.create_line(*coords, fill=message.color)
+        root.update()
+        elapsed = time.perf_counter() - start
+        results.append(elapsed)
+        print('  %-16s %8.1f ms  %12.0f segments/s' % (name, elapsed * 1000, segments / elapsed))
+    print('  speedup: %.1fx' % (results[0] / results[1]))
+    root.destroy()
+
+
+def main():
+    for title, messages in (('controller batch', strokes(256, 5)), ('catch-up', strokes(10000, 5)),
+                            ('long strokes', strokes(500, 100))):
+        segments = sum(len(message.changed_pxs) - 1 for message in messages)
+        print('%s: %s messages, %s segments' % (title, len(messages), segments))
+        old, expected = measure('per segment', per_segment, messages, segments)
+        measure('per message', per_message, messages, segments)
+        new, img = measure('batch', batch, messages, segments)
+        assert img == expected, '%s: images differ' % title
+        print('  speedup: %.1fx' % (old / new))
+    measure_tk(strokes(2000, 5), 2000 * 5)
+
+
+if __name__ == '__main__':
+    main()
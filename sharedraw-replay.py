@@ -0,0 +1,5 @@
+import sys
+from sharedraw.replay import main
+
+if __name__ == '__main__':
+    sys.exit(main())
\ No newline at end of file
@@ -1,13 +1,32 @@
-from queue import Queue
+import time
+from queue import Queue, Empty
 from threading import Thread, Event
 from sharedraw.cntrl.sync import ClientsTable, OwnershipManager
+from sharedraw.config import config
+from sharedraw.metrics import metrics, count_histogram
 
+from sharedraw.networking.aio import AsyncPeerPool
+from sharedraw.networking.capture import CaptureWriter
+from sharedraw.networking.eventloop import SelectorPeerPool
 from sharedraw.networking.messages import *
 from sharedraw.networking.networking import PeerPool, ClientStatusMonitor
-from sharedraw.ui.ui import SharedrawUI
+from sharedraw.storage.journal import Journal
+from sharedraw.ui.headless import HeadlessUI
+from sharedraw.ui.snapshot import SNAPSHOT_PNG, SNAPSHOT_TILES
 
 logger = logging.getLogger(__name__)
 
+# Czas oczekiwania komunikatów w kolejce kontrolera [s] i liczba oczekujących komunikatów przy pobieraniu serii
+_queue_wait_time = metrics.histogram('controller.queue_wait_time')
+_queue_depth = metrics.histogram('controller.queue_depth', factory=count_histogram)
+
+# Dostępne implementacje puli peerów (wybierane przez config.network_mode)
+peer_pool_types = {
+    'threads': PeerPool,
+    'selector': SelectorPeerPool,
+    'asyncio': AsyncPeerPool
+}
+
 
 class Controller(Thread):
     """ Kontroler
@@ -18,37 +37,158 @@ class Controller(Thread):
         self.setDaemon(True)
         self.stop_event = stop_event
         self.queue_to_ui = Queue()
-        self.peer_pool = PeerPool(port, stop_event, self.queue_to_ui)
+        self.peer_pool = self.create_peer_pool(port)
         self.status_monitor = ClientStatusMonitor(stop_event, self.peer_pool)
         # Lista klientów
         self.clients = ClientsTable()
         self.clients.add(own_id)
         self.om = OwnershipManager(self.clients, self.peer_pool)
-        self.sd_ui = SharedrawUI(self.peer_pool, self.om)
+        self.journal = self.create_journal()
+        self.sd_ui = self.create_ui()
+        if self.journal:
+            self.journal.image_source = self.sd_ui.current_image
+        # Tablica obsługi komunikatów (komunikaty paint obsługiwane są seriami w process)
+        self.actions = {
+            ImageMessage: self._handle_image_msg,
+            JoinMessage: self._handle_join_msg,
+            QuitMessage: self._remove_remote_client,
+            CleanMessage: self._handle_clean_msg,
+            PassTokenMessage: self._handle_pass_token_message,
+            RequestTableMessage: self._handle_request_message,
+            ResignMessage: self._handle_resign_message,
+            InternalReloadMessage: lambda m: self._update_clients_info(),
+            InternalQuitMessage: self._remove_neighbour_client
+        }
         self._update_clients_info()
+        self.register_metrics()
+
+    def register_metrics(self):
+        """ Rejestruje w metrykach statystyki odczytywane na żądanie
+        """
+        metrics.register_source('controller.queue_size', self.queue_to_ui.qsize)
+        metrics.register_source('peers.queues', self.peer_pool.queue_stats)
+        metrics.register_source('peers.connections', self.peer_pool.heartbeat_stats)
+        metrics.register_source('ui.batching', self.sd_ui.batching_stats)
+        metrics.register_source('ui.canvas', self.sd_ui.canvas_stats)
+        metrics.register_control('ui.batching', self.set_batching)
+
+    def set_batching(self, latency_budget_ms=None, byte_budget=None):
+        """ Zmienia parametry grupowania punktów rysowanej linii (np. przez żądanie POST /ui.batching serwera metryk)
+        :param latency_budget_ms: maksymalne opóźnienie wysłania [ms] (napis lub liczba, None - bez zmian)
+        :param byte_budget: maksymalny rozmiar komunikatu [B] (napis lub liczba, None - bez zmian)
+        :return: statystyki grupowania po zmianie
+        :raise ValueError: wartość nie jest dodatnią liczbą
+        """
+        latency_budget_ms = None if latency_budget_ms is None else float(latency_budget_ms)
+        byte_budget = None if byte_budget is None else int(byte_budget)
+        if (latency_budget_ms is not None and latency_budget_ms <= 0) or (byte_budget is not None and byte_budget <= 0):
+            raise ValueError("Batching budgets must be positive")
+        self.sd_ui.set_batching(latency_budget_ms, byte_budget)
+        return self.sd_ui.batching_stats()
+
+    def create_peer_pool(self, port: int):
+        """ Tworzy pulę peerów wybraną w konfiguracji
+        :param port: port serwera
+        :return: pula peerów
+        """
+        peer_pool = peer_pool_types[config.network_mode](port, self.stop_event, self.queue_to_ui)
+        if config.capture_file:
+            peer_pool.capture = CaptureWriter(config.capture_file)
+        return peer_pool
+
+    def create_ui(self):
+        """ Tworzy widok aplikacji (okno Tk lub, w trybie bez UI, obrazek w pamięci)
+        :return: widok (sharedraw.ui.view.View)
+        """
+        if config.headless:
+            return HeadlessUI(self.peer_pool, self.om, self.journal, self.stop_event)
+        # Import dopiero tutaj - klient bez UI nie potrzebuje Tk (ani wyświetlacza)
+        from sharedraw.ui.ui import SharedrawUI
+        return SharedrawUI(self.peer_pool, self.om, self.journal)
+
+    def create_journal(self):
+        """ Tworzy dziennik zmian obrazka, jeśli jest włączony w konfiguracji
+        :return: dziennik lub None
+        """
+        if not config.journal_dir:
+            return None
+        return Journal(config.journal_dir)
+
+    def recover(self):
+        """ Odtwarza obrazek z dziennika (przed uruchomieniem kontrolera)
+        """
+        if not self.journal:
+            return
+        version, img = self.sd_ui.current_image()
+        recovered = self.journal.recover(img.size)
+        if recovered:
+            self.sd_ui.load_image(recovered)
 
     def run(self):
         while not self.stop_event.is_set():
-            sm = self.queue_to_ui.get()
-            action = {
-                PaintMessage: self.sd_ui.paint,
-                ImageMessage: self._handle_image_msg,
-                JoinMessage: self._handle_join_msg,
-                QuitMessage: self._remove_remote_client,
-                CleanMessage: lambda m: self.sd_ui.clean(),
-                PassTokenMessage: self._handle_pass_token_message,
-                RequestTableMessage: self._handle_request_message,
-                ResignMessage: self._handle_resign_message,
-                InternalReloadMessage: lambda m: self._update_clients_info(),
-                InternalQuitMessage: self._remove_neighbour_client
-            }.get(type(sm.message))
+            self.process(self._fetch_batch())
+
+    def _fetch_batch(self):
+        """ Pobiera z kolejki wszystkie dostępne komunikaty (co najwyżej config.controller_batch_size),
+        czekając na pierwszy z nich
+        :return: lista podpisanych komunikatów
+        """
+        batch = [self.queue_to_ui.get()]
+        while len(batch) < config.controller_batch_size:
+            try:
+                batch.append(self.queue_to_ui.get_nowait())
+            except Empty:
+                break
+        _queue_depth.observe(len(batch) + self.queue_to_ui.qsize())
+        now = time.monotonic()
+        for sm in batch:
+            _queue_wait_time.observe(now - sm.queued_at)
+        return batch
 
+    def process(self, batch: []):
+        """ Obsługuje serię komunikatów z zachowaniem kolejności.
+        Kolejne komunikaty paint od tego samego klienta są sklejane, rysowane jednym wywołaniem i przesyłane dalej
+        razem.
+        :param batch: lista podpisanych komunikatów
+        """
+        i = 0
+        size = len(batch)
+        while i < size:
+            sm = batch[i]
+            if type(sm.message) is PaintMessage:
+                j = i + 1
+                while j < size and type(batch[j].message) is PaintMessage and batch[j].client_id == sm.client_id:
+                    j += 1
+                self._handle_paints(batch[i:j])
+                i = j
+                continue
+            action = self.actions.get(type(sm.message))
             if action:
                 action(sm.message)
 
             if not isinstance(sm.message, InternalMessage):
                 # Przesłanie komunikatu do pozostałych klientów
-                self.peer_pool.send(sm.message, sm.client_id)
+                self.peer_pool.forward(sm)
+            i += 1
+
+    def _handle_paints(self, sms: []):
+        """ Obsługuje serię komunikatów paint od jednego klienta.
+        Kontynuacje linii są sklejane i rysowane jednym wywołaniem; do peerów trafiają sklejone komunikaty
+        (niesklejone - w oryginalnych ramkach, bez ponownego kodowania).
+        :param sms: lista podpisanych komunikatów
+        """
+        coalesced = [sms[0]]
+        for sm in sms[1:]:
+            last = coalesced[-1]
+            if last.message.is_continued_by(sm.message):
+                # Sklejony komunikat nie ma oryginalnej ramki
+                coalesced[-1] = SignedMessage(last.client_id, last.message.merged_with(sm.message))
+            else:
+                coalesced.append(sm)
+        msgs = [sm.message for sm in coalesced]
+        self.sd_ui.paint_batch(msgs)
+        # Przesłanie komunikatów do pozostałych klientów
+        self.peer_pool.forward_batch(coalesced)
 
     def _handle_image_msg(self, msg: ImageMessage):
         self.clients.update_with_id_list(msg.client_ids, msg.client_id)
@@ -57,16 +197,38 @@ class Controller(Thread):
         self._add_client(msg.client_id)
         self.sd_ui.update_image(msg)
 
+    def _handle_clean_msg(self, msg: CleanMessage):
+        self.sd_ui.clean(msg)
+
     def _handle_join_msg(self, msg: JoinMessage):
         if msg.received_from_id:
             # Przeproxowany klient - dodajemy do listy z informacją, kto wysłał
             self._add_client(msg.client_id, msg.received_from_id)
         else:
             # Odsyłamy ImageMessage, jeśli to klient, który podłączył się do nas
-            img_msg = ImageMessage(own_id, self.sd_ui.get_png(), self.clients.get_client_ids(),
-                                   self.clients.token_owner, self.clients.locked)
+            capabilities = negotiate(msg.capabilities)
+            img_msg = ImageMessage(own_id, None, self.clients.get_client_ids(),
+                                   self.clients.token_owner, self.clients.locked, capabilities)
             self._add_client(msg.client_id)
-            self.peer_pool.send_to_client(img_msg, msg.client_id)
+            # Obrazek kodowany jest w tle - rezerwujemy dla niego miejsce przed komunikatami wysłanymi w międzyczasie
+            send = self.peer_pool.reserve_for_client(msg.client_id)
+            if send:
+                encoding = SNAPSHOT_TILES if TILED_SNAPSHOT_CAPABILITY in capabilities else SNAPSHOT_PNG
+                self.sd_ui.request_snapshot(lambda snapshot: send(self._with_snapshot(img_msg, snapshot)), encoding)
+
+    @staticmethod
+    def _with_snapshot(img_msg: ImageMessage, snapshot):
+        """ Uzupełnia komunikat ImageMessage o migawkę obrazka
+        :param img_msg: komunikat
+        :param snapshot: migawka (sharedraw.ui.snapshot.Snapshot) lub None, jeśli nie udało się jej zakodować
+        :return: komunikat lub None (rezerwacja w kolejce klienta zostanie zwolniona)
+        """
+        if snapshot is None:
+            logger.error("Snapshot not available - image not sent")
+            return None
+        img_msg.rawdata = snapshot.data
+        img_msg.rawdata_b64 = snapshot.data_b64
+        return img_msg
 
     def _add_client(self, client_id: str, received_from_id=None):
         self.clients.add(client_id, received_from_id)
@@ -1,13 +1,19 @@
 import logging
+import time
+from bisect import bisect_left, bisect_right, insort
 from threading import Timer
 
 from sharedraw.config import own_id, config
+from sharedraw.metrics import metrics
 from sharedraw.networking.messages import RequestTableMessage, PassTokenMessage, RicartTableRow, ResignMessage, \
     InternalReloadMessage, SignedMessage
 from sharedraw.networking.networking import PeerPool
 
 logger = logging.getLogger(__name__)
 
+# Czas od żądania tablicy do otrzymania tokena [s]
+_token_wait_time = metrics.histogram('token.wait_time')
+
 
 class LogicalClock:
     """ Klasa reprezentująca zegar logiczny. Dostępne 2 operacje - zwiększenie i max
@@ -29,17 +35,45 @@ class LogicalClock:
 
 class ClientsTable:
     """ Klasa trzymająca dane klientów obecnych w systemie rozproszonym
+    Klienci są indeksowani po identyfikatorze i pogrupowani wg klienta, od którego ich otrzymaliśmy.
+    Pierścień klientów to kolejność dodania; klienci żądający tokena (R > G) trzymani są w osobnym indeksie
+    uporządkowanym wg pozycji w pierścieniu - wyszukanie następnego posiadacza tokena nie przegląda pozostałych.
     """
 
     def __init__(self):
-        self.clients = []
+        # id -> Client; słownik zachowuje kolejność dodania (kolejność pierścienia)
+        self.__by_id = {}
+        # id -> pozycja w pierścieniu (rosnący numer dodania)
+        self.__positions = {}
+        self.__next_position = 0
+        # Żądający tokena: posortowana lista (pozycja, id)
+        self.__requesters = []
+        # received_from_id -> {id klienta: None} (uporządkowany zbiór)
+        self.__children = {}
         # Domyślnie sami posiadamy; jeśli się do kogoś podłączymy - tracimy
         self.token_owner = own_id
         self.locked = False
 
+    @property
+    def clients(self):
+        """ Lista klientów w kolejności pierścienia
+        """
+        return list(self.__by_id.values())
+
+    def __len__(self):
+        return len(self.__by_id)
+
+    def __iter__(self):
+        return iter(self.__by_id.values())
+
     def add(self, client_id: str, received_from_id=None):
-        if not self.__find_client(client_id):
-            self.clients.append(Client(client_id, received_from_id))
+        if client_id in self.__by_id:
+            return
+        self.__by_id[client_id] = Client(client_id, received_from_id, self.__on_client_changed)
+        # Na koniec pierścienia
+        self.__positions[client_id] = self.__next_position
+        self.__next_position += 1
+        self.__children.setdefault(received_from_id, {})[client_id] = None
 
     def remove(self, client_id: str):
         """ Usuwa klienta oraz wszystkich klientów z jego podsieci
@@ -47,7 +81,7 @@ class ClientsTable:
         :return: lista identyfikatorów usuniętych klientów
         """
         removed_ids = []
-        c = self.__find_client(client_id)
+        c = self.__by_id.get(client_id)
         if not c:
             logger.error("Cannot remove client with id: %s - not present in list" % client_id)
             return removed_ids
@@ -56,10 +90,10 @@ class ClientsTable:
         removed_ids.append(client_id)
         logger.debug("Removed client: %s" % client_id)
         # Usuwamy wszystkich otrzymanych od niego
-        for child in filter(lambda ch: ch.received_from_id == client_id, self.clients):
-            self.__remove_client(child, own_id)
-            removed_ids.append(child.id)
-            logger.debug("Removed child %s received from %s" % (child.id, client_id))
+        for child_id in list(self.__children.get(client_id, ())):
+            self.__remove_client(self.__by_id[child_id], own_id)
+            removed_ids.append(child_id)
+            logger.debug("Removed child %s received from %s" % (child_id, client_id))
         return removed_ids
 
     def remove_remote(self, client_ids: [], detected_by: str):
@@ -69,9 +103,10 @@ class ClientsTable:
         :return: nic
         """
         for client_id in client_ids:
-            c = self.__find_client(client_id)
+            c = self.__by_id.get(client_id)
             if not c:
                 logger.error("Cannot remove client with id: %s - not present in list" % client_id)
+                continue
 
             # Usuwamy klienta
             self.__remove_client(c, detected_by)
@@ -84,11 +119,17 @@ class ClientsTable:
         :return: nic
         """
         # Usuwamy klienta
-        try:
-            self.clients.remove(client)
-        except ValueError:
+        if self.__by_id.pop(client.id, None) is None:
             logger.error("Cannot remove client: %s" % client.id)
             return
+        client.on_change = None
+        self.__set_requesting(client.id, False)
+        del self.__positions[client.id]
+        siblings = self.__children.get(client.received_from_id)
+        if siblings is not None:
+            siblings.pop(client.id, None)
+            if not siblings:
+                del self.__children[client.received_from_id]
 
         # Jeśli miał token, zostaje przejęty przez tego, kto wykrył
         if self.token_owner == client.id:
@@ -99,7 +140,7 @@ class ClientsTable:
         """ Pobiera identyfikatory obecnie istniejących klientów
         :return: lista łańcuchów znaków
         """
-        return list(map(lambda c: c.id, self.clients))
+        return list(self.__by_id)
 
     def update_with_id_list(self, client_ids: [], received_from_id: str):
         for client_id in client_ids:
@@ -107,14 +148,51 @@ class ClientsTable:
                 self.add(client_id, received_from_id)
 
     def find_self(self):
-        return self.__find_client(own_id)
+        return self.__by_id.get(own_id)
+
+    def __on_client_changed(self, client):
+        """ Aktualizuje indeks żądających tokena po zmianie R lub G klienta
+        :param client: obiekt klasy Client
+        """
+        self.__set_requesting(client.id, client.has_requested())
+
+    def __set_requesting(self, client_id: str, requesting: bool):
+        """ Dodaje klienta do indeksu żądających tokena lub go z niego usuwa
+        :param client_id: id klienta
+        :param requesting: czy klient żąda tokena
+        """
+        entry = (self.__positions[client_id], client_id)
+        requesters = self.__requesters
+        i = bisect_left(requesters, entry)
+        present = i < len(requesters) and requesters[i] == entry
+        if requesting and not present:
+            insort(requesters, entry)
+        elif not requesting and present:
+            del requesters[i]
+
+    def find_next_requester(self, client_id: str):
+        """ Znajduje pierwszego klienta na prawo od podanego (w pierścieniu), który żąda tokena (R > G)
+        :param client_id: id klienta, od którego zaczynamy
+        :return: obiekt klienta lub None
+        """
+        position = self.__positions.get(client_id)
+        if position is None or not self.__requesters:
+            return None
+        requesters = self.__requesters
+        # Pierwszy żądający za podanym klientem, a jeśli takiego nie ma - pierwszy od początku pierścienia
+        i = bisect_right(requesters, (position, client_id))
+        next_id = requesters[i][1] if i < len(requesters) else requesters[0][1]
+        if next_id == client_id:
+            # Żąda tylko sam podany klient
+            return None
+        return self.__by_id[next_id]
 
     def to_ricart(self):
-        return list(map(Client.get_rtr, self.clients))
+        return list(map(Client.get_rtr, self.__by_id.values()))
 
     def update_with_ricart(self, ricart_table: []):
         for rtr in ricart_table:
-            client = self.__find_client(rtr.id)
+            client = self.__by_id.get(rtr.id)
             if not client:
                 # Nie powinno się zdarzyć
                 logger.warn('Client with id %s from Ricart Table not present in clients table!' % rtr.id)
@@ -124,18 +202,37 @@ class ClientsTable:
             client.requested = rtr.r
 
     def __getitem__(self, client_id):
-        return self.__find_client(client_id)
-
-    def __find_client(self, client_id: str):
-        return next((c for c in self.clients if c.id == client_id), None)
+        return self.__by_id.get(client_id)
 
 
 class Client:
-    def __init__(self, client_id: str, received_from_id=None):
+    def __init__(self, client_id: str, received_from_id=None, on_change=None):
         self.id = client_id
-        self.granted = 0
-        self.requested = 0
+        self.__granted = 0
+        self.__requested = 0
         self.received_from_id = received_from_id
+        # Funkcja f(klient) wywoływana po zmianie R lub G (indeks żądających w ClientsTable)
+        self.on_change = on_change
+
+    @property
+    def granted(self):
+        return self.__granted
+
+    @granted.setter
+    def granted(self, value: int):
+        self.__granted = value
+        if self.on_change:
+            self.on_change(self)
+
+    @property
+    def requested(self):
+        return self.__requested
+
+    @requested.setter
+    def requested(self, value: int):
+        self.__requested = value
+        if self.on_change:
+            self.on_change(self)
 
     def get_rtr(self):
         return RicartTableRow(self.id, self.granted, self.requested)
@@ -152,6 +249,8 @@ class OwnershipManager:
         self.__clients = clients
         self.__clock = LogicalClock()
         self.__peer_pool = peer_pool
+        # Czas ostatniego żądania tablicy, na które nie dostaliśmy jeszcze tokena
+        self.__claimed_at = None
 
     def claim_ownership(self):
         """ Żąda przejęcia tablicy na własność
@@ -160,6 +259,7 @@ class OwnershipManager:
         :return: wynikowa lista klientów
         """
         has_token = self.__has_token()
+        self.__claimed_at = time.monotonic()
         if has_token:
             # Mamy token - przejmujemy i informujemy
             self.__clients.token_owner = own_id
@@ -262,14 +362,13 @@ class OwnershipManager:
         """ Znajduje klienta, któremu zostanie przekazany token
         :return: obiekt klienta
         """
-        # Iterujemy w prawo od siebie
-        own_idx = next((i for i, c in enumerate(self.__clients.clients) if c.id == own_id), None)
-        size = len(self.__clients.clients)
-        iterator = map(lambda i: self.__clients.clients[(i + own_idx) % size], range(1, size))
-        # Znajdujemy pierwszego klienta na prawo, dla którego R > G
-        return next(filter(lambda c: c.has_requested(), iterator), None)
+        # Znajdujemy pierwszego klienta na prawo od siebie, dla którego R > G
+        return self.__clients.find_next_requester(own_id)
 
     def __register_token_ownership(self):
+        if self.__claimed_at is not None:
+            _token_wait_time.observe(time.monotonic() - self.__claimed_at)
+            self.__claimed_at = None
         # Odpalamy timer, który po określonym czasie zrezygnuje z tokena
         Timer(config.token_ownership_max_time, self.__token_time_elapsed).start()
 
@@ -0,0 +1,189 @@
+""" Pula procesów do kosztownych operacji na obrazkach (kodowanie migawek, dekodowanie dużych ramek z obrazkiem)
+Operacje te wykonywane w wątkach trzymałyby GIL przez setki milisekund, wstrzymując obsługę komunikatów paint
+i pętlę Tk. Piksele i ramki przekazywane są do procesów przez pamięć współdzieloną (bez serializacji). Migawki
+kodowane są w wątku bufora migawek, który czeka na wynik bez trzymania GIL; dekodowanie ramek zwraca Future, więc
+wątek odbierający (lub pętla zdarzeń) nie czeka na nie wcale.
+Pamięć współdzielona wymaga Pythona 3.8 - w starszych wersjach pula jest wyłączona.
+"""
+import base64
+import io
+import json
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, Future
+from threading import Lock
+
+try:
+    from multiprocessing.shared_memory import SharedMemory
+except ImportError:
+    # Python < 3.8
+    SharedMemory = None
+
+from PIL import Image
+
+from sharedraw.config import config
+
+__author__ = 'michalek'
+logger = logging.getLogger(__name__)
+
+# Pola komunikatu JSON z obrazkiem (jak w sharedraw.networking.messages - moduł nie jest importowany w procesach
+# roboczych)
+_TYPE = 'type'
+_IMAGE = 'image'
+
+
+def _copy_to_shared_memory(data):
+    """ Kopiuje bajty do nowego bloku pamięci współdzielonej
+    :param data: bajty (lub obiekt z interfejsem bufora)
+    :return: SharedMemory
+    """
+    shm = SharedMemory(create=True, size=max(len(data), 1))
+    shm.buf[:len(data)] = data
+    return shm
+
+
+def _encode_image(name: str, mode: str, size: tuple, encoding: str):
+    """ Koduje obrazek z pamięci współdzielonej (w procesie roboczym)
+    Wynik (bajty, a za nimi bajty w base64) zapisywany jest w nowym bloku pamięci współdzielonej.
+    :return: (nazwa bloku z wynikiem, długość bajtów, długość base64)
+    """
+    from sharedraw.ui.snapshot import encoders
+    shm = SharedMemory(name=name)
+    try:
+        img = Image.frombytes(mode, size, bytes(shm.buf[:len(mode) * size[0] * size[1]]))
+    finally:
+        shm.close()
+    data = encoders[encoding](img)
+    data_b64 = base64.b64encode(data)
+    out = _copy_to_shared_memory(data + data_b64)
+    out.close()
+    return out.name, len(data), len(data_b64)
+
+
+def _decode_image_frame(name: str, length: int):
+    """ Dekoduje ramkę JSON z obrazkiem (w procesie roboczym): JSON, base64 oraz PNG.
+    Piksele zapisywane są w nowym bloku pamięci współdzielonej. Migawka kafelkowa nie jest dekodowana do pikseli
+    (jej rozmiar zależy od zarysowanej powierzchni, a pełny obrazek - od rozmiaru tablicy) - blok zawiera jej bajty.
+    :return: (pola komunikatu bez obrazka, nazwa bloku z pikselami RGB lub migawką, rozmiar obrazka lub
+     długość migawki) lub None, jeśli ramka nie zawiera obrazka
+    """
+    from sharedraw.ui.tiles import is_tiled
+    shm = SharedMemory(name=name)
+    try:
+        data = json.loads(bytes(shm.buf[:length]).decode('utf-8'))
+    finally:
+        shm.close()
+    if not isinstance(data, dict) or data.get(_TYPE) != _IMAGE or not data.get(_IMAGE):
+        return None
+    raw = base64.b64decode(data.pop(_IMAGE))
+    if is_tiled(raw):
+        out = _copy_to_shared_memory(raw)
+        out.close()
+        return data, out.name, len(raw)
+    img = Image.open(io.BytesIO(raw)).convert('RGB')
+    out = _copy_to_shared_memory(img.tobytes())
+    out.close()
+    return data, out.name, img.size
+
+
+class Offload:
+    """ Pula procesów roboczych
+    """
+
+    def __init__(self, workers: int):
+        # 'spawn' - proces z wątkami (i Tk) nie powinien być klonowany przez fork
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+    def encode_image(self, img: Image.Image, encoding: str):
+        """ Koduje obrazek w procesie roboczym (blokuje wywołującego, ale nie trzyma GIL)
+        :param img: obrazek PIL
+        :param encoding: kodowanie (sharedraw.ui.snapshot.encoders)
+        :return: (bajty, bajty w base64 jako str)
+        """
+        shm = _copy_to_shared_memory(img.tobytes())
+        try:
+            name, length, length_b64 = self.executor.submit(_encode_image, shm.name, img.mode, img.size,
+                                                            encoding).result()
+        finally:
+            shm.close()
+            shm.unlink()
+        out = SharedMemory(name=name)
+        try:
+            return bytes(out.buf[:length]), str(out.buf[length:length + length_b64], encoding='ascii')
+        finally:
+            out.close()
+            out.unlink()
+
+    def decode_image_frame(self, frame: bytes):
+        """ Zleca dekodowanie ramki JSON z obrazkiem procesowi roboczemu (bez czekania na wynik)
+        :param frame: ramka
+        :return: Future z wynikiem: (pola komunikatu bez obrazka, obrazek PIL lub bajty migawki kafelkowej) lub None,
+         jeśli ramka nie zawiera obrazka
+        """
+        shm = _copy_to_shared_memory(frame)
+        result = Future()
+
+        def done(future: Future):
+            shm.close()
+            shm.unlink()
+            try:
+                result.set_result(self.__read_decoded(future.result()))
+            except Exception as e:
+                result.set_exception(e)
+
+        try:
+            self.executor.submit(_decode_image_frame, shm.name, len(frame)).add_done_callback(done)
+        except Exception:
+            shm.close()
+            shm.unlink()
+            raise
+        return result
+
+    @staticmethod
+    def __read_decoded(result):
+        """ Odczytuje wynik dekodowania z pamięci współdzielonej
+        :param result: wynik _decode_image_frame
+        :return: (pola komunikatu bez obrazka, obrazek PIL lub bajty migawki kafelkowej) lub None
+        """
+        if result is None:
+            return None
+        data, name, size = result
+        out = SharedMemory(name=name)
+        try:
+            if isinstance(size, int):
+                return data, bytes(out.buf[:size])
+            img = Image.frombytes('RGB', size, bytes(out.buf[:3 * size[0] * size[1]]))
+        finally:
+            out.close()
+            out.unlink()
+        return data, img
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+_offload = None
+_offload_lock = Lock()
+
+
+def get_offload():
+    """ Zwraca pulę procesów (tworzoną przy pierwszym użyciu) lub None, jeśli jest wyłączona w konfiguracji
+    (lub niedostępna - Python < 3.8)
+    """
+    global _offload
+    if not config.offload_workers or SharedMemory is None:
+        return None
+    with _offload_lock:
+        if _offload is None:
+            _offload = Offload(config.offload_workers)
+        return _offload
+
+
+def shutdown_offload():
+    """ Zatrzymuje pulę procesów, jeśli była używana
+    """
+    global _offload
+    with _offload_lock:
+        if _offload is not None:
+            _offload.shutdown()
+            _offload = None
@@ -2,23 +2,156 @@
 """
 from datetime import datetime
 
-from getopt import getopt
+from getopt import getopt, GetoptError
+import os
 import random
 import string
 import sys
 
+# Dopuszczalne wartości opcji wybierających tryb pracy
+NETWORK_MODES = ('threads', 'selector', 'asyncio')
+SLOW_CONSUMER_POLICIES = ('drop', 'merge', 'disconnect')
+RENDER_MODES = ('framebuffer', 'items')
+
+USAGE = """Usage: %s [-p port] [-n threads|selector|asyncio] [-B WIDTHxHEIGHT] [-J] [-T] [-R]
+    [-s drop|merge|disconnect] [-l ms] [-b bytes] [-t px] [-r framebuffer|items] [-H] [-j dir] [-m port]
+    [-M seconds] [-c file] [-w workers]"""
+
 
 class Config:
     port = 5555
+    # Rozmiar tablicy [px] (klienty w innych językach mają tablicę 640x480) i bok kafelka obrazka, przydzielanego
+    # dopiero przy pierwszym narysowaniu (wielokrotność boku kafelka migawek - 64)
+    board_width = 640
+    board_height = 480
+    canvas_tile_size = 256
+    # Odstęp pomiędzy komunikatami keepAlive [s]
     keep_alive_interval = 2
+    # Wykrywanie awarii peerów (phi accrual): próg poziomu podejrzenia i dopuszczalna dodatkowa przerwa
+    # pomiędzy komunikatami keepAlive [s]
+    phi_threshold = 8
+    heartbeat_acceptable_pause = 1
     token_ownership_max_time = 10
-    line_max_length = 30
+    # Grupowanie punktów rysowanej linii: maksymalne opóźnienie [ms] i rozmiar komunikatu [B] (nominalny - w JSON-ie,
+    # przed uproszczeniem linii; zmiana w trakcie działania: POST /ui.batching na serwerze metryk)
+    paint_latency_budget_ms = 40
+    paint_byte_budget = 1024
+    # Upraszczanie rysowanej linii przed wysłaniem: maksymalne odchylenie [px] (None - wyłączone, 0 - tylko usuwanie
+    # powtórzonych punktów) i długość fragmentu linii, od której odległości liczone są przez numpy (jeśli jest
+    # zainstalowany)
+    stroke_tolerance = None
+    stroke_numpy_min_points = 64
+    # Maksymalny czas blokującego oczekiwania na gnieździe [s]
+    socket_wait_timeout = 1
+    # Tryb obsługi sieci: 'threads' - wątek na peera, 'selector' - jedna pętla zdarzeń, 'asyncio' - pętla asyncio
+    network_mode = 'threads'
+    # Maksymalna liczba połączeń oczekujących na przyjęcie
+    listen_backlog = 16
+    # Negocjowanie binarnego formatu komunikatów z innymi klientami w Pythonie
+    binary_protocol = True
+    # Negocjowanie migawek obrazka w postaci dwupoziomowych kafelków (zamiast PNG) z innymi klientami w Pythonie
+    tiled_snapshots = True
+    # Wznawianie sesji z innymi klientami w Pythonie po krótkim zerwaniu połączenia: czas oczekiwania na ponowne
+    # połączenie [s] i liczba ostatnio wysłanych bajtów zapamiętywanych dla każdego peera
+    session_resumption = True
+    resume_grace_period = 10
+    resume_buffer_size = 1024 * 1024
+    # Kolejki wychodzące peerów: progi [B] oraz polityka wolnego odbiorcy ('drop', 'merge', 'disconnect')
+    send_queue_high_watermark = 1024 * 1024
+    send_queue_low_watermark = 256 * 1024
+    send_queue_max_size = 16 * 1024 * 1024
+    slow_consumer_policy = 'merge'
+    # Liczba procesów kodujących migawki i dekodujących duże ramki z obrazkiem (0 - w wątkach bieżącego procesu)
+    # oraz rozmiar ramki [B], od którego jest ona dekodowana w osobnym procesie
+    offload_workers = 1
+    offload_min_frame_size = 256 * 1024
+    # Maksymalna liczba komunikatów pobieranych przez kontroler z kolejki za jednym razem
+    controller_batch_size = 256
+    # Maksymalna liczba odświeżeń listy klientów w UI na sekundę
+    clients_refresh_rate = 5
+    # Sposób rysowania: 'framebuffer' - jeden obrazek odświeżany co najwyżej render_fps razy na sekundę,
+    # 'items' - każdy odcinek jako osobny element płótna Tk
+    render_mode = 'framebuffer'
+    # Praca bez okna (np. klient pośredniczący na serwerze) - obrazek trzymany tylko w pamięci
+    headless = False
+    render_fps = 30
+    # Dziennik zmian obrazka (odtwarzanie po restarcie): katalog (None - wyłączony), maksymalny czas pomiędzy
+    # zapisami na dysk [s], liczba rekordów pomiędzy punktami kontrolnymi, przyrost pliku [B]
+    journal_dir = None
+    journal_sync_interval = 1
+    journal_checkpoint_records = 10000
+    journal_segment_size = 4 * 1024 * 1024
+    # Metryki: port lokalnego serwera HTTP (None - wyłączony) i odstęp zapisu do logu [s] (None - wyłączony)
+    metrics_port = None
+    metrics_dump_interval = None
+    # Plik, do którego zapisywany jest cały ruch sieciowy (None - wyłączony)
+    capture_file = None
 
     def load(self):
-        opts, args = getopt(sys.argv[1:], "p:")
+        """ Wczytuje konfigurację z argumentów wiersza poleceń; przy niepoprawnych argumentach wypisuje sposób
+        użycia i kończy program
+        """
+        try:
+            self.__parse(sys.argv[1:])
+        except (GetoptError, ValueError) as e:
+            print("%s\n%s" % (e, USAGE % os.path.basename(sys.argv[0])), file=sys.stderr)
+            sys.exit(2)
+
+    def __parse(self, argv: []):
+        """ Ustawia konfigurację zgodnie z opcjami
+        :param argv: argumenty wiersza poleceń
+        :raise GetoptError: nieznana opcja lub brak wartości
+        :raise ValueError: niepoprawna wartość opcji
+        """
+        opts, args = getopt(argv, "p:n:B:JTRs:l:b:t:r:Hj:m:M:c:w:")
         for opt, arg in opts:
             if opt == "-p":
                 self.port = int(arg)
+            elif opt == "-n":
+                self.network_mode = _choice(opt, arg, NETWORK_MODES)
+            elif opt == "-B":
+                self.board_width, self.board_height = map(int, arg.lower().split('x'))
+            elif opt == "-J":
+                self.binary_protocol = False
+            elif opt == "-T":
+                self.tiled_snapshots = False
+            elif opt == "-R":
+                self.session_resumption = False
+            elif opt == "-s":
+                self.slow_consumer_policy = _choice(opt, arg, SLOW_CONSUMER_POLICIES)
+            elif opt == "-l":
+                self.paint_latency_budget_ms = int(arg)
+            elif opt == "-b":
+                self.paint_byte_budget = int(arg)
+            elif opt == "-t":
+                self.stroke_tolerance = float(arg)
+            elif opt == "-r":
+                self.render_mode = _choice(opt, arg, RENDER_MODES)
+            elif opt == "-H":
+                self.headless = True
+            elif opt == "-j":
+                self.journal_dir = arg
+            elif opt == "-m":
+                self.metrics_port = int(arg)
+            elif opt == "-M":
+                self.metrics_dump_interval = float(arg)
+            elif opt == "-c":
+                self.capture_file = arg
+            elif opt == "-w":
+                self.offload_workers = int(arg)
+
+
+def _choice(opt: str, arg: str, allowed: ()):
+    """ Sprawdza, czy wartość opcji należy do dopuszczalnych
+    :param opt: opcja
+    :param arg: wartość
+    :param allowed: dopuszczalne wartości
+    :return: wartość
+    :raise ValueError: wartość niedopuszczalna
+    """
+    if arg not in allowed:
+        raise ValueError("Invalid value of %s: %s (allowed: %s)" % (opt, arg, ', '.join(allowed)))
+    return arg
 
 
 config = Config()
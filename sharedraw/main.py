@@ -1,5 +1,9 @@
+import signal
+
+from sharedraw.concurrent.offload import shutdown_offload
 from sharedraw.config import config
 from sharedraw.cntrl.cntrl import *
+from sharedraw.metrics import start_reporting
 
 __author__ = 'Michał Toporowski'
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s %(name)s %(levelname)s %(message)s')
@@ -7,14 +11,32 @@ logging.basicConfig(level=logging.DEBUG, format='%(asctime)s %(name)s %(levelnam
 
 def main():
     config.load()
+    return run()
+
+
+def run():
+    """ Uruchamia klienta zgodnie z konfiguracją i czeka na zakończenie jego pracy
+    """
     stop_event = Event()
+    if config.headless:
+        # Klient bez UI zatrzymywany jest także sygnałem SIGTERM (np. przez menedżer usług)
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
     cntrl = Controller(stop_event, config.port)
+    cntrl.recover()
     cntrl.start()
     cntrl.peer_pool.start()
     cntrl.status_monitor.start()
+    metrics_server = start_reporting(stop_event)
     cntrl.sd_ui.start()
     stop_event.set()
+    if metrics_server:
+        metrics_server.stop()
     cntrl.peer_pool.stop()
+    if cntrl.journal:
+        cntrl.journal.close()
+    if cntrl.peer_pool.capture:
+        cntrl.peer_pool.capture.close()
+    shutdown_offload()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,256 @@
+""" Liczniki i histogramy opisujące pracę klienta (ruch sieciowy, kolejka kontrolera, kodowanie, rysowanie, token)
+Metryki są zawsze zbierane - aktualizacja to kilka operacji na liczbach, bez blokad (przy jednoczesnych
+aktualizacjach z wielu wątków pojedyncze zliczenia mogą zostać zgubione, co dla statystyk nie ma znaczenia).
+Odczyt: lokalny serwer HTTP (config.metrics_port, zwraca JSON) lub okresowy zapis do logu
+(config.metrics_dump_interval). Serwer HTTP pozwala też zmieniać zarejestrowane parametry w trakcie działania
+(żądanie POST /nazwa?parametr=wartość).
+"""
+import json
+import logging
+import sys
+from bisect import bisect_left
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from threading import Thread, Event
+from urllib.parse import urlsplit, parse_qsl
+
+from sharedraw.concurrent.threading import TimerThread
+from sharedraw.config import config
+
+__author__ = 'michalek'
+logger = logging.getLogger(__name__)
+
+
+class Counter:
+    """ Licznik
+    """
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, n=1):
+        self.value += n
+
+    def snapshot(self):
+        return self.value
+
+
+class Histogram:
+    """ Histogram o wykładniczo rosnących przedziałach - pozwala szacować percentyle przy stałym koszcie pamięci
+    """
+
+    def __init__(self, start=1e-6, factor=2, size=27):
+        """
+        :param start: górna granica pierwszego przedziału (domyślnie 1 µs - dla czasów w sekundach)
+        :param factor: stosunek granic kolejnych przedziałów
+        :param size: liczba przedziałów (ostatni jest nieograniczony z góry)
+        """
+        self.bounds = [start * factor ** i for i in range(size - 1)]
+        self.buckets = [0] * size
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def observe(self, value):
+        self.buckets[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, p: float):
+        """ Szacuje percentyl (górna granica przedziału, w którym się znajduje)
+        :param p: percentyl (0-100)
+        :return: wartość lub None, jeśli histogram jest pusty
+        """
+        if not self.count:
+            return None
+        rank = p / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= rank:
+                return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'mean': self.sum / self.count if self.count else None,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'max': self.max
+        }
+
+
+def count_histogram():
+    """ Tworzy histogram dla wartości całkowitych (np. długości kolejki): 1, 2, 4, ... 65536
+    """
+    return Histogram(1, 2, 18)
+
+
+class Metrics:
+    """ Rejestr metryk
+    Metryki identyfikowane są nazwą i opcjonalną etykietą (np. typem komunikatu lub id klienta). Obiekty metryk
+    warto pobrać raz (np. na poziomie modułu) - aktualizacja nie wymaga wtedy wyszukiwania w słowniku.
+    """
+
+    def __init__(self):
+        # (nazwa, etykieta) -> metryka
+        self.__metrics = {}
+        # Nazwa -> funkcja zwracająca aktualne wartości (np. statystyki kolejek), wywoływana przy odczycie
+        self.__sources = {}
+        # Nazwa -> funkcja zmieniająca parametry programu, wywoływana przez żądanie POST
+        self.__controls = {}
+
+    def counter(self, name: str, label=None):
+        """ Zwraca licznik (tworzy go, jeśli nie istnieje)
+        :param name: nazwa
+        :param label: etykieta
+        :return: Counter
+        """
+        metric = self.__metrics.get((name, label))
+        if metric is None:
+            metric = self.__metrics.setdefault((name, label), Counter())
+        return metric
+
+    def histogram(self, name: str, label=None, factory=Histogram):
+        """ Zwraca histogram (tworzy go, jeśli nie istnieje)
+        :param name: nazwa
+        :param label: etykieta
+        :param factory: funkcja tworząca histogram (domyślnie - dla czasów w sekundach)
+        :return: Histogram
+        """
+        metric = self.__metrics.get((name, label))
+        if metric is None:
+            metric = self.__metrics.setdefault((name, label), factory())
+        return metric
+
+    def register_source(self, name: str, source):
+        """ Rejestruje funkcję dostarczającą wartości w chwili odczytu
+        :param name: nazwa
+        :param source: funkcja bez argumentów zwracająca wartość serializowalną do JSON-a
+        """
+        self.__sources[name] = source
+
+    def register_control(self, name: str, control):
+        """ Rejestruje funkcję zmieniającą parametry programu w trakcie działania
+        :param name: nazwa
+        :param control: funkcja przyjmująca parametry nazwane (wartości jako napisy), zwracająca wartość
+        serializowalną do JSON-a; niepoprawne wartości sygnalizuje wyjątkiem ValueError
+        """
+        self.__controls[name] = control
+
+    def control(self, name: str, params: dict):
+        """ Wywołuje zarejestrowaną funkcję zmieniającą parametry
+        :param name: nazwa
+        :param params: parametry (nazwa -> napis)
+        :return: wynik funkcji
+        :raise KeyError: brak funkcji o podanej nazwie
+        :raise ValueError: niepoprawne parametry
+        """
+        control = self.__controls[name]
+        try:
+            return control(**params)
+        except TypeError as e:
+            raise ValueError(str(e))
+
+    def snapshot(self):
+        """ Zwraca bieżące wartości wszystkich metryk
+        :return: słownik: nazwa -> wartość lub (dla metryk z etykietami) słownik: etykieta -> wartość
+        """
+        result = {}
+        for (name, label), metric in list(self.__metrics.items()):
+            if label is None:
+                result[name] = metric.snapshot()
+            else:
+                result.setdefault(name, {})[str(label)] = metric.snapshot()
+        for name, source in list(self.__sources.items()):
+            try:
+                result[name] = source()
+            except Exception:
+                logger.error("Cannot read metrics source %s: %s" % (name, str(sys.exc_info())))
+        return result
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), sort_keys=True)
+
+
+metrics = Metrics()
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """ Zwraca metryki w postaci JSON-a na każde żądanie GET, a na żądanie POST /nazwa?parametr=wartość wywołuje
+    zarejestrowaną funkcję zmieniającą parametry i zwraca jej wynik
+    """
+
+    def do_GET(self):
+        self.__reply(200, metrics.to_json())
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        try:
+            result = metrics.control(url.path.strip('/'), dict(parse_qsl(url.query)))
+        except KeyError:
+            self.__reply(404, json.dumps({'error': 'unknown control: %s' % url.path}))
+            return
+        except ValueError as e:
+            self.__reply(400, json.dumps({'error': str(e)}))
+            return
+        logger.info("Control %s: %s" % (url.path, url.query))
+        self.__reply(200, json.dumps(result, sort_keys=True))
+
+    def __reply(self, status: int, body: str):
+        data = bytes(body, encoding='utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logger.debug("Metrics request: %s" % (format % args))
+
+
+class MetricsServer(Thread):
+    """ Lokalny serwer HTTP udostępniający metryki (tylko na 127.0.0.1)
+    """
+
+    def __init__(self, port: int):
+        super().__init__()
+        self.setDaemon(True)
+        self.server = HTTPServer(('127.0.0.1', port), MetricsRequestHandler)
+
+    def run(self):
+        logger.info("Serving metrics on http://127.0.0.1:%s/" % self.server.server_port)
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class MetricsDumper(TimerThread):
+    """ Wątek okresowo zapisujący metryki do logu
+    """
+
+    def __init__(self, stopped: Event, interval: float):
+        super().__init__(stopped, interval)
+        self.setDaemon(True)
+
+    def execute(self):
+        logger.info("Metrics: %s" % metrics.to_json())
+
+
+def start_reporting(stop_event: Event):
+    """ Uruchamia udostępnianie metryk włączone w konfiguracji
+    :param stop_event: zdarzenie zakończenia programu
+    :return: serwer HTTP lub None
+    """
+    server = None
+    if config.metrics_port:
+        server = MetricsServer(config.metrics_port)
+        server.start()
+    if config.metrics_dump_interval:
+        MetricsDumper(stop_event, config.metrics_dump_interval).start()
+    return server
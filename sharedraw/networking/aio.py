@@ -0,0 +1,153 @@
+""" Obsługa sieci oparta na asyncio
+Wszystkie połączenia obsługiwane są przez jedną pętlę asyncio działającą w wątku puli.
+Wysyłanie odbywa się przez kolejkę wychodzącą peera i writer.drain(), dzięki czemu wolny klient nie blokuje wywołującego.
+"""
+import asyncio
+from queue import Queue
+from threading import Event
+
+from sharedraw.networking.binary import frame_repr
+from sharedraw.networking.messages import *
+from sharedraw.networking.networking import Peer, PeerPool
+
+__author__ = 'michalek'
+logger = logging.getLogger(__name__)
+
+
+class AsyncPeer(Peer):
+    """ Peer obsługiwany przez pętlę asyncio - nie posiada własnego wątku
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, loop: asyncio.AbstractEventLoop,
+                 stop_event: Event, queue_to_ui: Queue):
+        super().__init__(writer.get_extra_info('socket'), stop_event, queue_to_ui)
+        self.reader = reader
+        self.writer = writer
+        self.loop = loop
+        # Ustawiane (w pętli), gdy w kolejce wychodzącej pojawią się dane
+        self.ready = asyncio.Event()
+        self.outbound.notify = lambda: self.loop.call_soon_threadsafe(self.ready.set)
+
+    def call_when_done(self, future, callback):
+        """ Wynik dekodowania w tle obsługiwany jest w pętli - jak pozostałe komunikaty peera
+        """
+        asyncio.wrap_future(future, loop=self.loop).add_done_callback(callback)
+
+    async def write_loop(self):
+        """ Wysyła dane z kolejki wychodzącej, czekając na opróżnienie bufora gniazda (backpressure)
+        """
+        try:
+            while self.enabled:
+                data = self.outbound.pop()
+                if data is None:
+                    if self.outbound.closed:
+                        break
+                    self.ready.clear()
+                    await self.ready.wait()
+                    continue
+                self.writer.write(data)
+                await self.writer.drain()
+                logger.info("Packet sent: %s" % frame_repr(data))
+        except OSError:
+            logger.warn("Connection error: %s" % str(sys.exc_info()))
+            self.enabled = False
+
+    async def read_loop(self):
+        """ Odczytuje dane z połączenia i przekazuje komunikaty do kontrolera
+        """
+        try:
+            while self.enabled and not self.stop_event.is_set():
+                msg = await self.reader.read(65536)
+                if len(msg) == 0:
+                    logger.info('Data not available - assuming, that connection is closed')
+                    break
+                self.handle_data(msg)
+        except OSError:
+            logger.warn("Connection error: %s" % str(sys.exc_info()))
+        self.enabled = False
+        # Budzimy writera, żeby się zakończył
+        self.outbound.close()
+
+    async def serve(self):
+        """ Obsługuje połączenie aż do jego zamknięcia
+        """
+        writer_task = self.loop.create_task(self.write_loop())
+        self.send_join()
+        await self.read_loop()
+        await writer_task
+        self.writer.close()
+
+
+class AsyncPeerPool(PeerPool):
+    """ Pula peerów obsługiwana przez pętlę asyncio
+    """
+
+    def __init__(self, port: int, stop_event: Event, queue_to_ui: Queue):
+        super().__init__(port, stop_event, queue_to_ui)
+        self.loop = asyncio.new_event_loop()
+        self.__stopped = None
+        self.__tasks = set()
+
+    def run(self):
+        """
+        Wątek pętli asyncio - uruchamia serwer i obsługuje wszystkie połączenia
+        """
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self.__serve())
+        self.loop.close()
+
+    async def __serve(self):
+        self.__stopped = asyncio.Event()
+        sock = self.open_server_socket()
+        server = await asyncio.start_server(self.__on_connection, sock=sock)
+        await self.__stopped.wait()
+        server.close()
+        await server.wait_closed()
+        for peer in self.peers:
+            peer.writer.close()
+        if self.__tasks:
+            await asyncio.wait(self.__tasks)
+
+    def __on_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        peer = AsyncPeer(reader, writer, self.loop, self.stop_event, self.queue_to_ui)
+        peer.is_incoming = True
+        self.__add_peer(peer)
+
+    async def __connect(self, ip, port: int, resuming=None):
+        connecting = asyncio.open_connection(ip, port)
+        if resuming:
+            connecting = asyncio.wait_for(connecting, config.socket_wait_timeout)
+        reader, writer = await connecting
+        peer = AsyncPeer(reader, writer, self.loop, self.stop_event, self.queue_to_ui)
+        peer.resuming = resuming
+        self.__add_peer(peer)
+        return peer
+
+    def __add_peer(self, peer: AsyncPeer):
+        peer.resume_handler = self.resume
+        peer.capture = self.capture
+        self.peers.append(peer)
+        task = self.loop.create_task(peer.serve())
+        self.__tasks.add(task)
+        task.add_done_callback(self.__tasks.discard)
+
+    def connect_to(self, ip, port: int, resuming=None):
+        """ Nawiązuje połączenie z innym klientem (wywoływane spoza pętli)
+
+        :param ip: ip (string)
+        :param port: port (int)
+        :param resuming: peer, którego sesję wznawiamy (None - nowe połączenie)
+        :return: peer
+        """
+        try:
+            return asyncio.run_coroutine_threadsafe(self.__connect(ip, port, resuming), self.loop).result()
+        except asyncio.TimeoutError:
+            raise OSError("Connection to %s:%s timed out" % (ip, port))
+
+    def stop(self):
+        """
+        Zatrzymuje serwer i klientów
+        """
+        self.running = False
+        if self.__stopped:
+            self.loop.call_soon_threadsafe(self.__stopped.set)
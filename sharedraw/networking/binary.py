@@ -0,0 +1,317 @@
+""" Zwarty binarny format komunikatów, używany wyłącznie pomiędzy klientami w Pythonie
+Format jest negocjowany podczas dołączania (pole "capabilities" w komunikatach joined/image). Klienty napisane
+w innych językach zawsze otrzymują JSON.
+
+Ramka: MAGIC | długość treści (varint) | treść
+Treść: typ komunikatu (1 bajt) | pola zależne od typu
+Liczby całkowite zapisywane są jako varinty ze znakiem (zigzag), łańcuchy jako długość (varint) + UTF-8.
+Punkty w komunikacie paint kodowane są różnicowo względem poprzedniego punktu.
+"""
+import re
+import time
+from concurrent.futures import Future
+
+from sharedraw.concurrent.offload import get_offload
+from sharedraw.metrics import metrics
+from sharedraw.networking.messages import *
+
+__author__ = 'michalek'
+logger = logging.getLogger(__name__)
+
+# Bajt rozpoczynający ramkę binarną - nie może rozpoczynać komunikatu JSON
+MAGIC = 0xB5
+WIRE_JSON = 'json'
+WIRE_BINARY = 'binary'
+
+_PAINT, _CLEAN, _REQUEST, _RESIGN, _PASS_TOKEN, _QUIT = range(1, 7)
+
+# Czasy kodowania i dekodowania ramek [s]
+_encode_time = {fmt: metrics.histogram('codec.encode_time', fmt) for fmt in (WIRE_JSON, WIRE_BINARY)}
+_decode_time = {fmt: metrics.histogram('codec.decode_time', fmt) for fmt in (WIRE_JSON, WIRE_BINARY)}
+
+# Pole typu komunikatu z obrazkiem w ramce JSON (dane obrazka w base64 nie zawierają cudzysłowów)
+_IMAGE_TYPE_FIELD = re.compile(rb'"type"\s*:\s*"image"')
+
+
+def _put_uint(out: bytearray, value: int):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _put_int(out: bytearray, value: int):
+    _put_uint(out, (value << 1) if value >= 0 else ((-value << 1) - 1))
+
+
+def _put_str(out: bytearray, value: str):
+    data = value.encode('utf-8')
+    _put_uint(out, len(data))
+    out += data
+
+
+def read_uint(data, pos: int):
+    """ Odczytuje varint bez znaku
+    :param data: bajty
+    :param pos: pozycja początkowa
+    :return: (wartość, pozycja za varintem)
+    """
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _read_int(data, pos: int):
+    value, pos = read_uint(data, pos)
+    return (value >> 1) ^ -(value & 1), pos
+
+
+def _read_str(data, pos: int):
+    length, pos = read_uint(data, pos)
+    end = pos + length
+    return str(data[pos:end], encoding='utf-8'), end
+
+
+def _encode_paint(msg: PaintMessage, out: bytearray):
+    out.append(1 if msg.color == 'white' else 0)
+    _put_str(out, msg.client_id)
+    _put_uint(out, len(msg.changed_pxs))
+    prevx = prevy = 0
+    for x, y in msg.changed_pxs:
+        _put_int(out, x - prevx)
+        _put_int(out, y - prevy)
+        prevx, prevy = x, y
+
+
+def _decode_paint(data, pos: int):
+    color = 'white' if data[pos] else 'black'
+    client_id, pos = _read_str(data, pos + 1)
+    count, pos = read_uint(data, pos)
+    changed_pxs = []
+    x = y = 0
+    for _ in range(count):
+        dx, pos = _read_int(data, pos)
+        dy, pos = _read_int(data, pos)
+        x += dx
+        y += dy
+        changed_pxs.append((x, y))
+    return PaintMessage(changed_pxs, color, client_id)
+
+
+def _encode_client_id(msg, out: bytearray):
+    _put_str(out, msg.client_id)
+
+
+def _encode_request(msg: RequestTableMessage, out: bytearray):
+    _put_str(out, msg.client_id)
+    _put_int(out, msg.logical_time)
+
+
+def _decode_request(data, pos: int):
+    client_id, pos = _read_str(data, pos)
+    logical_time, pos = _read_int(data, pos)
+    return RequestTableMessage(client_id, logical_time)
+
+
+def _encode_pass_token(msg: PassTokenMessage, out: bytearray):
+    _put_str(out, msg.dest_client_id)
+    _put_uint(out, len(msg.ricart_table))
+    for rtr in msg.ricart_table:
+        _put_str(out, rtr.id)
+        _put_int(out, rtr.g)
+        _put_int(out, rtr.r)
+
+
+def _decode_pass_token(data, pos: int):
+    dest_client_id, pos = _read_str(data, pos)
+    count, pos = read_uint(data, pos)
+    rt = []
+    for _ in range(count):
+        client_id, pos = _read_str(data, pos)
+        g, pos = _read_int(data, pos)
+        r, pos = _read_int(data, pos)
+        rt.append(RicartTableRow(client_id, g, r))
+    return PassTokenMessage(dest_client_id, rt)
+
+
+def _encode_quit(msg: QuitMessage, out: bytearray):
+    _put_str(out, msg.detected_by)
+    _put_uint(out, len(msg.client_ids))
+    for client_id in msg.client_ids:
+        _put_str(out, client_id)
+
+
+def _decode_quit(data, pos: int):
+    detected_by, pos = _read_str(data, pos)
+    count, pos = read_uint(data, pos)
+    client_ids = []
+    for _ in range(count):
+        client_id, pos = _read_str(data, pos)
+        client_ids.append(client_id)
+    return QuitMessage(client_ids, detected_by)
+
+
+# Typ komunikatu -> (kod, funkcja kodująca)
+_encoders = {
+    PaintMessage: (_PAINT, _encode_paint),
+    CleanMessage: (_CLEAN, _encode_client_id),
+    RequestTableMessage: (_REQUEST, _encode_request),
+    ResignMessage: (_RESIGN, _encode_client_id),
+    PassTokenMessage: (_PASS_TOKEN, _encode_pass_token),
+    QuitMessage: (_QUIT, _encode_quit)
+}
+
+# Kod -> funkcja dekodująca f(dane, pozycja)
+_decoders = {
+    _PAINT: _decode_paint,
+    _CLEAN: lambda data, pos: CleanMessage(_read_str(data, pos)[0]),
+    _REQUEST: _decode_request,
+    _RESIGN: lambda data, pos: ResignMessage(_read_str(data, pos)[0]),
+    _PASS_TOKEN: _decode_pass_token,
+    _QUIT: _decode_quit
+}
+
+
+def to_binary(msg: Message):
+    """ Koduje komunikat do ramki binarnej
+    :param msg: komunikat
+    :return: ramka jako bajty lub None, jeśli komunikat nie ma postaci binarnej (joined, image)
+    """
+    encoder = _encoders.get(type(msg))
+    if not encoder:
+        return None
+    code, encode = encoder
+    payload = bytearray((code,))
+    encode(msg, payload)
+    frame = bytearray((MAGIC,))
+    _put_uint(frame, len(payload))
+    frame += payload
+    return bytes(frame)
+
+
+def from_binary(frame: bytes):
+    """ Dekoduje ramkę binarną
+    :param frame: pełna ramka (razem z nagłówkiem)
+    :return: komunikat lub None w przypadku błędu
+    """
+    try:
+        length, pos = read_uint(frame, 1)
+        decode = _decoders.get(frame[pos])
+        if not decode:
+            logger.error("Nieznany typ komunikatu binarnego: %s" % frame[pos])
+            return None
+        return decode(frame, pos + 1)
+    except (IndexError, UnicodeDecodeError):
+        logger.error("Cannot decode binary frame: %s, error: %s" % (frame, sys.exc_info()))
+        return None
+
+
+def to_wire(msg: Message, wire_format: str):
+    """ Koduje komunikat w formacie wynegocjowanym z danym klientem
+    :param msg: komunikat
+    :param wire_format: WIRE_JSON lub WIRE_BINARY
+    :return: bajty do wysłania
+    """
+    start = time.perf_counter()
+    if wire_format == WIRE_BINARY:
+        frame = to_binary(msg)
+        if frame is not None:
+            _encode_time[WIRE_BINARY].observe(time.perf_counter() - start)
+            return frame
+    frame = msg.to_bytes()
+    _encode_time[WIRE_JSON].observe(time.perf_counter() - start)
+    return frame
+
+
+def from_wire(frame: bytes):
+    """ Dekoduje ramkę w dowolnym formacie (JSON lub binarnym)
+    :param frame: pełna ramka
+    :return: komunikat lub None
+    """
+    start = time.perf_counter()
+    if frame[0] == MAGIC:
+        msg = from_binary(frame)
+        _decode_time[WIRE_BINARY].observe(time.perf_counter() - start)
+        return msg
+    # Komunikaty paint (większość ruchu) dekodowane są wyspecjalizowanym kodekiem
+    msg = PaintMessage.from_frame(frame)
+    if msg is None:
+        msg = from_json(frame.decode("utf-8"))
+    _decode_time[WIRE_JSON].observe(time.perf_counter() - start)
+    return msg
+
+
+def from_wire_in_background(frame: bytes):
+    """ Zleca dekodowanie dużej ramki JSON z obrazkiem procesowi roboczemu (bez trzymania GIL przez wątek odbierający
+    i bez czekania na wynik)
+    :param frame: pełna ramka
+    :return: Future z ImageMessage (z obrazkiem zdekodowanym do pikseli lub z bajtami migawki kafelkowej) albo z None,
+     jeśli ramkę trzeba zdekodować na miejscu (from_wire); None, jeśli ramka nie jest dekodowana w tle
+    """
+    if frame[0] == MAGIC or len(frame) < config.offload_min_frame_size or not _IMAGE_TYPE_FIELD.search(frame):
+        return None
+    offload = get_offload()
+    if offload is None:
+        return None
+    try:
+        decoding = offload.decode_image_frame(frame)
+    except Exception:
+        logger.warn("Cannot decode frame in worker process, decoding in place: %s" % str(sys.exc_info()))
+        return None
+    result = Future()
+    decoding.add_done_callback(lambda f: result.set_result(_image_from_decoded(f)))
+    return result
+
+
+def _image_from_decoded(decoding: Future):
+    """ Tworzy ImageMessage z wyniku dekodowania w procesie roboczym
+    :param decoding: zakończone dekodowanie (Offload.decode_image_frame)
+    :return: ImageMessage lub None, jeśli ramkę trzeba zdekodować na miejscu
+    """
+    try:
+        result = decoding.result()
+    except Exception:
+        logger.warn("Cannot decode frame in worker process, decoding in place: %s" % str(sys.exc_info()))
+        return None
+    if result is None:
+        return None
+    data, img = result
+    try:
+        return ImageMessage.from_decoded(data, img)
+    except KeyError:
+        logger.error("Cannot decode image message, error: %s" % str(sys.exc_info()))
+        return None
+
+
+def wire_format_of(frame: bytes):
+    """ Zwraca format, w jakim zakodowana jest ramka
+    """
+    return WIRE_BINARY if frame[0] == MAGIC else WIRE_JSON
+
+
+def to_raw(frame: bytes):
+    """ Zamienia ramkę odebraną przez MessageFramer na postać gotową do wysłania
+    (framer usuwa kończący znak nowej linii z ramek JSON)
+    """
+    if frame[0] == MAGIC:
+        return frame
+    return frame + b'\n'
+
+
+def frame_repr(frame: bytes):
+    """ Opis ramki do logów
+    """
+    if frame and frame[0] == MAGIC:
+        return '<binary frame, %s bytes>' % len(frame)
+    return frame.decode("utf-8")
+
+
+def wire_format_for(capabilities: []):
+    """ Zwraca format przesyłania danych dla wynegocjowanych możliwości
+    """
+    return WIRE_BINARY if BINARY_WIRE_CAPABILITY in capabilities else WIRE_JSON
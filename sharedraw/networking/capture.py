@@ -0,0 +1,93 @@
+""" Zapis ruchu sieciowego do pliku (capture) - do późniejszego odtworzenia (sharedraw.replay)
+
+Plik: MAGIC | rekordy
+Rekord: czas (float64, sekundy od epoki) | kierunek (u8) | numer peera (u16) | długość (u32) | dane
+Kierunki: DIRECTION_IN - ramka odebrana, DIRECTION_OUT - ramka wysłana (wstawiona do kolejki wychodzącej),
+DIRECTION_PEER - opis peera o danym numerze (dane: id klienta lub adres w UTF-8; może się zmienić po rejestracji).
+Ramki zapisywane są w postaci gotowej do wysłania (JSON z kończącym znakiem nowej linii lub ramka binarna).
+"""
+import logging
+import struct
+import time
+from threading import Lock
+
+__author__ = 'michalek'
+logger = logging.getLogger(__name__)
+
+MAGIC = b'SDCAP1\n'
+DIRECTION_IN = 0
+DIRECTION_OUT = 1
+DIRECTION_PEER = 2
+
+_RECORD = struct.Struct('<dBHI')
+
+
+class CaptureWriter:
+    """ Zapisuje ramki do pliku; metody mogą być wywoływane z wielu wątków
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: ścieżka pliku (nadpisywany)
+        """
+        self.path = path
+        self.__file = open(path, 'wb', buffering=256 * 1024)
+        self.__file.write(MAGIC)
+        self.__lock = Lock()
+        # Peer -> (numer, ostatnio zapisany opis)
+        self.__peers = {}
+        self.frames = 0
+        logger.info("Capturing traffic to %s" % path)
+
+    def record(self, peer, direction: int, frame: bytes):
+        """ Zapisuje ramkę
+        :param peer: peer (sharedraw.networking.networking.Peer)
+        :param direction: DIRECTION_IN lub DIRECTION_OUT
+        :param frame: ramka gotowa do wysłania
+        """
+        now = time.time()
+        label = str(peer.client_id) if peer.is_registered() else '%s:%s' % peer.address
+        with self.__lock:
+            if self.__file is None:
+                return
+            number, last_label = self.__peers.get(peer, (len(self.__peers), None))
+            if label != last_label:
+                self.__peers[peer] = (number, label)
+                data = label.encode('utf-8')
+                self.__file.write(_RECORD.pack(now, DIRECTION_PEER, number, len(data)))
+                self.__file.write(data)
+            self.__file.write(_RECORD.pack(now, direction, number, len(frame)))
+            self.__file.write(frame)
+            self.frames += 1
+
+    def close(self):
+        with self.__lock:
+            if self.__file is not None:
+                self.__file.close()
+                self.__file = None
+        logger.info("Capture %s closed: %s frames" % (self.path, self.frames))
+
+
+def read_capture(path: str):
+    """ Odczytuje plik z zapisanym ruchem
+    :param path: ścieżka pliku
+    :return: generator krotek (czas, kierunek, opis peera, ramka) - tylko dla DIRECTION_IN i DIRECTION_OUT
+    :raise ValueError: jeśli plik nie jest zapisem ruchu
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("Not a sharedraw capture file: %s" % path)
+        peers = {}
+        while True:
+            header = f.read(_RECORD.size)
+            if len(header) < _RECORD.size:
+                return
+            timestamp, direction, number, length = _RECORD.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                # Niedokończony zapis
+                return
+            if direction == DIRECTION_PEER:
+                peers[number] = data.decode('utf-8')
+            else:
+                yield timestamp, direction, peers.get(number), data
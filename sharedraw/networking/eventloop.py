@@ -0,0 +1,221 @@
+""" Obsługa sieci oparta na jednej pętli zdarzeń (moduł selectors)
+Zamiast wątku na każdego peera, gniazdo serwera oraz gniazda wszystkich peerów są obsługiwane
+przez jeden wątek, który blokująco czeka na zdarzenia - zużycie procesora rośnie z ruchem, a nie z liczbą połączeń.
+"""
+from functools import partial
+from queue import Queue, Empty
+from socket import *
+from threading import Event
+import selectors
+
+from sharedraw.config import config
+from sharedraw.networking.binary import frame_repr
+from sharedraw.networking.messages import *
+from sharedraw.networking.networking import Peer, PeerPool
+
+__author__ = 'michalek'
+logger = logging.getLogger(__name__)
+
+
+class SelectorPeer(Peer):
+    """ Peer obsługiwany przez wspólną pętlę zdarzeń - nie posiada własnego wątku
+    Gniazdo działa w trybie nieblokującym; dane z kolejki wychodzącej wysyłane są, gdy gniazdo jest gotowe do zapisu.
+    """
+
+    def __init__(self, sock: SocketType, stop_event: Event, queue_to_ui: Queue):
+        super().__init__(sock, stop_event, queue_to_ui)
+        sock.setblocking(False)
+        # Niewysłana reszta bieżącej ramki
+        self.pending = None
+
+    def on_writable(self):
+        """ Wysyła dane z kolejki wychodzącej, dopóki gniazdo przyjmuje dane
+        :return: True, jeśli pozostały dane do wysłania
+        """
+        try:
+            while True:
+                if not self.pending:
+                    data = self.outbound.pop()
+                    if data is None:
+                        return False
+                    logger.info("Packet sent: %s" % frame_repr(data))
+                    self.pending = memoryview(data)
+                sent = self.sock.send(self.pending)
+                self.pending = self.pending[sent:]
+        except (BlockingIOError, InterruptedError):
+            return True
+        except OSError:
+            logger.warn("Connection error: %s" % str(sys.exc_info()))
+            self.enabled = False
+            return False
+
+    def on_readable(self):
+        """ Odczytuje dane z gniazda gotowego do odczytu
+        :return: False, jeśli połączenie zostało zamknięte
+        """
+        try:
+            n = self.builder.recv_from(self.sock)
+        except (BlockingIOError, InterruptedError):
+            return True
+        except OSError:
+            logger.warn("Connection error: %s" % str(sys.exc_info()))
+            self.enabled = False
+            return False
+        if n == 0:
+            logger.info('Data not available - assuming, that connection is closed')
+            self.enabled = False
+            return False
+        self.handle_frames(self.builder.fetch())
+        return True
+
+
+class SelectorPeerPool(PeerPool):
+    """ Pula peerów obsługiwana przez jedną pętlę zdarzeń
+    """
+
+    def __init__(self, port: int, stop_event: Event, queue_to_ui: Queue):
+        super().__init__(port, stop_event, queue_to_ui)
+        self.selector = selectors.DefaultSelector()
+        # Peery dodane z innych wątków - rejestrowane w pętli
+        self.__new_peers = Queue()
+        # Peery, które mają dane do wysłania lub zostały odłączone - obsługiwane w pętli
+        self.__changed_peers = Queue()
+        # Para gniazd do wybudzania pętli z innych wątków
+        self.__wakeup_r, self.__wakeup_w = socketpair()
+        self.__wakeup_r.setblocking(False)
+
+    def run(self):
+        """
+        Pętla zdarzeń - przyjmuje połączenia, odczytuje i wysyła dane do wszystkich peerów
+        """
+        sock = self.open_server_socket()
+        sock.setblocking(False)
+        self.selector.register(sock, selectors.EVENT_READ, self.__accept)
+        self.selector.register(self.__wakeup_r, selectors.EVENT_READ, self.__on_wakeup)
+        while self.running and not self.stop_event.is_set():
+            for key, mask in self.selector.select(config.socket_wait_timeout):
+                callback = key.data
+                callback(mask)
+        self.__close()
+
+    def create_peer(self, sock: SocketType):
+        peer = SelectorPeer(sock, self.stop_event, self.queue_to_ui)
+        peer.outbound.notify = partial(self.__on_peer_changed, peer)
+        peer.resume_handler = self.resume
+        peer.capture = self.capture
+        return peer
+
+    def add_peer(self, peer: Peer):
+        """ Dodaje peera do puli; rejestracja w selektorze odbywa się w wątku pętli
+        :param peer: peer
+        """
+        self.peers.append(peer)
+        self.__new_peers.put(peer)
+        peer.send_join()
+        self.__wakeup()
+
+    def stop(self):
+        """
+        Zatrzymuje pętlę - gniazda są zamykane w wątku pętli
+        """
+        self.running = False
+        self.__wakeup()
+
+    def __accept(self, mask):
+        # Przyjmujemy wszystkie oczekujące połączenia (wielu klientów może dołączać jednocześnie)
+        for _ in range(config.listen_backlog):
+            try:
+                conn, addr = self.server_sock.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except error:
+                logger.warn("Cannot accept connection: %s" % str(sys.exc_info()))
+                return
+            peer = self.create_peer(conn)
+            peer.is_incoming = True
+            self.peers.append(peer)
+            self.__register(peer)
+
+    def __register(self, peer: SelectorPeer):
+        self.selector.register(peer.sock, self.__events_for(peer), partial(self.__on_io, peer))
+
+    @staticmethod
+    def __events_for(peer: SelectorPeer):
+        if peer.pending or peer.outbound.has_ready():
+            return selectors.EVENT_READ | selectors.EVENT_WRITE
+        return selectors.EVENT_READ
+
+    def __on_io(self, peer: SelectorPeer, mask):
+        alive = peer.enabled
+        if alive and mask & selectors.EVENT_READ:
+            alive = peer.on_readable()
+        if alive and mask & selectors.EVENT_WRITE:
+            peer.on_writable()
+            alive = peer.enabled
+        if alive:
+            self.__update(peer)
+        else:
+            self.__unregister(peer)
+
+    def __update(self, peer: SelectorPeer):
+        events = self.__events_for(peer)
+        if self.selector.get_key(peer.sock).events != events:
+            self.selector.modify(peer.sock, events, partial(self.__on_io, peer))
+
+    def __unregister(self, peer: SelectorPeer):
+        try:
+            self.selector.unregister(peer.sock)
+        except (KeyError, ValueError):
+            return
+        peer.sock.close()
+        # Jak po zakończeniu wątku peera: dane wysyłane do peera, z którym można wznowić sesję, trafiają odtąd
+        # do historii, a nie do kolejki
+        peer.outbound.close()
+
+    def __on_peer_changed(self, peer: SelectorPeer):
+        """ Wywoływane z dowolnego wątku, gdy peer ma nowe dane do wysłania lub został odłączony
+        """
+        self.__changed_peers.put(peer)
+        self.__wakeup()
+
+    def __wakeup(self):
+        try:
+            self.__wakeup_w.send(b'\0')
+        except OSError:
+            pass
+
+    def __on_wakeup(self, mask):
+        try:
+            while self.__wakeup_r.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+        while True:
+            try:
+                peer = self.__new_peers.get_nowait()
+            except Empty:
+                break
+            if peer.enabled:
+                self.__register(peer)
+        while True:
+            try:
+                peer = self.__changed_peers.get_nowait()
+            except Empty:
+                break
+            if peer.sock.fileno() < 0:
+                continue
+            if peer.enabled:
+                try:
+                    self.__update(peer)
+                except KeyError:
+                    # Jeszcze nie zarejestrowany
+                    pass
+            else:
+                self.__unregister(peer)
+
+    def __close(self):
+        for key in list(self.selector.get_map().values()):
+            self.selector.unregister(key.fileobj)
+            key.fileobj.close()
+        self.selector.close()
+        self.__wakeup_w.close()
@@ -0,0 +1,171 @@
+""" Wydzielanie pełnych komunikatów ze strumienia TCP
+"""
+import re
+
+from sharedraw.networking.binary import MAGIC, read_uint
+
+__author__ = 'michalek'
+
+# Znaki istotne dla struktury JSON-a poza łańcuchami oraz wewnątrz nich
+_STRUCTURAL = re.compile(b'[{}"]')
+_IN_STRING = re.compile(b'["\\\\]')
+_LEFT_PAR, _RIGHT_PAR, _QUOTE, _BACKSLASH = b'{}"\\'
+_WHITESPACE = b' \t\r\n'
+
+
+class MessageFramer:
+    """ Składa komunikaty z kawałków danych odczytanych z gniazda.
+    Granice komunikatów wyznaczane są przez kończący znak '\\n' (Message.to_bytes), wyszukiwany hurtowo przez
+    bytearray.find. Dopóki klient nie wyśle komunikatu zakończonego znakiem nowej linii, stosowane jest zliczanie
+    nawiasów (z pominięciem łańcuchów znaków) - dla zgodności z klientami, które go nie wysyłają.
+    Ramki binarne (rozpoczynające się bajtem MAGIC) wydzielane są na podstawie długości z nagłówka.
+    """
+
+    def __init__(self, buffer_size=65536):
+        self.ready_msgs = []
+        self.newline_delimited = False
+        self.buf = bytearray()
+        # Bufor wielokrotnego użytku dla recv_into
+        self.chunk = bytearray(buffer_size)
+        self.chunk_view = memoryview(self.chunk)
+        # Pozycja w buforze, od której kontynuujemy przeszukiwanie
+        self._pos = 0
+        # Czy w buforze rozpoczął się komunikat JSON
+        self._started = False
+        # Stan zliczania nawiasów
+        self._depth = 0
+        self._in_string = False
+        self._after_frame = False
+
+    def recv_from(self, sock):
+        """ Odczytuje dane z gniazda bezpośrednio do bufora
+        :param sock: gniazdo
+        :return: liczba odczytanych bajtów (0 oznacza zamknięcie połączenia)
+        """
+        n = sock.recv_into(self.chunk)
+        if n:
+            self.buf += self.chunk_view[:n]
+            self._parse()
+        return n
+
+    def append(self, rawdata: bytes):
+        """ Dodaje bajty do bufora
+        :param rawdata: bajty (część komunikatu)
+        :return: instancja framera
+        """
+        self.buf += rawdata
+        self._parse()
+        return self
+
+    def fetch(self):
+        """ Pobiera zakończone komunikaty
+        :return: lista pełnych komunikatów w postaci bajtów lub pusta, jeśli nie ma
+        """
+        msgs = self.ready_msgs
+        self.ready_msgs = []
+        return msgs
+
+    def _parse(self):
+        buf = self.buf
+        consumed = 0
+        while True:
+            if not self._started:
+                # Granica komunikatów - pomijamy białe znaki pomiędzy nimi
+                begin = consumed
+                size = len(buf)
+                while begin < size and buf[begin] in _WHITESPACE:
+                    begin += 1
+                if self._after_frame and begin > consumed:
+                    # Klient kończy komunikaty znakiem nowej linii - przechodzimy w szybszy tryb
+                    self.newline_delimited = b'\n' in buf[consumed:begin]
+                    self._after_frame = False
+                consumed = begin
+                if begin == size:
+                    break
+                self._after_frame = False
+                if buf[begin] == MAGIC:
+                    end = self._binary_end(buf, begin)
+                    if end < 0:
+                        break
+                    self.ready_msgs.append(bytes(buf[begin:end]))
+                    consumed = end
+                    continue
+                if buf[begin] != _LEFT_PAR and not self.newline_delimited:
+                    # Śmieci przed komunikatem - pomijamy
+                    consumed = begin + 1
+                    continue
+                self._started = True
+                self._pos = begin
+            if self.newline_delimited:
+                end = buf.find(b'\n', self._pos)
+                if end < 0:
+                    self._pos = len(buf)
+                    break
+                frame = bytes(buf[consumed:end]).rstrip()
+                consumed = end + 1
+                self._started = False
+                if frame:
+                    self.ready_msgs.append(frame)
+            else:
+                end = self._scan_pars(buf)
+                if end < 0:
+                    break
+                self.ready_msgs.append(bytes(buf[consumed:end]))
+                consumed = end
+                self._started = False
+                self._after_frame = True
+        if consumed:
+            del buf[:consumed]
+            self._pos = max(self._pos - consumed, 0)
+
+    @staticmethod
+    def _binary_end(buf: bytearray, begin: int):
+        """ Wyznacza koniec ramki binarnej na podstawie nagłówka z długością
+        :param buf: bufor
+        :param begin: pozycja bajtu MAGIC
+        :return: pozycja za końcem ramki lub -1, jeśli ramka jest niepełna
+        """
+        try:
+            length, pos = read_uint(buf, begin + 1)
+        except IndexError:
+            return -1
+        end = pos + length
+        return end if end <= len(buf) else -1
+
+    def _scan_pars(self, buf: bytearray):
+        """ Zlicza nawiasy w celu znalezienia końca komunikatu; ignoruje nawiasy wewnątrz łańcuchów znaków
+        :param buf: bufor
+        :return: pozycja za końcem komunikatu lub -1, jeśli komunikat jest niepełny
+        """
+        pos = self._pos
+        while True:
+            if self._in_string:
+                m = _IN_STRING.search(buf, pos)
+                if not m:
+                    self._pos = len(buf)
+                    return -1
+                if buf[m.start()] == _BACKSLASH:
+                    if m.end() >= len(buf):
+                        # Znak ucieczki na końcu bufora - czekamy na kolejny bajt
+                        self._pos = m.start()
+                        return -1
+                    pos = m.end() + 1
+                    continue
+                self._in_string = False
+                pos = m.end()
+            else:
+                m = _STRUCTURAL.search(buf, pos)
+                if not m:
+                    self._pos = len(buf)
+                    return -1
+                char = buf[m.start()]
+                pos = m.end()
+                if char == _QUOTE:
+                    self._in_string = True
+                elif char == _LEFT_PAR:
+                    self._depth += 1
+                else:
+                    self._depth -= 1
+                    if self._depth == 0:
+                        self._pos = pos
+                        return pos
@@ -0,0 +1,93 @@
+""" Wykrywanie awarii peerów na podstawie komunikatów keepAlive (i pozostałego ruchu) oraz pomiar czasu
+odpowiedzi (RTT)
+"""
+import math
+from collections import deque
+
+from sharedraw.config import config
+
+__author__ = 'michalek'
+
+
+class FailureDetector:
+    """ Detektor awarii typu phi accrual (Hayashibara i in.)
+    Zamiast stałego limitu czasu zwraca poziom podejrzenia phi, wyznaczony z rozkładu (przybliżonego rozkładem
+    normalnym) odstępów pomiędzy ostatnimi komunikatami keepAlive. phi = 1 oznacza ok. 10% szans na pomyłkę,
+    phi = 2 - 1%, phi = 3 - 0,1% itd.
+    Czas od ostatniej oznaki życia liczony jest od dowolnych danych odebranych od peera - keepAlive może czekać
+    w kolejce za dużą ramką (np. obrazkiem), która sama świadczy o tym, że peer działa.
+    """
+
+    def __init__(self, window=100, min_std_deviation=0.5, acceptable_pause=None):
+        """
+        :param window: liczba zapamiętywanych odstępów
+        :param min_std_deviation: minimalne odchylenie standardowe [s] - chroni przed zbyt czułym detektorem,
+         gdy komunikaty przychodzą bardzo regularnie
+        :param acceptable_pause: dodatkowa, dopuszczalna przerwa [s] (np. chwilowe przeciążenie)
+        """
+        self.intervals = deque(maxlen=window)
+        self.min_std_deviation = min_std_deviation
+        self.acceptable_pause = acceptable_pause if acceptable_pause is not None else config.heartbeat_acceptable_pause
+        # Ostatnia oznaka życia i ostatni komunikat keepAlive
+        self.last = None
+        self.last_keep_alive = None
+
+    def heartbeat(self, now: float):
+        """ Rejestruje oznakę życia peera (odebrane dane)
+        :param now: czas (time.monotonic())
+        """
+        self.last = now
+
+    def keep_alive(self, now: float):
+        """ Rejestruje nadejście komunikatu keepAlive (odstępy pomiędzy nimi wyznaczają rozkład)
+        :param now: czas (time.monotonic())
+        """
+        if self.last_keep_alive is not None:
+            self.intervals.append(now - self.last_keep_alive)
+        self.last_keep_alive = now
+        self.heartbeat(now)
+
+    def is_monitoring(self):
+        """ Zwraca, czy detektor ma dość danych, by oceniać peera
+        """
+        return len(self.intervals) > 0
+
+    def phi(self, now: float):
+        """ Zwraca poziom podejrzenia awarii
+        :param now: czas (time.monotonic())
+        :return: phi (0 - brak podejrzeń)
+        """
+        if not self.intervals:
+            return 0.0
+        n = len(self.intervals)
+        mean = sum(self.intervals) / n
+        variance = sum((i - mean) ** 2 for i in self.intervals) / n
+        std = max(math.sqrt(variance), self.min_std_deviation)
+        y = (now - self.last - mean - self.acceptable_pause) / std
+        # Przybliżenie dystrybuanty rozkładu normalnego funkcją logistyczną
+        e = math.exp(-y * (1.5976 + 0.070566 * y * y))
+        if y > 0:
+            return -math.log10(e / (1.0 + e))
+        return -math.log10(1.0 - 1.0 / (1.0 + e))
+
+
+class RttStats:
+    """ Ostatnie pomiary czasu odpowiedzi peera
+    """
+
+    def __init__(self, window=256):
+        self.samples = deque(maxlen=window)
+
+    def add(self, rtt_ms: float):
+        self.samples.append(round(rtt_ms, 3))
+
+    def percentiles(self, *ps):
+        """ Zwraca percentyle RTT
+        :param ps: percentyle (0-100)
+        :return: lista wartości [ms] (None, jeśli nie ma pomiarów)
+        """
+        if not self.samples:
+            return [None for _ in ps]
+        ordered = sorted(self.samples)
+        last = len(ordered) - 1
+        return [ordered[min(int(round(p / 100 * last)), last)] for p in ps]
@@ -2,9 +2,10 @@ import base64
 import json
 import logging
 import sys
+import time
 from collections import namedtuple
 
-from sharedraw.config import own_id
+from sharedraw.config import config, own_id
 
 
 logger = logging.getLogger(__name__)
@@ -23,6 +24,11 @@ TOKEN = 'token'
 HAS_LOCK = 'hasLock'
 CLIENT_LIST = 'clientList'
 DETECTED_BY = 'detectedBy'
+CAPABILITIES = 'capabilities'
+RESUME = 'resume'
+LAST_SEEN = 'lastSeen'
+SENT_AT = 'sentAt'
+ECHO = 'echo'
 X = 'x'
 Y = 'y'
 COLOR_WHITE = 255
@@ -37,12 +43,20 @@ CLEAN_TYPE = 'clean'
 REQUEST_TYPE = 'request'
 RESIGN_TYPE = 'unlock'
 PASS_TOKEN_TYPE = 'passToken'
+RESUME_TYPE = 'resume'
+
+# Możliwości negocjowane pomiędzy klientami w Pythonie (pole "capabilities")
+BINARY_WIRE_CAPABILITY = 'sdbin1'
+TILED_SNAPSHOT_CAPABILITY = 'sdtile1'
+SESSION_RESUME_CAPABILITY = 'sdresume1'
 
 
 class Message:
     """
     Komunikat do wymiany danych z innymi użytkownikami
     """
+    # Komunikaty dotyczące samego połączenia (wznawianie sesji) - nie są liczone do pozycji w strumieniu sesji
+    link_local = False
 
     def to_json(self):
         pass
@@ -58,43 +72,135 @@ class Message:
         return bytedata
 
 
+# Wyspecjalizowany kodek JSON komunikatów paint - daje dokładnie te same bajty co json.dumps (domyślne separatory,
+# kolejność pól jak w PaintMessage.to_json_generic); ramki w innej postaci dekodowane są ogólną ścieżką
+_PAINT_TEMPLATE = '{"type": "paint", "clientId": %s, "pointList": [%s], "color": %s}'
+_POINT_TEMPLATE = '{"x": %s, "y": %s}'
+_PAINT_PREFIX = '{"type": "paint", "clientId": "'
+_POINTS_PREFIX = '", "pointList": [{"x": '
+_COLOR_PREFIX = '}], "color": '
+_PAINT_PREFIX_BYTES = _PAINT_PREFIX.encode('utf-8')
+# Dekoduje listę liczb (json.loads bez sprawdzania typu argumentu)
+_decode_numbers = json.JSONDecoder().raw_decode
+# Identyfikatory klientów zakodowane jako łańcuchy JSON (jest ich niewiele, a występują w każdym komunikacie)
+_json_strings = {}
+
+
+def _json_string(value: str):
+    encoded = _json_strings.get(value)
+    if encoded is None:
+        if len(_json_strings) > 1024:
+            _json_strings.clear()
+        encoded = _json_strings[value] = json.dumps(value)
+    return encoded
+
+
 class PaintMessage(Message):
     """
     Komunikat służący do przesłania danych o obrazie
     """
 
-    def __init__(self, changed_pxs: [], color: str):
+    def __init__(self, changed_pxs: [], color: str, client_id=None):
         self.changed_pxs = changed_pxs
         self.color = color
+        # Autor zmiany - domyślnie my
+        self.client_id = client_id or own_id
 
     @staticmethod
     def from_json(msg: {}):
         if not msg[POINT_LIST]:
             logger.error('No coords!')
-        changed_pxs = list(map(lambda coord_obj: (coord_obj[X], coord_obj[Y]), msg[POINT_LIST]))
-        return PaintMessage(changed_pxs, 'white' if COLOR in msg and msg[COLOR] == COLOR_WHITE else 'black')
+        # Współrzędne ułamkowe (inne implementacje) obcinane są do pikseli - tak jak rysował je ImageDraw
+        changed_pxs = list(map(lambda coord_obj: (int(coord_obj[X]), int(coord_obj[Y])), msg[POINT_LIST]))
+        return PaintMessage(changed_pxs, 'white' if COLOR in msg and msg[COLOR] == COLOR_WHITE else 'black',
+                            msg.get(CLIENT_ID))
+
+    @staticmethod
+    def from_frame(frame: bytes):
+        """ Szybko dekoduje ramkę JSON z komunikatem paint (bez budowania słowników dla punktów)
+        :param frame: ramka
+        :return: komunikat lub None, jeśli ramka nie jest komunikatem paint w oczekiwanej postaci
+        """
+        if not frame.startswith(_PAINT_PREFIX_BYTES):
+            return None
+        frame = frame.decode('utf-8')
+        points_start = frame.find(_POINTS_PREFIX, len(_PAINT_PREFIX))
+        color_start = frame.find(_COLOR_PREFIX, points_start)
+        if points_start < 0 or color_start < 0:
+            return None
+        client_id = frame[len(_PAINT_PREFIX):points_start]
+        points = frame[points_start + len(_POINTS_PREFIX):color_start]
+        color = frame[color_start + len(_COLOR_PREFIX):].rstrip()
+        if '"' in client_id or '\\' in client_id or not color.endswith('}') or not color[:-1].isdigit():
+            return None
+        if '.' in points or 'e' in points or 'E' in points:
+            # Współrzędne ułamkowe - dekodowane przez from_json
+            return None
+        # '1, "y": 2}, {"x": 3, "y": 4' -> '[1,2,3,4]' - liczby dekoduje parser JSON
+        numbers = '[%s]' % points.replace(', "y": ', ',').replace('}, {"x": ', ',')
+        try:
+            coords, end = _decode_numbers(numbers)
+        except ValueError:
+            return None
+        if end != len(numbers) or len(coords) != 2 * (points.count('{') + 1):
+            return None
+        return PaintMessage(list(zip(coords[0::2], coords[1::2])),
+                            'white' if int(color[:-1]) == COLOR_WHITE else 'black', client_id)
 
     def to_json(self):
+        try:
+            points = ', '.join(map(_POINT_TEMPLATE.__mod__, self.changed_pxs))
+        except TypeError:
+            # Punkty nie są krotkami
+            return self.to_json_generic()
+        if type(self.client_id) is not str:
+            return self.to_json_generic()
+        return _PAINT_TEMPLATE % (_json_string(self.client_id), points,
+                                  COLOR_WHITE if self.color == 'white' else COLOR_BLACK)
+
+    def to_json_generic(self):
         data = list(map(lambda xy: {X: xy[0], Y: xy[1]}, self.changed_pxs))
         msg = {
             TYPE: PAINT_TYPE,
-            CLIENT_ID: own_id,
+            CLIENT_ID: self.client_id,
             POINT_LIST: data,
             COLOR: COLOR_WHITE if self.color == 'white' else COLOR_BLACK
         }
         return json.dumps(msg)
 
+    def is_continued_by(self, other):
+        """ Sprawdza, czy komunikat other jest kontynuacją tej samej linii (ten sam autor i kolor, wspólny punkt)
+        :param other: komunikat
+        :return: wartość logiczna
+        """
+        return type(other) is PaintMessage and other.color == self.color and other.client_id == self.client_id \
+            and self.changed_pxs and other.changed_pxs and self.changed_pxs[-1] == other.changed_pxs[0]
+
+    def merged_with(self, other):
+        """ Skleja komunikat z jego kontynuacją
+        :param other: komunikat będący kontynuacją (is_continued_by)
+        :return: nowy komunikat
+        """
+        return PaintMessage(self.changed_pxs + other.changed_pxs[1:], self.color, self.client_id)
+
 
 class ImageMessage(Message):
     """ Komunikat zawierający aktualny stan tablicy po dołączeniu się klienta
     """
 
-    def __init__(self, client_id: str, rawdata: bytes, client_ids: [], token_owner: str, locked: bool):
+    def __init__(self, client_id: str, rawdata: bytes, client_ids: [], token_owner: str, locked: bool,
+                 capabilities=None):
         self.client_id = client_id
         self.rawdata = rawdata
+        # Obrazek zakodowany w base64 (jeśli jest już gotowy, np. z bufora migawek)
+        self.rawdata_b64 = None
+        # Obrazek PIL, jeśli został już zdekodowany (w osobnym procesie) - rawdata jest wtedy puste
+        self.decoded = None
         self.client_ids = client_ids
         self.token_owner = token_owner
         self.locked = locked
+        # Możliwości wynegocjowane z klientem (rozszerzenie dla klientów w Pythonie)
+        self.capabilities = capabilities or []
 
     @staticmethod
     def from_json(msg: {}):
@@ -104,19 +210,35 @@ class ImageMessage(Message):
             logger.error('No image!')
         token_node = msg[TOKEN]
         return ImageMessage(msg[CLIENT_ID], base64.b64decode(msg[IMAGE]), msg[CLIENT_LIST], token_node[CLIENT_ID],
-                            token_node[HAS_LOCK])
+                            token_node[HAS_LOCK], msg.get(CAPABILITIES))
+
+    @staticmethod
+    def from_decoded(msg: {}, img):
+        """ Tworzy komunikat z pól JSON-a (bez obrazka) i zdekodowanego już obrazka
+        :param msg: pola komunikatu
+        :param img: obrazek PIL lub bajty migawki kafelkowej (dekodowanej wprost do kafelków płótna)
+        """
+        token_node = msg[TOKEN]
+        rawdata = img if isinstance(img, bytes) else None
+        result = ImageMessage(msg[CLIENT_ID], rawdata, msg[CLIENT_LIST], token_node[CLIENT_ID], token_node[HAS_LOCK],
+                              msg.get(CAPABILITIES))
+        if rawdata is None:
+            result.decoded = img
+        return result
 
     def to_json(self):
         msg = {
             TYPE: IMAGE,
             CLIENT_ID: self.client_id,
             'clientList': self.client_ids,
-            IMAGE: str(base64.b64encode(self.rawdata), encoding="utf8"),
+            IMAGE: self.rawdata_b64 or str(base64.b64encode(self.rawdata), encoding="utf8"),
             TOKEN: {
                 CLIENT_ID: self.token_owner,
                 HAS_LOCK: self.locked
             }
         }
+        if self.capabilities:
+            msg[CAPABILITIES] = self.capabilities
         return json.dumps(msg)
 
 
@@ -124,25 +246,87 @@ class JoinMessage(Message):
     """ Komunikat potwiedzający dołączenie się klienta
     """
 
-    def __init__(self, client_id: str):
+    def __init__(self, client_id: str, capabilities=None, resume=None):
         self.client_id = client_id
+        # Pozycja w strumieniu sesji, do której klient odebrał od nas dane - jeśli wznawia sesję po zerwaniu połączenia
+        self.resume = resume
         # Wewnętrzne pole - od kogo dostaliśmy
         # None, jeśli od niego samego - oznacza, że klientowi należy odesłać ImageMessage
         self.received_from_id = False
         # Adres
         self.address = None
+        # Możliwości ogłaszane przez klienta (rozszerzenie dla klientów w Pythonie)
+        self.capabilities = capabilities or []
 
     @staticmethod
     def from_json(msg: {}):
         if not msg[CLIENT_ID]:
             logger.error('No clientId!')
-        return JoinMessage(msg[CLIENT_ID])
+        return JoinMessage(msg[CLIENT_ID], msg.get(CAPABILITIES), msg.get(RESUME))
+
+    @property
+    def link_local(self):
+        return self.resume is not None
 
     def to_json(self):
         msg = {
             TYPE: JOIN_TYPE,
             CLIENT_ID: self.client_id
         }
+        if self.capabilities:
+            msg[CAPABILITIES] = self.capabilities
+        if self.resume is not None:
+            msg[RESUME] = self.resume
+        return json.dumps(msg)
+
+
+class ResumeMessage(Message):
+    """ Odpowiedź na próbę wznowienia sesji (rozszerzenie dla klientów w Pythonie)
+    Zawiera pozycję w strumieniu sesji, do której odebraliśmy dane od klienta - klient dosyła resztę.
+    """
+    link_local = True
+
+    def __init__(self, client_id: str, last_seen: int):
+        self.client_id = client_id
+        self.last_seen = last_seen
+
+    @staticmethod
+    def from_json(msg: {}):
+        return ResumeMessage(msg[CLIENT_ID], msg[LAST_SEEN])
+
+    def to_json(self):
+        return json.dumps({
+            TYPE: RESUME_TYPE,
+            CLIENT_ID: self.client_id,
+            LAST_SEEN: self.last_seen
+        })
+
+
+class KeepAliveMessage(Message):
+    """ Komunikat podtrzymujący połączenie (nie jest przekazywany dalej ani do kontrolera)
+    Pole sentAt zawiera czas nadania u nadawcy [ms], a odpowiedź odsyła go w polu echo - pozwala to zmierzyć RTT.
+    Klienty, które nie odpowiadają, są nadal monitorowane na podstawie ich własnych komunikatów keepAlive.
+    """
+    link_local = True
+
+    def __init__(self, client_id: str, sent_at: float = None, echo: float = None):
+        self.client_id = client_id
+        self.sent_at = sent_at
+        self.echo = echo
+
+    @staticmethod
+    def from_json(msg: {}):
+        return KeepAliveMessage(msg[CLIENT_ID], msg.get(SENT_AT), msg.get(ECHO))
+
+    def to_json(self):
+        msg = {
+            TYPE: KEEP_ALIVE_TYPE,
+            CLIENT_ID: self.client_id
+        }
+        if self.sent_at is not None:
+            msg[SENT_AT] = self.sent_at
+        if self.echo is not None:
+            msg[ECHO] = self.echo
         return json.dumps(msg)
 
 
@@ -274,7 +458,9 @@ message_type_handlers = {
     CLEAN_TYPE: CleanMessage.from_json,
     REQUEST_TYPE: RequestTableMessage.from_json,
     RESIGN_TYPE: ResignMessage.from_json,
-    PASS_TOKEN_TYPE: PassTokenMessage.from_json
+    PASS_TOKEN_TYPE: PassTokenMessage.from_json,
+    RESUME_TYPE: ResumeMessage.from_json,
+    KEEP_ALIVE_TYPE: KeepAliveMessage.from_json
 }
 
 
@@ -297,13 +483,40 @@ def from_json(jsonstr: str):
         return None
 
 
+def own_capabilities():
+    """ Zwraca możliwości ogłaszane przez nas w komunikacie joined
+    :return: lista nazw
+    """
+    capabilities = []
+    if config.binary_protocol:
+        capabilities.append(BINARY_WIRE_CAPABILITY)
+    if config.tiled_snapshots:
+        capabilities.append(TILED_SNAPSHOT_CAPABILITY)
+    if config.session_resumption:
+        capabilities.append(SESSION_RESUME_CAPABILITY)
+    return capabilities
+
+
+def negotiate(capabilities: []):
+    """ Wyznacza możliwości wspólne dla nas i drugiej strony
+    :param capabilities: możliwości ogłoszone przez drugą stronę
+    :return: lista nazw
+    """
+    return [c for c in own_capabilities() if c in capabilities]
+
+
 class SignedMessage:
     """ Podpisany komunikat (z autorem)
     """
 
-    def __init__(self, client_id: str, message: Message):
+    def __init__(self, client_id: str, message: Message, raw=None):
         self.client_id = client_id
         self.message = message
+        # Oryginalna ramka (gotowa do wysłania) - pozwala przekazać komunikat dalej bez ponownego kodowania.
+        # Jeśli kontroler zmienia komunikat przed przekazaniem, musi ją wyzerować.
+        self.raw = raw
+        # Czas wstawienia do kolejki kontrolera (metryki)
+        self.queued_at = time.monotonic()
 
 
 class InternalMessage(Message):
@@ -1,17 +1,29 @@
+from collections import deque
 from queue import Queue
 from socket import *
-from threading import Event, Thread
+from threading import Event, Thread, RLock
 import select
+import time
 
 from sharedraw.config import config
 
 from sharedraw.concurrent.threading import TimerThread
+from sharedraw.metrics import metrics
+from sharedraw.networking.binary import from_wire, from_wire_in_background, to_wire, to_raw, frame_repr, \
+    wire_format_for, wire_format_of
+from sharedraw.networking.capture import DIRECTION_IN, DIRECTION_OUT
+from sharedraw.networking.framing import MessageFramer
+from sharedraw.networking.heartbeat import FailureDetector, RttStats
 from sharedraw.networking.messages import *
+from sharedraw.networking.outbound import OutboundQueue
 
 
 __author__ = 'michalek'
 logger = logging.getLogger(__name__)
 
+# Liczniki ruchu według typu komunikatu: (kierunek, typ komunikatu) -> (licznik komunikatów, licznik bajtów)
+_traffic_by_type = {}
+
 
 class Peer(Thread):
     """
@@ -26,14 +38,47 @@ class Peer(Thread):
         self.queue_to_ui = queue_to_ui
         self.enabled = True
         self.is_incoming = False
+        # Możliwości wynegocjowane z peerem (np. format binarny)
+        self.capabilities = []
+        self.builder = MessageFramer()
+        # Kolejka wychodząca - opróżniana przez writera peera
+        self.outbound = OutboundQueue(self.encode)
+        # Wznawianie sesji: liczba bajtów odebranych od peera (pozycja w strumieniu sesji), poprzednie połączenie,
+        # którego sesję wznawiamy, bieżąca próba wznowienia i termin, do którego czekamy na wznowienie
+        self.received_bytes = 0
+        self.resuming = None
+        self.resume_attempt = None
+        self.suspended_until = None
+        # Funkcja f(peer, komunikat) obsługująca wznowienie sesji (ustawiana przez pulę)
+        self.resume_handler = None
+        # Zapis ruchu do pliku (CaptureWriter, ustawiany przez pulę; None - wyłączony)
+        self.capture = None
+        # Wykrywanie awarii (na podstawie komunikatów keepAlive od peera) i pomiary RTT
+        self.failure_detector = FailureDetector()
+        self.rtt = RttStats()
+        # Ramki odebrane w czasie dekodowania obrazka w tle (None - nic nie jest dekodowane); wynik dekodowania
+        # obsługiwany jest w innym wątku niż odbierający, stąd blokada
+        self.__held_frames = None
+        self.__frames_lock = RLock()
+        # Liczniki ruchu peera: kierunek -> (id klienta, licznik komunikatów, licznik bajtów)
+        self.__traffic = {}
+        self.address = sock.getpeername()
         self.setDaemon(True)
-        logger.debug("Peer created: %s, %s" % sock.getpeername())
+        logger.debug("Peer created: %s, %s" % self.address)
 
     def is_active(self):
         """ Zwraca klient jest aktywny tj. może się komunikować
+        Klient, z którym można wznowić sesję, pozostaje aktywny po zerwaniu połączenia - wysyłane do niego dane
+        są zapamiętywane.
+        :return: wartość logiczna
+        """
+        return (self.enabled or self.is_resumable()) and self.is_registered()
+
+    def is_resumable(self):
+        """ Zwraca, czy sesję z peerem można wznowić po zerwaniu połączenia
         :return: wartość logiczna
         """
-        return self.enabled and self.is_registered()
+        return self.outbound.history is not None
 
     def is_registered(self):
         """ Zwraca, czy peer potwiedził swoje przyłączenie tj. wysłał komunikat "joined"
@@ -41,79 +86,303 @@ class Peer(Thread):
         """
         return self.client_id is not None
 
-    def send(self, data):
+    @property
+    def wire_format(self):
+        """ Format, w jakim wysyłamy komunikaty do peera (JSON lub binarny)
         """
-        Wysyła dane do peera
+        return wire_format_for(self.capabilities)
+
+    def encode(self, msg: Message):
+        """ Koduje komunikat w formacie wynegocjowanym z peerem
+        :param msg: komunikat
+        :return: bajty
+        """
+        return to_wire(msg, self.wire_format)
+
+    def send(self, data, msg=None):
+        """
+        Wstawia dane do kolejki wychodzącej peera - nie blokuje wywołującego
         :param data: dane (jako bajty)
+        :param msg: komunikat, z którego powstały dane (dla polityki wolnego odbiorcy)
         :return: nic
         """
-        self.sock.send(data)
-        logger.info("Packet sent: %s" % data.decode("utf-8"))
+        self.outbound.put(data, msg)
+        self.count_traffic('out', data, msg)
+        if self.capture:
+            self.capture.record(self, DIRECTION_OUT, data)
+
+    def send_reserved(self, reservation, msg: Message):
+        """ Wysyła komunikat na miejsce zarezerwowane wcześniej w kolejce wychodzącej
+        :param reservation: rezerwacja (OutboundQueue.reserve)
+        :param msg: komunikat (None - rezygnacja z rezerwacji; kolejne komunikaty nie czekają na nią)
+        """
+        if msg is None:
+            self.outbound.cancel(reservation)
+            return
+        data = self.encode(msg)
+        self.outbound.fill(reservation, data, msg)
+        self.count_traffic('out', data, msg)
+        if self.capture:
+            self.capture.record(self, DIRECTION_OUT, data)
+
+    def count_traffic(self, direction: str, data: bytes, msg):
+        """ Zlicza komunikat i jego bajty w metrykach - według typu komunikatu i według klienta
+        :param direction: 'in' lub 'out'
+        :param data: ramka
+        :param msg: komunikat (None - seria komunikatów w jednej ramce)
+        """
+        # Liczniki pobierane są z rejestru tylko za pierwszym razem (i po zmianie id klienta)
+        counters = _traffic_by_type.get((direction, type(msg)))
+        if counters is None:
+            kind = type(msg).__name__ if msg is not None else 'batch'
+            counters = _traffic_by_type[(direction, type(msg))] = (
+                metrics.counter('net.%s.messages' % direction, kind), metrics.counter('net.%s.bytes' % direction, kind))
+        counters[0].inc()
+        counters[1].inc(len(data))
+        counters = self.__traffic.get(direction)
+        if counters is None or counters[0] != self.client_id:
+            peer = str(self.client_id)
+            counters = self.__traffic[direction] = (self.client_id,
+                                                    metrics.counter('net.%s.peer_messages' % direction, peer),
+                                                    metrics.counter('net.%s.peer_bytes' % direction, peer))
+        counters[1].inc()
+        counters[2].inc(len(data))
+
+    def disconnect(self):
+        """ Wyłącza peera i zamyka jego kolejkę wychodzącą
+        """
+        self.enabled = False
+        self.outbound.history = None
+        self.outbound.close()
+
+    def write_loop(self):
+        """ Pętla writera - wysyła dane z kolejki wychodzącej
+        """
+        while self.enabled and not self.stop_event.is_set():
+            data = self.outbound.get(config.socket_wait_timeout)
+            if data is None:
+                continue
+            try:
+                self.sock.sendall(data)
+            except OSError:
+                logger.warn("Connection error: %s" % str(sys.exc_info()))
+                self.enabled = False
+                break
+            logger.info("Packet sent: %s" % frame_repr(data))
 
     def receive(self):
         """ Odczytuje dane z gniazda
         """
-        builder = MessageBuilder()
         while self.enabled and not self.stop_event.is_set():
             try:
+                # Czekamy na dane z timeoutem - dzięki temu wątek nie zajmuje procesora,
+                # a jednocześnie co jakiś czas sprawdza, czy nie należy zakończyć pracy.
                 # Dzięki wywołaniu select() sock.recv nie zwróci danych, jeśli połączenie zostało zamknięte
-                r, w, e = select.select((self.sock,), (), (), 0)
+                r, w, e = select.select((self.sock,), (), (), config.socket_wait_timeout)
                 if r:
-                    msg = self.sock.recv(65536)
-                    if len(msg) == 0:
+                    if not self.builder.recv_from(self.sock):
                         logger.info('Data not available - assuming, that connection is closed')
                         self.enabled = False
                         break
-                    full_msgs = builder.append(msg).fetch()
-                    if not full_msgs:
-                        logger.debug("No ready messages; raw received data: %s" % msg)
-                        continue
-                    logger.debug('Received %s message(s)' % len(full_msgs))
-                    for full_msg in full_msgs:
-                        data = full_msg.decode("utf-8")
-                        logger.info('Packet received: %s' % data)
-                        rcm = from_json(data)
-                        if not rcm:
-                            continue
-                        if type(rcm) is JoinMessage:
-                            if not self.is_registered():
-                                # Nowy klient podłączył się do nas i wysłał join
-                                # Rejestrujemy klienta
-                                self.client_id = rcm.client_id
-                                # Sam się zgłosił - w kontrolerze odsyłamy mu ImageMessage
-                                rcm.received_from_id = None
-                            else:
-                                rcm.received_from_id = self.client_id
-                        elif type(rcm) is ImageMessage:
-                            if not self.is_registered():
-                                # Drugi klient potwiedził podłączenie i przesłał nam obrazek
-                                # Rejestrujemy
-                                self.client_id = rcm.client_id
-                                # Aktualizujemy obrazek w UI - w ramach kontrolera
-                            else:
-                                logger.warn('Received ImageMessage from already registered client -'
-                                            ' this should not happen, ignoring')
-                                continue
-                        # Ładujemy do kolejki - kontroler obsłuży
-                        self.queue_to_ui.put(SignedMessage(self.client_id, rcm))
-                        # Wysłanie do pozostałych klientów w kontrolerze
+                    self.handle_frames(self.builder.fetch())
             except OSError:
                 logger.warn("Connection error: %s" % str(sys.exc_info()))
                 self.enabled = False
                 break
         self.sock.close()
 
+    def handle_data(self, msg: bytes):
+        """ Przetwarza dane odczytane z gniazda - składa komunikaty i przekazuje je do kontrolera
+        :param msg: odczytane bajty
+        """
+        self.handle_frames(self.builder.append(msg).fetch())
+
+    def handle_frames(self, full_msgs: []):
+        """ Przekazuje złożone komunikaty do kontrolera
+        :param full_msgs: lista pełnych komunikatów w postaci bajtów
+        """
+        # Każdy odczyt z gniazda (także fragment dużej ramki) jest oznaką życia peera
+        self.failure_detector.heartbeat(time.monotonic())
+        if not full_msgs:
+            logger.debug("No ready messages")
+            return
+        logger.debug('Received %s message(s)' % len(full_msgs))
+        for full_msg in full_msgs:
+            self.handle_frame(full_msg)
+
+    def handle_frame(self, full_msg: bytes):
+        """ Dekoduje pojedynczy pełny komunikat i wrzuca go do kolejki kontrolera.
+        Duże ramki z obrazkiem dekodowane są w tle - kolejne ramki od peera czekają wtedy na zakończenie dekodowania
+        (kontroler otrzymuje komunikaty w kolejności odebrania).
+        :param full_msg: komunikat w postaci bajtów
+        """
+        logger.info('Packet received: %s' % frame_repr(full_msg))
+        with self.__frames_lock:
+            if self.__held_frames is None:
+                self.__process_frame(full_msg)
+                return
+            rcm = from_wire(full_msg) if len(full_msg) < config.offload_min_frame_size else None
+            if type(rcm) is KeepAliveMessage:
+                # keepAlive nie czeka na obrazek - peer mierzy RTT z naszej odpowiedzi
+                if self.capture:
+                    self.capture.record(self, DIRECTION_IN, to_raw(full_msg))
+                self.__handle_message(rcm, full_msg)
+                return
+            self.__held_frames.append((full_msg, rcm))
+
+    def __process_frame(self, full_msg: bytes, rcm=None):
+        """ Dekoduje ramkę (lub zleca jej dekodowanie w tle) i obsługuje komunikat
+        :param full_msg: komunikat w postaci bajtów
+        :param rcm: komunikat, jeśli ramka została już zdekodowana
+        """
+        if self.capture:
+            self.capture.record(self, DIRECTION_IN, to_raw(full_msg))
+        if rcm is None:
+            decoding = from_wire_in_background(full_msg)
+            if decoding is not None:
+                self.__held_frames = deque()
+                self.call_when_done(decoding, lambda f: self.__on_decoded(f, full_msg))
+                return
+            rcm = from_wire(full_msg)
+        self.__handle_message(rcm, full_msg)
+
+    def __on_decoded(self, decoding, full_msg: bytes):
+        """ Obsługuje komunikat zdekodowany w tle, a następnie ramki odebrane w międzyczasie
+        :param decoding: zakończone dekodowanie (Future z komunikatem lub None)
+        :param full_msg: ramka
+        """
+        rcm = decoding.result()
+        if rcm is None:
+            rcm = from_wire(full_msg)
+        with self.__frames_lock:
+            self.__handle_message(rcm, full_msg)
+            held, self.__held_frames = self.__held_frames, None
+            while held:
+                self.__process_frame(*held.popleft())
+                if self.__held_frames is not None:
+                    # Kolejny obrazek dekodowany w tle - pozostałe ramki czekają dalej
+                    self.__held_frames.extend(held)
+                    return
+
+    def call_when_done(self, future, callback):
+        """ Wywołuje callback(future) po zakończeniu dekodowania w tle - w wątku, który je zakończył
+        :param future: concurrent.futures.Future
+        :param callback: funkcja f(future)
+        """
+        future.add_done_callback(callback)
+
+    def __handle_message(self, rcm: Message, full_msg: bytes):
+        """ Obsługuje zdekodowany komunikat: rejestracja peera, keepAlive, wznowienie sesji lub przekazanie do kontrolera
+        :param rcm: komunikat lub None, jeśli ramki nie udało się zdekodować
+        :param full_msg: komunikat w postaci bajtów
+        """
+        raw = to_raw(full_msg)
+        if not rcm or not rcm.link_local:
+            # Pozycja w strumieniu sesji - liczymy każdą ramkę (także taką, której nie rozumiemy) oprócz komunikatów
+            # dotyczących samego połączenia, tak jak nadawca (OutboundQueue.session_bytes)
+            self.received_bytes += len(raw)
+        if not rcm:
+            return
+        self.count_traffic('in', full_msg, rcm)
+        if type(rcm) is KeepAliveMessage:
+            self.handle_keep_alive(rcm)
+            return
+        if rcm.link_local:
+            # Wznowienie sesji - obsługiwane przez pulę, bez udziału kontrolera
+            if not self.is_registered() and self.resume_handler:
+                self.resume_handler(self, rcm)
+            return
+        if type(rcm) is JoinMessage:
+            if not self.is_registered():
+                # Nowy klient podłączył się do nas i wysłał join
+                # Rejestrujemy klienta
+                self.client_id = rcm.client_id
+                self.capabilities = negotiate(rcm.capabilities)
+                self.start_session()
+                # Sam się zgłosił - w kontrolerze odsyłamy mu ImageMessage
+                rcm.received_from_id = None
+            else:
+                rcm.received_from_id = self.client_id
+        elif type(rcm) is ImageMessage:
+            if not self.is_registered():
+                # Drugi klient potwiedził podłączenie i przesłał nam obrazek
+                # Rejestrujemy
+                self.client_id = rcm.client_id
+                self.capabilities = negotiate(rcm.capabilities)
+                self.start_session()
+                # Aktualizujemy obrazek w UI - w ramach kontrolera
+            else:
+                logger.warn('Received ImageMessage from already registered client -'
+                            ' this should not happen, ignoring')
+                return
+        # Ładujemy do kolejki razem z oryginalną ramką - kontroler obsłuży
+        self.queue_to_ui.put(SignedMessage(self.client_id, rcm, raw))
+        # Wysłanie do pozostałych klientów w kontrolerze
+
+    def handle_keep_alive(self, msg: KeepAliveMessage):
+        """ Obsługuje komunikat keepAlive: odpowiedź - pomiar RTT, komunikat od peera - rejestracja w detektorze
+        awarii i odesłanie czasu nadania
+        :param msg: komunikat
+        """
+        now = time.monotonic()
+        if msg.echo is not None:
+            self.rtt.add(now * 1000 - msg.echo)
+            return
+        self.failure_detector.keep_alive(now)
+        if msg.sent_at is not None:
+            reply = KeepAliveMessage(own_id, echo=msg.sent_at)
+            try:
+                self.send(reply.to_bytes(), reply)
+            except OSError:
+                pass
+
+    def send_keep_alive(self):
+        """ Wysyła komunikat keepAlive z czasem nadania
+        """
+        msg = KeepAliveMessage(own_id, round(time.monotonic() * 1000, 3))
+        self.send(msg.to_bytes(), msg)
+
+    def heartbeat_stats(self):
+        """ Zwraca statystyki połączenia: percentyle RTT [ms] i bieżący poziom podejrzenia awarii
+        :return: słownik
+        """
+        p50, p95, p99 = self.rtt.percentiles(50, 95, 99)
+        return {
+            'rtt_p50': p50,
+            'rtt_p95': p95,
+            'rtt_p99': p99,
+            'phi': round(self.failure_detector.phi(time.monotonic()), 2)
+        }
+
+    def start_session(self):
+        """ Zaczyna zapamiętywać wysyłane dane, jeśli wynegocjowaliśmy wznawianie sesji
+        """
+        if SESSION_RESUME_CAPABILITY in self.capabilities:
+            self.outbound.keep_history(config.resume_buffer_size)
+
+    def send_join(self):
+        """ Wysyła komunikat "join", jeśli to my nawiązaliśmy połączenie
+        (przy wznawianiu sesji - z pozycją, do której odebraliśmy dane)
+        """
+        if not self.is_incoming:
+            resume = self.resuming.received_bytes if self.resuming else None
+            msg = JoinMessage(own_id, own_capabilities(), resume)
+            self.send(msg.to_bytes(), msg)
+
     def run(self):
         """
         Pętla wątku peera
         """
-        if not self.is_incoming:
-            # Wysyłamy wiadomość "join"
-            msg = JoinMessage(own_id)
-            self.send(msg.to_bytes())
+        # Uruchamiamy writera
+        writer = Thread(target=self.write_loop)
+        writer.setDaemon(True)
+        writer.start()
+        # Wysyłamy wiadomość "join"
+        self.send_join()
 
         # Wchodzimy w tryb odbierania
         self.receive()
+        self.outbound.close()
 
 
 class PeerPool(Thread):
@@ -121,6 +390,8 @@ class PeerPool(Thread):
     Pula peerów, do których jesteśmy podłączeni
     """
     peers = []
+    # Zapis ruchu do pliku (CaptureWriter) przekazywany tworzonym peerom
+    capture = None
 
     def __init__(self, port: int, stop_event: Event, queue_to_ui: Queue):
         Thread.__init__(self)
@@ -136,52 +407,148 @@ class PeerPool(Thread):
         """
         Główna pętla wątku, otwiera gniazdo serwera i przyjmuje połączenia
         """
-        logger.info("Creating socket...: port: %s" % self.port)
-        sock = self.server_sock = socket(AF_INET, SOCK_STREAM)
-        # Dzięki tej opcji gniazda nie powinny zostawać otwarte
-        sock.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
-        sock.bind((self.ip, self.port))
-        sock.listen(1)
+        sock = self.open_server_socket()
         while self.running:
             try:
                 sock.settimeout(1)
                 conn, addr = sock.accept()
                 sock.settimeout(None)
-                peer = Peer(conn, self.stop_event, self.queue_to_ui)
-                self.peers.append(peer)
+                peer = self.create_peer(conn)
                 peer.is_incoming = True
-                peer.start()
+                self.add_peer(peer)
             except timeout:
                 pass
             except error:
                 pass
         sock.close()
 
-    def connect_to(self, ip, port: int):
+    def open_server_socket(self):
+        """ Otwiera gniazdo serwera nasłuchujące na połączenia od innych klientów
+        :return: gniazdo
+        """
+        logger.info("Creating socket...: port: %s" % self.port)
+        sock = self.server_sock = socket(AF_INET, SOCK_STREAM)
+        # Dzięki tej opcji gniazda nie powinny zostawać otwarte
+        sock.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+        sock.bind((self.ip, self.port))
+        sock.listen(config.listen_backlog)
+        return sock
+
+    def connect_to(self, ip, port: int, resuming=None):
         """ Nawiązuje połączenie z innym klientem
 
         :param ip: ip (string)
         :param port: port (int)
-        :return: nic
+        :param resuming: peer, którego sesję wznawiamy (None - nowe połączenie)
+        :return: peer
         """
         sock = socket(AF_INET, SOCK_STREAM)
+        if resuming:
+            sock.settimeout(config.socket_wait_timeout)
         sock.connect((ip, port))
+        sock.settimeout(None)
+        peer = self.create_peer(sock)
+        peer.resuming = resuming
+        self.add_peer(peer)
+        return peer
+
+    def create_peer(self, sock: SocketType):
+        """ Tworzy obiekt peera dla nawiązanego połączenia
+        :param sock: gniazdo
+        :return: peer
+        """
         peer = Peer(sock, self.stop_event, self.queue_to_ui)
+        peer.resume_handler = self.resume
+        peer.capture = self.capture
+        return peer
+
+    def add_peer(self, peer: Peer):
+        """ Dodaje peera do puli i uruchamia jego obsługę
+        :param peer: peer
+        """
         self.peers.append(peer)
         peer.start()
 
-    def send(self, data: Message, excluded_client_id=None):
+    def resume(self, peer: Peer, msg: Message):
+        """ Wznawia sesję z klientem na nowym połączeniu (wywoływane z wątku obsługującego połączenie)
+        Strona przyjmująca połączenie odbiera JoinMessage z pozycją, do której klient odebrał dane, odpowiada
+        ResumeMessage i dosyła brakującą końcówkę; klient po odebraniu ResumeMessage robi to samo. Klient zachowuje
+        swoje miejsce w tablicy klientów (kontroler nie dostaje ani quit, ani join).
+        :param peer: nowe, jeszcze niezarejestrowane połączenie
+        :param msg: JoinMessage z polem resume lub ResumeMessage
+        """
+        if type(msg) is ResumeMessage:
+            old = peer.resuming
+            offset = msg.last_seen
+        else:
+            old = next((p for p in self.peers if p is not peer and p.client_id == msg.client_id and
+                        p.is_resumable()), None)
+            offset = msg.resume
+        if old is None or old.client_id != msg.client_id or not old.outbound.can_resume(offset):
+            logger.warn("Cannot resume session with %s - closing connection" % msg.client_id)
+            self.__close_connection(peer)
+            return
+        if old.enabled:
+            # Nie zauważyliśmy jeszcze zerwania poprzedniego połączenia
+            self.__close_connection(old)
+        peer.capabilities = old.capabilities
+        peer.received_bytes = old.received_bytes
+        if type(msg) is JoinMessage:
+            reply = ResumeMessage(own_id, old.received_bytes)
+            peer.send(reply.to_bytes(), reply)
+        if not old.outbound.hand_over(peer.outbound, offset):
+            logger.warn("Cannot resume session with %s - data no longer available" % msg.client_id)
+            self.__close_connection(peer)
+            return
+        peer.client_id = old.client_id
+        if old in self.peers:
+            self.peers.remove(old)
+        logger.info("Session with %s resumed, resending %s bytes" % (peer.client_id, peer.outbound.queued_bytes))
+
+    @staticmethod
+    def __close_connection(peer: Peer):
+        """ Wyłącza peera i zamyka jego połączenie - wątek (lub zadanie) obsługujący połączenie zakończy się sam
+        """
+        peer.enabled = False
+        try:
+            peer.sock.shutdown(SHUT_RDWR)
+        except OSError:
+            pass
+
+    def send(self, data: Message, excluded_client_id=None, raw=None):
         """ Wysyła dane do wszystkich zarejestrowanych klientów
         :param data: dane komunikatu
         :param excluded_client_id: klient, którego należy pominąć przy wysyłaniu
+        :param raw: gotowa ramka z komunikatem - wysyłana bez zmian do klientów używających jej formatu
         """
         if not self.peers:
             logger.debug("No peers connected!")
             return
-        for peer in self.peers:
-            bytedata = data.to_bytes()
+        # Komunikat kodujemy co najwyżej raz dla każdego formatu
+        encoded = {wire_format_of(raw): raw} if raw else {}
+        # Kopia listy - peer może zostać usunięty w trakcie wysyłania (polityka wolnego odbiorcy 'disconnect')
+        for peer in list(self.peers):
             if peer.is_active() and peer.client_id != excluded_client_id:
-                self.__send_to_peer(peer, bytedata)
+                wire_format = peer.wire_format
+                bytedata = encoded.get(wire_format)
+                if bytedata is None:
+                    bytedata = encoded[wire_format] = to_wire(data, wire_format)
+                self.__send_to_peer(peer, bytedata, data)
+
+    def forward(self, sm: SignedMessage):
+        """ Przekazuje odebrany komunikat do pozostałych klientów, w miarę możliwości bez ponownego kodowania
+        :param sm: podpisany komunikat
+        """
+        self.send(sm.message, sm.client_id, sm.raw)
+
+    def forward_batch(self, sms: []):
+        """ Przekazuje do pozostałych klientów serię komunikatów otrzymanych od tego samego klienta
+        Każdy komunikat trafia do kolejki peera osobno, razem z obiektem komunikatu - dzięki temu polityka
+        wolnego odbiorcy może odrzucać i sklejać przekazywane komunikaty paint.
+        :param sms: lista podpisanych komunikatów (z tym samym client_id; kontynuacje linii sklejone przez kontroler)
+        """
+        for sm in sms:
+            self.forward(sm)
 
     def send_to_client(self, msg: Message, client_id: str):
         """ Wysyła komunikat do klienta o podanym identyfikatorze
@@ -191,40 +558,117 @@ class PeerPool(Thread):
         for peer in self.peers:
             if peer.client_id == client_id:
                 if peer.is_active():
-                    self.__send_to_peer(peer, msg.to_bytes())
+                    self.__send_to_peer(peer, peer.encode(msg), msg)
                 else:
                     logger.warn("Peer %s not active!" % client_id)
                 return
         logger.warn("Client with id: %s not found" % client_id)
 
-    def __send_to_peer(self, peer: Peer, bytedata: bytes):
+    def reserve_for_client(self, client_id: str):
+        """ Rezerwuje miejsce w kolejce wychodzącej klienta na komunikat, który będzie gotowy później.
+        Komunikaty wysłane do klienta w międzyczasie zostaną wysłane po nim.
+        :param client_id: identyfikator klienta
+        :return: funkcja f(msg) wysyłająca komunikat na zarezerwowane miejsce (f(None) - rezygnacja z rezerwacji)
+         lub None, jeśli klient nie jest aktywny
+        """
+        for peer in self.peers:
+            if peer.client_id == client_id and peer.is_active():
+                try:
+                    reservation = peer.outbound.reserve()
+                except OSError:
+                    logger.error("Error during sending to peer: %s. DISCONNECTING" % peer.client_id)
+                    self.__remove_peer(peer)
+                    return None
+                return lambda msg: peer.send_reserved(reservation, msg)
+        logger.warn("Client with id: %s not found" % client_id)
+        return None
+
+    def __send_to_peer(self, peer: Peer, bytedata: bytes, msg: Message):
         """ Wysyła dane do danego klienta
-        W przypadku błędu komunikacji klient jest usuwany.
+        W przypadku błędu komunikacji lub przepełnienia kolejki klient jest usuwany.
         :param peer: klient
         :param bytedata: dane
+        :param msg: komunikat
         """
         try:
-            peer.send(bytedata)
+            peer.send(bytedata, msg)
         except OSError:
             logger.error("Error during sending to peer: %s. DISCONNECTING" % peer.client_id)
             self.__remove_peer(peer)
 
+    def send_keep_alive(self):
+        """ Wysyła komunikat keepAlive do wszystkich aktywnych klientów
+        """
+        for peer in list(self.peers):
+            if peer.enabled and peer.is_registered():
+                try:
+                    peer.send_keep_alive()
+                except OSError:
+                    logger.warn("Cannot send keepAlive to %s: %s" % (peer.client_id, str(sys.exc_info())))
+                    peer.enabled = False
+
     def check_alive(self):
         """ Sprawdza, czy klienci są żywi i wyłącza ich, jeśli nie
+        Klient, od którego dostawaliśmy komunikaty keepAlive, jest uznawany za martwy, gdy poziom podejrzenia
+        awarii (phi) przekroczy config.phi_threshold - zerwane połączenie (np. półotwarte, bez RST) wykrywamy
+        po kilku sekundach, a nie po czasie oczekiwania TCP.
         """
-        for peer in self.peers:
-            if not peer.enabled:
-                logger.warn("Peer %s has been disabled, removing" % peer.client_id)
-                self.__remove_peer(peer)
+        now = time.monotonic()
+        for peer in list(self.peers):
+            if peer.enabled and peer.failure_detector.is_monitoring():
+                phi = peer.failure_detector.phi(now)
+                if phi > config.phi_threshold:
+                    logger.warn("Peer %s is not responding (phi = %.1f), closing connection" % (peer.client_id, phi))
+                    self.__close_connection(peer)
+            if peer.enabled:
+                continue
+            if peer.is_resumable() and self.running:
+                if peer.suspended_until is None:
+                    logger.warn("Connection with %s lost, waiting %s s for the session to be resumed" %
+                                (peer.client_id, config.resume_grace_period))
+                    peer.suspended_until = now + config.resume_grace_period
+                if now < peer.suspended_until:
+                    if not peer.is_incoming:
+                        self.__reconnect(peer)
+                    continue
+            logger.warn("Peer %s has been disabled, removing" % peer.client_id)
+            self.__remove_peer(peer)
+
+    def __reconnect(self, peer: Peer):
+        """ Próbuje ponownie połączyć się z klientem i wznowić sesję
+        :param peer: peer, z którym zerwano połączenie
+        """
+        attempt = peer.resume_attempt
+        if attempt is not None and attempt.enabled:
+            # Poprzednia próba jeszcze trwa
+            return
+        try:
+            peer.resume_attempt = self.connect_to(peer.address[0], peer.address[1], peer)
+        except OSError:
+            logger.debug("Cannot reconnect to %s: %s" % (peer.client_id, str(sys.exc_info())))
 
     def __remove_peer(self, peer: Peer):
         """ Odłącza wybranego klienta
         :param peer: klient
         """
-        peer.enabled = False
-        self.peers.remove(peer)
-        # Wysyłamy do kontrolera info o usunięciu - zostanie rozpropagowane
-        self.queue_to_ui.put(SignedMessage(own_id, InternalQuitMessage(str(peer.client_id))))
+        peer.disconnect()
+        if peer in self.peers:
+            self.peers.remove(peer)
+        if peer.is_registered():
+            # Wysyłamy do kontrolera info o usunięciu - zostanie rozpropagowane
+            self.queue_to_ui.put(SignedMessage(own_id, InternalQuitMessage(str(peer.client_id))))
+
+    def queue_stats(self):
+        """ Zwraca statystyki kolejek wychodzących peerów
+        :return: słownik: id klienta -> statystyki
+        """
+        return {str(peer.client_id): peer.outbound.stats() for peer in self.peers}
+
+    def heartbeat_stats(self):
+        """ Zwraca statystyki połączeń z peerami (RTT, poziom podejrzenia awarii)
+        :return: słownik: id klienta -> statystyki
+        """
+        return {str(peer.client_id): peer.heartbeat_stats() for peer in self.peers if peer.is_registered()}
 
     def stop(self):
         """
@@ -241,7 +685,7 @@ class PeerPool(Thread):
 
 
 class ClientStatusMonitor(TimerThread):
-    """ Wątek sprawdzający dostępność klientów
+    """ Wątek wysyłający komunikaty keepAlive i sprawdzający dostępność klientów
     """
 
     def __init__(self, stopped, peer_pool: PeerPool):
@@ -249,13 +693,18 @@ class ClientStatusMonitor(TimerThread):
         self.peer_pool = peer_pool
 
     def execute(self):
+        self.peer_pool.send_keep_alive()
         # Sprawdzamy, czy klienty są aktywne
         self.peer_pool.check_alive()
+        logger.debug("Outbound queues: %s" % self.peer_pool.queue_stats())
+        logger.debug("Connections: %s" % self.peer_pool.heartbeat_stats())
 
 
 class MessageBuilder:
     """ Klasa do budowania komunikatów - niektóre klienty wysyłają je w częściach, zatem trzeba poskładać do całości.
     Obsługuje również sytuację, w której wiele komunikatów zostanie wysłanych w jednym pakiecie TCP
+    Przetwarza dane bajt po bajcie - peery korzystają z MessageFramer, ta klasa pozostaje jako punkt odniesienia
+    (benchmarks/framing.py)
     """
 
     def __init__(self):
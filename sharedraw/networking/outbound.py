@@ -0,0 +1,334 @@
+""" Kolejki wychodzące peerów
+Każdy peer posiada własną, ograniczoną kolejkę ramek do wysłania, opróżnianą przez osobnego writera
+(wątek, pętlę zdarzeń lub zadanie asyncio). Wysyłanie z kontrolera lub UI sprowadza się do wstawienia do kolejki,
+dzięki czemu wolny klient nie spowalnia pozostałych.
+"""
+from collections import deque
+from threading import Condition
+
+from sharedraw.config import config
+from sharedraw.networking.messages import *
+
+__author__ = 'michalek'
+logger = logging.getLogger(__name__)
+
+# Polityki postępowania z wolnym odbiorcą (po przekroczeniu górnego progu)
+POLICY_DROP = 'drop'
+POLICY_MERGE = 'merge'
+POLICY_DISCONNECT = 'disconnect'
+
+
+class SlowConsumerError(OSError):
+    """ Wyjątek zgłaszany, gdy peer nie nadąża z odbiorem i należy go odłączyć
+    """
+    pass
+
+
+class SendHistory:
+    """ Ostatnie bajty wysłane do peera (co najwyżej capacity) - pozwalają dosłać brakującą końcówkę strumienia
+    po wznowieniu sesji. Pozycje liczone są od początku pierwotnego połączenia.
+    """
+
+    def __init__(self, start: int, capacity: int):
+        """
+        :param start: pozycja w strumieniu, od której zapamiętujemy dane
+        :param capacity: maksymalna liczba zapamiętanych bajtów
+        """
+        self.start = start
+        self.end = start
+        self.capacity = capacity
+        self.__chunks = deque()
+
+    def append(self, data: bytes):
+        self.__chunks.append(data)
+        self.end += len(data)
+        while self.end - self.start > self.capacity and self.__chunks:
+            self.start += len(self.__chunks.popleft())
+
+    def since(self, offset: int):
+        """ Zwraca dane wysłane od podanej pozycji
+        :param offset: pozycja w strumieniu
+        :return: bajty lub None, jeśli dane nie są już (lub jeszcze) dostępne
+        """
+        if offset < self.start or offset > self.end:
+            return None
+        return b''.join(self.__chunks)[offset - self.start:]
+
+
+class OutboundQueue:
+    """ Ograniczona kolejka ramek do wysłania z progami (watermarks) i polityką wolnego odbiorcy
+    Po przekroczeniu górnego progu kolejka przechodzi w stan przeciążenia, w którym komunikaty paint są
+    odrzucane (drop) lub sklejane z poprzednimi (merge), albo peer jest odłączany (disconnect).
+    Stan przeciążenia kończy się po spadku poniżej dolnego progu.
+    """
+
+    def __init__(self, encode, notify=None, high_watermark=None, low_watermark=None, max_size=None, policy=None):
+        """
+        :param encode: funkcja kodująca komunikat do bajtów (używana przy sklejaniu)
+        :param notify: funkcja wywoływana po wstawieniu ramki do pustej kolejki (budzi writera)
+        :param high_watermark: górny próg [B]
+        :param low_watermark: dolny próg [B]
+        :param max_size: bezwzględny limit rozmiaru kolejki [B] - po przekroczeniu peer jest odłączany
+        :param policy: polityka wolnego odbiorcy
+        """
+        self.encode = encode
+        self.notify = notify
+        self.high_watermark = high_watermark or config.send_queue_high_watermark
+        self.low_watermark = low_watermark or config.send_queue_low_watermark
+        self.max_size = max_size or config.send_queue_max_size
+        self.policy = policy or config.slow_consumer_policy
+        self.congested = False
+        self.closed = False
+        # Historia wysłanych danych (SendHistory) - tylko dla peerów, z którymi można wznowić sesję.
+        # Po zamknięciu kolejki dane wstawiane są wprost do historii.
+        self.history = None
+        # Kolejka nowego połączenia, które przejęło sesję (hand_over)
+        self.successor = None
+        # Elementy: [bajty, komunikat, czy zapisać w historii]
+        self.__frames = deque()
+        self.__cond = Condition()
+        self.queued_bytes = 0
+        # Pozycja w strumieniu sesji: wysłane bajty bez komunikatów dotyczących samego połączenia (np. keepAlive) -
+        # tak samo liczy je odbiorca (Peer.received_bytes)
+        self.session_bytes = 0
+        # Statystyki
+        self.sent_frames = 0
+        self.sent_bytes = 0
+        self.dropped_frames = 0
+        self.merged_frames = 0
+        self.max_queued_bytes = 0
+        self.congestion_count = 0
+
+    def put(self, data: bytes, msg=None):
+        """ Wstawia ramkę do kolejki, stosując politykę wolnego odbiorcy
+        :param data: bajty do wysłania
+        :param msg: komunikat, z którego powstały bajty (pozwala odrzucać i sklejać komunikaty paint)
+        :raise SlowConsumerError: jeśli peer powinien zostać odłączony
+        """
+        with self.__cond:
+            if self.closed:
+                if msg is not None and msg.link_local:
+                    # Komunikaty dotyczące samego połączenia (np. keepAlive) nie przechodzą na następne połączenie
+                    return
+                if self.successor is not None:
+                    self.successor.put(data, msg)
+                    return
+                if self.history is not None:
+                    # Połączenie zerwane - zapamiętujemy dane do wysłania po wznowieniu sesji
+                    self.history.append(data)
+                    return
+                raise SlowConsumerError("Outbound queue closed")
+            was_empty = not self.__frames
+            # Progi porównujemy z zaległościami sprzed wstawienia - pojedyncza duża ramka (np. obrazek)
+            # nie oznacza wolnego odbiorcy
+            backlog = self.queued_bytes
+            if backlog > self.max_size or (backlog > self.high_watermark and self.policy == POLICY_DISCONNECT):
+                self.closed = True
+                self.__cond.notify_all()
+                raise SlowConsumerError("Slow consumer: %s bytes queued" % backlog)
+            if backlog > self.high_watermark and not self.congested:
+                self.congested = True
+                self.congestion_count += 1
+                logger.warn("Outbound queue over high watermark: %s bytes" % backlog)
+            if self.congested and type(msg) is PaintMessage:
+                if self.policy == POLICY_DROP:
+                    self.dropped_frames += 1
+                    return
+                if self.policy == POLICY_MERGE and self.__merge(msg):
+                    return
+            self.__frames.append([data, msg, msg is None or not msg.link_local])
+            self.queued_bytes += len(data)
+            self.max_queued_bytes = max(self.max_queued_bytes, self.queued_bytes)
+            self.__cond.notify()
+        if was_empty and self.notify:
+            self.notify()
+
+    def reserve(self):
+        """ Rezerwuje miejsce w kolejce dla ramki, która nie jest jeszcze gotowa (np. kodowany w tle obrazek).
+        Ramki wstawione później czekają, aż rezerwacja zostanie wypełniona.
+        :return: rezerwacja (przekazywana do fill)
+        :raise SlowConsumerError: jeśli kolejka jest zamknięta
+        """
+        with self.__cond:
+            if self.closed:
+                raise SlowConsumerError("Outbound queue closed")
+            reservation = [None, None, True]
+            self.__frames.append(reservation)
+            return reservation
+
+    def fill(self, reservation: [], data: bytes, msg=None):
+        """ Wypełnia zarezerwowane miejsce w kolejce
+        :param reservation: rezerwacja zwrócona przez reserve
+        :param data: bajty do wysłania
+        :param msg: komunikat, z którego powstały bajty
+        """
+        with self.__cond:
+            if self.closed:
+                return
+            reservation[0] = data
+            reservation[1] = msg
+            self.queued_bytes += len(data)
+            self.max_queued_bytes = max(self.max_queued_bytes, self.queued_bytes)
+            self.__cond.notify()
+        if self.notify:
+            self.notify()
+
+    def cancel(self, reservation: []):
+        """ Usuwa niewypełnioną rezerwację z kolejki - ramki wstawione po niej mogą zostać wysłane
+        :param reservation: rezerwacja zwrócona przez reserve
+        """
+        with self.__cond:
+            # Porównujemy tożsamość - puste rezerwacje są sobie równe
+            for i, frame in enumerate(self.__frames):
+                if frame is reservation:
+                    del self.__frames[i]
+                    break
+            else:
+                return
+            self.__cond.notify()
+        if self.notify:
+            self.notify()
+
+    def has_ready(self):
+        """ Zwraca, czy na początku kolejki jest ramka gotowa do wysłania
+        """
+        frames = self.__frames
+        return bool(frames) and frames[0][0] is not None
+
+    def __merge(self, msg: PaintMessage):
+        """ Skleja komunikat paint z ostatnim oczekującym, jeśli jest jego kontynuacją
+        :return: True, jeśli udało się skleić
+        """
+        if not self.__frames:
+            return False
+        last = self.__frames[-1]
+        prev = last[1]
+        if type(prev) is not PaintMessage or not prev.is_continued_by(msg):
+            return False
+        merged = prev.merged_with(msg)
+        data = self.encode(merged)
+        self.queued_bytes += len(data) - len(last[0])
+        last[0] = data
+        last[1] = merged
+        self.merged_frames += 1
+        return True
+
+    def pop(self):
+        """ Pobiera ramkę z początku kolejki bez czekania
+        :return: bajty lub None, jeśli kolejka jest pusta
+        """
+        with self.__cond:
+            return self.__pop()
+
+    def get(self, timeout=None):
+        """ Pobiera ramkę z początku kolejki, czekając na nią co najwyżej timeout sekund
+        :return: bajty lub None, jeśli kolejka jest pusta lub zamknięta
+        """
+        with self.__cond:
+            if not self.has_ready() and not self.closed:
+                self.__cond.wait(timeout)
+            return self.__pop()
+
+    def __pop(self):
+        if not self.has_ready() or self.closed:
+            return None
+        data, msg, record = self.__frames.popleft()
+        if record:
+            self.session_bytes += len(data)
+            if self.history is not None:
+                self.history.append(data)
+        self.queued_bytes -= len(data)
+        self.sent_frames += 1
+        self.sent_bytes += len(data)
+        if self.congested and self.queued_bytes <= self.low_watermark:
+            self.congested = False
+            logger.info("Outbound queue back under low watermark")
+        return data
+
+    def close(self):
+        """ Zamyka kolejkę i budzi czekającego writera
+        """
+        with self.__cond:
+            self.__close()
+        if self.notify:
+            self.notify()
+
+    def __close(self):
+        if self.history is not None:
+            # Niewysłane ramki trafiają do historii - zostaną wysłane po wznowieniu sesji
+            for data, msg, record in self.__frames:
+                if data is not None and record:
+                    self.history.append(data)
+        self.closed = True
+        self.__frames.clear()
+        self.queued_bytes = 0
+        self.__cond.notify_all()
+
+    def keep_history(self, capacity: int):
+        """ Zaczyna zapamiętywać wysyłane dane (umożliwia wznowienie sesji)
+        :param capacity: maksymalna liczba zapamiętanych bajtów
+        """
+        with self.__cond:
+            if self.history is None:
+                self.history = SendHistory(self.session_bytes, capacity)
+
+    def can_resume(self, offset: int):
+        """ Zwraca, czy można dosłać dane od podanej pozycji strumienia
+        """
+        with self.__cond:
+            return self.history is not None and self.history.start <= offset <= self.history.end
+
+    def hand_over(self, successor, offset: int):
+        """ Przekazuje sesję kolejce nowego połączenia: zamyka kolejkę, wstawia do nowej kolejki dane wysłane od
+        podanej pozycji, a kolejne wstawiane dane przekierowuje do niej
+        :param successor: kolejka nowego połączenia
+        :param offset: pozycja w strumieniu, do której druga strona odebrała dane
+        :return: True, jeśli się udało
+        """
+        with self.__cond:
+            if self.history is None:
+                return False
+            if not self.closed:
+                self.__close()
+            tail = self.history.since(offset)
+            if tail is None:
+                return False
+            successor.adopt(self.history, tail)
+            self.successor = successor
+            self.history = None
+        if self.notify:
+            self.notify()
+        return True
+
+    def adopt(self, history: SendHistory, tail: bytes):
+        """ Przejmuje historię sesji od kolejki poprzedniego połączenia
+        :param history: historia wysłanych danych
+        :param tail: dane do ponownego wysłania (nie są ponownie zapisywane w historii)
+        """
+        with self.__cond:
+            self.history = history
+            if tail:
+                self.__frames.append([tail, None, False])
+                self.queued_bytes += len(tail)
+            self.__cond.notify()
+        if self.notify:
+            self.notify()
+
+    def __len__(self):
+        return len(self.__frames)
+
+    def stats(self):
+        """ Zwraca statystyki kolejki
+        :return: słownik
+        """
+        return {
+            'depth': len(self.__frames),
+            'queued_bytes': self.queued_bytes,
+            'max_queued_bytes': self.max_queued_bytes,
+            'sent_frames': self.sent_frames,
+            'sent_bytes': self.sent_bytes,
+            'dropped_frames': self.dropped_frames,
+            'merged_frames': self.merged_frames,
+            'congested': self.congested,
+            'congestion_count': self.congestion_count
+        }
@@ -0,0 +1,29 @@
+""" Serwer pośredniczący dla wielu klientów połączonych w gwiazdę
+Jest to zwykły klient sharedraw (ten sam protokół: joined, image, paint, passToken, ...) uruchomiony bez UI,
+z jedną pętlą zdarzeń dla wszystkich połączeń. Trzyma w pamięci aktualny obrazek (wysyłany dołączającym klientom)
+i tablicę klientów z logiką tokena - każdy komunikat dociera do pozostałych klientów przez jeden węzeł pośredni,
+niezależnie od ich liczby.
+
+Uruchomienie: python sharedraw-relay.py [-p port] [opcje jak dla sharedraw.py]
+"""
+import logging
+
+from sharedraw.config import config
+from sharedraw.main import run
+
+__author__ = 'michalek'
+
+# Ustawienia domyślne serwera - opcje z linii poleceń mają pierwszeństwo
+RELAY_NETWORK_MODE = 'selector'
+RELAY_LISTEN_BACKLOG = 1024
+# Przy setkach klientów logowanie każdej ramki kosztowałoby więcej niż jej przekazanie
+RELAY_LOG_LEVEL = logging.WARNING
+
+
+def main():
+    config.headless = True
+    config.network_mode = RELAY_NETWORK_MODE
+    config.listen_backlog = RELAY_LISTEN_BACKLOG
+    config.load()
+    logging.getLogger().setLevel(RELAY_LOG_LEVEL)
+    return run()
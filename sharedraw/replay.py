@@ -0,0 +1,157 @@
+""" Odtwarzanie zapisanego ruchu sieciowego (plik z opcji -c, sharedraw.networking.capture)
+Komunikaty paint i clean z zapisu wysyłane są do działającego klienta (np. bez UI) tak, jakby pochodziły od nowego
+peera - z zachowaniem odstępów czasowych (przyspieszonych N razy) lub najszybciej, jak to możliwe.
+
+Uruchomienie: python sharedraw-replay.py [-s szybkość] [-d in|out] [-f peer] plik host port
+  -s - mnożnik szybkości (domyślnie 1; 0 - bez czekania)
+  -d - odtwarzane ramki: odebrane (in, domyślnie) lub wysłane (out) przez klienta, który zapisał ruch
+  -f - tylko ramki od/do danego peera (id klienta lub adres)
+"""
+import logging
+import socket
+import sys
+import time
+from getopt import getopt
+from threading import Thread, Event
+
+from sharedraw.config import own_id
+from sharedraw.networking.binary import from_wire, to_raw
+from sharedraw.networking.capture import read_capture, DIRECTION_IN, DIRECTION_OUT
+from sharedraw.networking.framing import MessageFramer
+from sharedraw.networking.messages import JoinMessage, PaintMessage, CleanMessage
+
+__author__ = 'michalek'
+logger = logging.getLogger(__name__)
+
+# Typy komunikatów przesyłane do odtwarzającego klienta (pozostałe dotyczą połączenia lub tokena)
+REPLAYED_TYPES = (PaintMessage, CleanMessage)
+
+
+def load_frames(path: str, direction=DIRECTION_IN, peer=None):
+    """ Wczytuje ramki do odtworzenia
+    :param path: plik z zapisem ruchu
+    :param direction: DIRECTION_IN lub DIRECTION_OUT
+    :param peer: opis peera (None - wszystkie)
+    :return: lista par (czas, ramka gotowa do wysłania)
+    """
+    frames = []
+    for timestamp, frame_direction, label, data in read_capture(path):
+        if frame_direction != direction or (peer is not None and label != peer):
+            continue
+        # Ramka wychodząca może zawierać serię komunikatów
+        for frame in MessageFramer().append(data).fetch():
+            if type(from_wire(frame)) in REPLAYED_TYPES:
+                frames.append((timestamp, to_raw(frame)))
+    return frames
+
+
+class Replayer:
+    """ Wysyła ramki do klienta jako nowy peer
+    """
+
+    def __init__(self, frames: [], speed=1.0):
+        """
+        :param frames: lista par (czas, ramka)
+        :param speed: mnożnik szybkości (0 - bez czekania)
+        """
+        self.frames = frames
+        self.speed = speed
+        self.sock = None
+        self.joined = Event()
+        self.received_bytes = 0
+
+    def connect(self, host: str, port: int, timeout=10):
+        """ Łączy się z klientem i czeka na obrazek (odpowiedź na "joined")
+        :raise OSError: jeśli klient nie odpowiedział
+        """
+        self.sock = socket.create_connection((host, port))
+        reader = Thread(target=self.__drain)
+        reader.setDaemon(True)
+        reader.start()
+        self.sock.sendall(JoinMessage(own_id).to_bytes())
+        if not self.joined.wait(timeout):
+            raise OSError("No response from %s:%s" % (host, port))
+
+    def __drain(self):
+        """ Odbiera (i pomija) wszystko, co wysyła klient - inaczej uznałby nas za wolnego odbiorcę
+        """
+        framer = MessageFramer()
+        while True:
+            try:
+                data = self.sock.recv(65536)
+            except OSError:
+                break
+            if not data:
+                break
+            self.received_bytes += len(data)
+            if not self.joined.is_set() and framer.append(data).fetch():
+                self.joined.set()
+        self.joined.set()
+
+    def run(self):
+        """ Wysyła ramki zgodnie z zapisanymi odstępami czasowymi
+        :return: słownik ze statystykami
+        """
+        sent_bytes = 0
+        max_lag = 0
+        start = time.perf_counter()
+        first = self.frames[0][0] if self.frames else 0
+        pending = []
+        for timestamp, frame in self.frames:
+            if self.speed > 0:
+                due = start + (timestamp - first) / self.speed
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    if pending:
+                        self.sock.sendall(b''.join(pending))
+                        pending = []
+                    time.sleep(delay)
+                else:
+                    max_lag = max(max_lag, -delay)
+            pending.append(frame)
+            sent_bytes += len(frame)
+            if len(pending) >= 256:
+                self.sock.sendall(b''.join(pending))
+                pending = []
+        if pending:
+            self.sock.sendall(b''.join(pending))
+        elapsed = time.perf_counter() - start
+        return {
+            'frames': len(self.frames),
+            'bytes': sent_bytes,
+            'elapsed': elapsed,
+            'frames_per_second': len(self.frames) / elapsed if elapsed else 0,
+            'max_lag': max_lag
+        }
+
+    def close(self):
+        self.sock.close()
+
+
+def main():
+    opts, args = getopt(sys.argv[1:], "s:d:f:")
+    speed, direction, peer = 1.0, DIRECTION_IN, None
+    for opt, arg in opts:
+        if opt == "-s":
+            speed = float(arg)
+        elif opt == "-d":
+            direction = DIRECTION_OUT if arg == 'out' else DIRECTION_IN
+        elif opt == "-f":
+            peer = arg
+    if len(args) != 3:
+        print(__doc__)
+        return 2
+    path, host, port = args
+    frames = load_frames(path, direction, peer)
+    if not frames:
+        print("No paint or clean frames to replay in %s" % path)
+        return 1
+    print("Replaying %s frames (%.1f s of traffic) to %s:%s at %s" %
+          (len(frames), frames[-1][0] - frames[0][0], host, port, ('%sx' % speed) if speed > 0 else 'max speed'))
+    replayer = Replayer(frames, speed)
+    replayer.connect(host, int(port))
+    stats = replayer.run()
+    replayer.close()
+    print("Sent %(frames)s frames, %(bytes)s bytes in %(elapsed).2f s (%(frames_per_second).0f frames/s), "
+          "max lag %(max_lag).3f s" % stats)
+    return 0
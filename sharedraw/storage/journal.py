@@ -0,0 +1,269 @@
+""" Dziennik zmian obrazka (append-only) z punktami kontrolnymi - pozwala odtworzyć tablicę po restarcie
+Każdy narysowany komunikat paint i clean dopisywany jest do pliku dziennika odwzorowanego w pamięci (mmap).
+Co journal_checkpoint_records rekordów zapisywany jest punkt kontrolny (obrazek w postaci kafelkowej) - odtworzenie
+wymaga wczytania punktu kontrolnego i co najwyżej tylu rekordów.
+
+Dziennik składa się z kolejno numerowanych plików. Punkt kontrolny zamyka bieżący plik (kolejne rekordy trafiają
+do następnego) i kopiuje obrazek - a kodowanie i zapis kopii na dysk odbywają się w tle. Dopiero po zapisaniu punktu
+kontrolnego usuwane są pliki, które obejmuje. Po awarii w trakcie zapisu odtwarzany jest poprzedni punkt kontrolny
+i wszystkie pozostałe pliki (ponowne nałożenie rekordów objętych punktem kontrolnym niczego nie zmienia - rysowanie
+i czyszczenie nadpisują piksele).
+
+Rekord: długość (u32) | crc32 treści (u32) | treść - ramka w formacie binarnym (sharedraw.networking.binary)
+Rekord o długości 0 oznacza koniec dziennika; odczyt kończy się też na pierwszym uszkodzonym rekordzie
+(niedokończony zapis przy awarii).
+"""
+import mmap
+import os
+import re
+import struct
+import time
+import zlib
+from threading import Lock, Thread
+
+from sharedraw.config import config
+from sharedraw.networking.binary import to_binary, from_binary
+from sharedraw.networking.messages import *
+from sharedraw.ui.canvas import ImageCanvas
+from sharedraw.ui.tiles import encode_tiles, decode_tiles
+
+__author__ = 'michalek'
+logger = logging.getLogger(__name__)
+
+JOURNAL_FILE = 'journal.%08d.log'
+CHECKPOINT_FILE = 'checkpoint.sdt'
+
+_JOURNAL_FILE_NAME = re.compile(r'^journal\.(\d{8})\.log$')
+_RECORD = struct.Struct('<II')
+
+
+def read_records(data):
+    """ Odczytuje poprawne rekordy od początku pliku dziennika
+    :param data: zawartość pliku (bajty lub mmap)
+    :return: generator par (pozycja za rekordem, komunikat)
+    """
+    pos = 0
+    end = len(data) - _RECORD.size
+    while pos <= end:
+        length, crc = _RECORD.unpack_from(data, pos)
+        start = pos + _RECORD.size
+        if length == 0 or start + length > len(data):
+            return
+        payload = data[start:start + length]
+        if zlib.crc32(payload) != crc:
+            logger.warn("Journal record at %s is damaged, ignoring the rest of the journal file" % pos)
+            return
+        msg = from_binary(payload)
+        if msg is None:
+            return
+        pos = start + length
+        yield pos, msg
+
+
+def apply(canvas: ImageCanvas, msg: Message):
+    """ Nanosi komunikat z dziennika na obrazek
+    :param canvas: obrazek
+    :param msg: komunikat paint lub clean
+    """
+    if type(msg) is PaintMessage:
+        canvas.draw(msg.changed_pxs, msg.color)
+    elif type(msg) is CleanMessage:
+        canvas.clean_img()
+
+
+class Journal:
+    """ Dziennik zmian obrazka
+    Zapisywane komunikaty muszą być już narysowane - punkt kontrolny zawiera wtedy wszystko, co jest w dzienniku -
+    w kolejności rysowania (sharedraw.ui.view.View rysuje i zapisuje pod wspólną blokadą).
+    Metody mogą być wywoływane z wielu wątków (kontroler, UI); punkty kontrolne zapisywane są w osobnym wątku.
+    """
+
+    def __init__(self, directory: str, image_source=None, sync_interval=None, checkpoint_records=None,
+                 segment_size=None):
+        """
+        :param directory: katalog dziennika
+        :param image_source: funkcja zwracająca (wersja, obrazek PIL lub TiledImage) - potrzebna do punktów kontrolnych
+        :param sync_interval: maksymalny czas [s] pomiędzy kolejnymi zapisami dziennika na dysk (fsync)
+        :param checkpoint_records: liczba rekordów, po której zapisywany jest punkt kontrolny
+        :param segment_size: o tyle bajtów powiększany jest plik dziennika
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.checkpoint_path = os.path.join(directory, CHECKPOINT_FILE)
+        self.image_source = image_source
+        self.sync_interval = sync_interval if sync_interval is not None else config.journal_sync_interval
+        self.checkpoint_records = checkpoint_records or config.journal_checkpoint_records
+        self.segment_size = segment_size or config.journal_segment_size
+        self.__lock = Lock()
+        # Zajęta przez cały czas zapisywania punktu kontrolnego (zwalniana przez wątek zapisujący)
+        self.__checkpoint_lock = Lock()
+        # Bieżący plik dziennika (ostatni - wcześniejsze pozostają po awarii w trakcie zapisu punktu kontrolnego)
+        numbers = self.__file_numbers()
+        self.number = numbers[-1] if numbers else 1
+        self.__fd = None
+        self.__map = None
+        self.__open_file()
+        # Pozycja końca bieżącego pliku i liczba rekordów od ostatniego punktu kontrolnego
+        self.offset = 0
+        self.records = 0
+        for pos, msg in read_records(self.__map):
+            self.offset = pos
+            self.records += 1
+        self.__synced = time.monotonic()
+        # Statystyki
+        self.checkpoints = 0
+
+    def __path(self, number: int):
+        return os.path.join(self.directory, JOURNAL_FILE % number)
+
+    def __file_numbers(self):
+        """ Zwraca numery plików dziennika w katalogu, rosnąco
+        """
+        names = (_JOURNAL_FILE_NAME.match(name) for name in os.listdir(self.directory))
+        return sorted(int(match.group(1)) for match in names if match)
+
+    def __open_file(self):
+        """ Otwiera (lub tworzy) bieżący plik dziennika
+        """
+        self.__fd = os.open(self.__path(self.number), os.O_RDWR | os.O_CREAT, 0o644)
+        self.__map_file(max(os.fstat(self.__fd).st_size, self.segment_size))
+
+    def __close_file(self):
+        """ Zapisuje bieżący plik dziennika na dysk i zamyka go
+        """
+        self.__map.flush()
+        self.__map.close()
+        self.__map = None
+        os.close(self.__fd)
+
+    def __map_file(self, size: int):
+        if self.__map is not None:
+            self.__map.close()
+        os.ftruncate(self.__fd, size)
+        self.__map = mmap.mmap(self.__fd, size)
+
+    def append(self, msg: Message):
+        """ Dopisuje komunikat do dziennika
+        :param msg: komunikat paint lub clean (już narysowany)
+        """
+        self.append_all((msg,))
+
+    def append_all(self, msgs: []):
+        """ Dopisuje komunikaty do dziennika
+        :param msgs: lista komunikatów paint lub clean (już narysowanych)
+        """
+        records = []
+        for msg in msgs:
+            payload = to_binary(msg)
+            records.append(_RECORD.pack(len(payload), zlib.crc32(payload)))
+            records.append(payload)
+        data = b''.join(records)
+        with self.__lock:
+            end = self.offset + len(data)
+            if end + _RECORD.size > len(self.__map):
+                self.__map.flush()
+                self.__map_file(max(len(self.__map) + self.segment_size, end + _RECORD.size))
+            self.__map[self.offset:end] = data
+            self.offset = end
+            self.records += len(msgs)
+            if time.monotonic() - self.__synced >= self.sync_interval:
+                self.__sync()
+            checkpoint = self.records >= self.checkpoint_records and self.image_source is not None
+        if checkpoint:
+            self.checkpoint()
+
+    def __sync(self):
+        self.__map.flush()
+        self.__synced = time.monotonic()
+
+    def sync(self):
+        """ Zapisuje dziennik na dysk
+        """
+        with self.__lock:
+            self.__sync()
+
+    def checkpoint(self, wait=False):
+        """ Zapisuje punkt kontrolny (bieżący obrazek) i usuwa objęte nim pliki dziennika.
+        Pod blokadą wykonywane jest tylko kopiowanie obrazka i przejście do nowego pliku dziennika; kodowanie i zapis na
+        dysk odbywają się w tle.
+        :param wait: czy czekać na zapisanie punktu kontrolnego (np. po zastąpieniu obrazka w całości - rekordy
+         dopisane później nie mogą zostać nałożone na poprzedni punkt kontrolny); bez czekania punkt kontrolny jest
+         pomijany, jeśli poprzedni jest jeszcze zapisywany
+        """
+        if not self.__checkpoint_lock.acquire(blocking=wait):
+            # Kolejna próba przy następnych rekordach
+            return
+        try:
+            with self.__lock:
+                version, img = self.image_source()
+                img = img.copy()
+                covered = self.number
+                self.__close_file()
+                self.number += 1
+                self.__open_file()
+                self.__sync()
+                self.offset = 0
+                self.records = 0
+        except BaseException:
+            self.__checkpoint_lock.release()
+            raise
+        if wait:
+            self.__write_checkpoint(img, covered)
+        else:
+            Thread(target=self.__write_checkpoint, args=(img, covered), name='journal-checkpoint', daemon=True).start()
+
+    def __write_checkpoint(self, img, covered: int):
+        """ Koduje i zapisuje punkt kontrolny, a następnie usuwa objęte nim pliki dziennika
+        :param img: kopia obrazka
+        :param covered: numer ostatniego pliku dziennika objętego punktem kontrolnym
+        """
+        try:
+            data = encode_tiles(img)
+            tmp_path = self.checkpoint_path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.checkpoint_path)
+            # Awaria w tym miejscu nie szkodzi - ponowne nałożenie dziennika na punkt kontrolny niczego nie zmienia
+            for number in self.__file_numbers():
+                if number <= covered:
+                    os.remove(self.__path(number))
+            self.checkpoints += 1
+            logger.debug("Journal checkpoint written: %s bytes" % len(data))
+        except OSError:
+            logger.error("Cannot write journal checkpoint: %s" % str(sys.exc_info()))
+        finally:
+            self.__checkpoint_lock.release()
+
+    def recover(self, size: tuple):
+        """ Odtwarza obrazek z punktu kontrolnego i dziennika
+        :param size: rozmiar obrazka (szerokość, wysokość)
+        :return: obrazek (TiledImage) lub None, jeśli nie ma czego odtwarzać
+        """
+        canvas = ImageCanvas(*size)
+        found = False
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, 'rb') as f:
+                decode_tiles(f.read(), canvas.img)
+            found = True
+        with self.__lock:
+            for number in self.__file_numbers():
+                if number < self.number:
+                    with open(self.__path(number), 'rb') as f:
+                        data = f.read()
+                else:
+                    data = self.__map
+                for pos, msg in read_records(data):
+                    apply(canvas, msg)
+                    found = True
+        logger.info("Recovered board from journal: %s records after checkpoint" % self.records)
+        return canvas.img if found else None
+
+    def close(self):
+        """ Czeka na zapisanie punktu kontrolnego, zapisuje dziennik na dysk i zamyka go
+        """
+        with self.__checkpoint_lock:
+            with self.__lock:
+                if self.__map is not None:
+                    self.__close_file()
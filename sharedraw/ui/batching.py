@@ -0,0 +1,109 @@
+""" Grupowanie punktów rysowanej linii w komunikaty paint
+"""
+import logging
+import time
+
+from sharedraw.config import config
+
+__author__ = 'michalek'
+logger = logging.getLogger(__name__)
+
+# Nominalny rozmiar komunikatu paint w JSON-ie: nagłówek oraz jeden punkt (', {"x": 123, "y": 456}').
+# Budżet rozmiaru liczony jest w tych jednostkach dla punktów przed uproszczeniem linii - niezależnie od formatu
+# łącza, bo ta sama paczka wysyłana jest do wszystkich peerów (w formacie binarnym i po uproszczeniu komunikat
+# jest kilka razy mniejszy, a rzeczywiste rozmiary widać w metrykach net.out.bytes).
+PAINT_HEADER_SIZE = 90
+PAINT_POINT_SIZE = 22
+
+
+class StrokeBatcher:
+    """ Decyduje, kiedy wysłać zebrane punkty linii - po upływie budżetu opóźnienia lub po przekroczeniu
+    budżetu rozmiaru komunikatu, w zależności od tego, co nastąpi pierwsze.
+    Budżety można zmieniać w trakcie działania programu. Budżet rozmiaru jest nominalny - patrz PAINT_POINT_SIZE.
+    """
+
+    def __init__(self, flush, schedule, cancel, latency_budget_ms=None, byte_budget=None):
+        """
+        :param flush: funkcja wysyłająca zebrane punkty
+        :param schedule: funkcja f(ms, callback) planująca wywołanie, zwraca identyfikator (np. Tk.after)
+        :param cancel: funkcja anulująca zaplanowane wywołanie (np. Tk.after_cancel)
+        :param latency_budget_ms: maksymalne opóźnienie wysłania punktu [ms]
+        :param byte_budget: maksymalny nominalny rozmiar komunikatu [B]
+        """
+        self.__flush = flush
+        self.__schedule = schedule
+        self.__cancel = cancel
+        self.latency_budget_ms = latency_budget_ms or config.paint_latency_budget_ms
+        self.byte_budget = byte_budget or config.paint_byte_budget
+        # Punkty dodane od ostatniego wysłania
+        self.pending = 0
+        self.__started = None
+        self.__timer = None
+        # Statystyki
+        self.batches = 0
+        self.points = 0
+        self.flushed_by_time = 0
+        self.flushed_by_size = 0
+        self.max_batch = 0
+
+    def set_budgets(self, latency_budget_ms=None, byte_budget=None):
+        """ Zmienia budżety grupowania
+        :param latency_budget_ms: maksymalne opóźnienie [ms]
+        :param byte_budget: maksymalny rozmiar komunikatu [B]
+        """
+        if latency_budget_ms:
+            self.latency_budget_ms = latency_budget_ms
+        if byte_budget:
+            self.byte_budget = byte_budget
+        logger.info("Stroke batching: %s ms, %s B" % (self.latency_budget_ms, self.byte_budget))
+
+    def add(self, count=1):
+        """ Rejestruje dodanie punktów do bieżącej linii
+        :param count: liczba punktów
+        """
+        if not self.pending:
+            self.__started = time.monotonic()
+            self.__timer = self.__schedule(int(self.latency_budget_ms), self.__time_elapsed)
+        self.pending += count
+        if PAINT_HEADER_SIZE + self.pending * PAINT_POINT_SIZE >= self.byte_budget:
+            self.flushed_by_size += 1
+            self.flush()
+        elif (time.monotonic() - self.__started) * 1000 >= self.latency_budget_ms:
+            self.flushed_by_time += 1
+            self.flush()
+
+    def flush(self):
+        """ Wysyła zebrane punkty (jeśli są)
+        """
+        if self.__timer is not None:
+            self.__cancel(self.__timer)
+            self.__timer = None
+        if not self.pending:
+            return
+        self.batches += 1
+        self.points += self.pending
+        self.max_batch = max(self.max_batch, self.pending)
+        self.pending = 0
+        self.__flush()
+        if self.batches % 100 == 0:
+            logger.debug("Stroke batches: %s" % self.stats())
+
+    def __time_elapsed(self):
+        self.__timer = None
+        if self.pending:
+            self.flushed_by_time += 1
+            self.flush()
+
+    def stats(self):
+        """ Zwraca statystyki osiągniętych rozmiarów paczek
+        :return: słownik
+        """
+        return {
+            'batches': self.batches,
+            'mean_points': self.points / self.batches if self.batches else 0,
+            'max_points': self.max_batch,
+            'flushed_by_time': self.flushed_by_time,
+            'flushed_by_size': self.flushed_by_size,
+            'latency_budget_ms': self.latency_budget_ms,
+            'byte_budget': self.byte_budget
+        }
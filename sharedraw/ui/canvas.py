@@ -0,0 +1,125 @@
+""" Obrazek tablicy niezależny od Tk - stan płótna używany zarówno przez UI, jak i przez klienta bez UI
+Obrazek podzielony jest na kafelki (sharedraw.ui.tiledimage) - rysowanie, czyszczenie i migawki dotyczą tylko
+zarysowanych kafelków.
+"""
+import io
+import itertools
+
+from PIL import Image, ImageColor
+
+from sharedraw.config import config
+from sharedraw.ui.tiledimage import TiledImage
+from sharedraw.ui.tiles import is_tiled, decode_tiles
+
+__author__ = 'michalek'
+
+# Kolory komunikatów paint jako krotki RGB (nazwa koloru nie jest wtedy analizowana przy każdym rysowaniu)
+_inks = {}
+
+
+def ink(color: str):
+    """ Zwraca kolor jako krotkę RGB
+    :param color: nazwa koloru
+    """
+    rgb = _inks.get(color)
+    if rgb is None:
+        rgb = _inks[color] = ImageColor.getrgb(color)
+    return rgb
+
+
+class ImageCanvas:
+    """ Obrazek PIL z licznikiem wersji
+    Wersja zwiększana jest po każdej zmianie obrazka (klucz bufora migawek).
+    """
+
+    def __init__(self, width=None, height=None):
+        """
+        :param width: szerokość (domyślnie config.board_width)
+        :param height: wysokość (domyślnie config.board_height)
+        """
+        self.width = width or config.board_width
+        self.height = height or config.board_height
+        self.img = TiledImage(self.width, self.height, config.canvas_tile_size)
+        self.__versions = itertools.count(1)
+        self.version = 0
+
+    def touch(self):
+        """ Oznacza zmianę obrazka (nowa wersja)
+        """
+        self.version = next(self.__versions)
+
+    def draw(self, points: [], color: str):
+        """ Rysuje łamaną przechodzącą przez punkty points
+        :param points: punkty należące do łamanej w postaci [(x1, y1), (x2, y2), ...]
+        :param color: kolor
+        """
+        if not points:
+            return
+        self.img.draw_line(points, ink(color))
+        self.touch()
+
+    def draw_local(self, points: [], color: str):
+        """ Rysuje łamaną narysowaną przez użytkownika (w UI - bez przerywania rysowanej właśnie linii)
+        :param points: punkty należące do łamanej w postaci [(x1, y1), (x2, y2), ...]
+        :param color: kolor
+        """
+        self.draw(points, color)
+
+    def draw_batch(self, messages: []):
+        """ Rysuje serię komunikatów paint - każdy jedną łamaną, z jedną zmianą wersji obrazka dla całej serii
+        :param messages: lista komunikatów paint
+        """
+        line = self.img.draw_line
+        drawn = False
+        for message in messages:
+            if message.changed_pxs:
+                line(message.changed_pxs, ink(message.color))
+                drawn = True
+        if drawn:
+            self.touch()
+
+    def clean_img(self):
+        """ Czyści obrazek
+        """
+        self.img.clear()
+        self.touch()
+
+    def current_image(self):
+        """ Zwraca wersję płótna i obrazek
+        :return: (wersja, TiledImage)
+        """
+        return self.version, self.img
+
+    def as_png(self):
+        imgbytearr = io.BytesIO()
+        self.img.to_image().save(imgbytearr, format='PNG')
+        return imgbytearr.getvalue()
+
+    def update_with_png(self, raw_data: bytes):
+        """ Zastępuje obrazek otrzymaną migawką (PNG lub kafelki)
+        :param raw_data: bajty migawki
+        """
+        if is_tiled(raw_data):
+            # Kafelki dekodowane są wprost do obrazka
+            decode_tiles(raw_data, self.img)
+            self.image_replaced(self.img)
+        else:
+            stream = io.BytesIO(raw_data)
+            self.load_image(Image.open(stream).convert('RGB'))
+
+    def load_image(self, img):
+        """ Zastępuje obrazek podanym
+        :param img: obrazek PIL lub TiledImage (np. odtworzony z dziennika)
+        """
+        if isinstance(img, TiledImage) and img.size == self.img.size:
+            self.img = img.copy()
+        else:
+            self.img.clear()
+            self.img.paste(img.to_image() if isinstance(img, TiledImage) else img)
+        self.image_replaced(self.img)
+
+    def image_replaced(self, img):
+        """ Wywoływane po zastąpieniu obrazka w całości
+        :param img: nowy obrazek
+        """
+        self.touch()
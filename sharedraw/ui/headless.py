@@ -0,0 +1,84 @@
+""" Widok bez wyświetlania (bez Tk) - dla klientów pośredniczących, serwerów i testów wydajności
+Obrazek trzymany jest w pamięci (PIL); stan i operacje lokalne dostępne są programowo.
+"""
+from threading import Event
+
+from sharedraw.cntrl.sync import ClientsTable, OwnershipManager
+from sharedraw.config import own_id
+from sharedraw.networking.messages import *
+from sharedraw.networking.networking import PeerPool
+from sharedraw.ui.canvas import ImageCanvas
+from sharedraw.ui.simplify import simplify
+from sharedraw.ui.view import View
+
+__author__ = 'michalek'
+logger = logging.getLogger(__name__)
+
+
+class HeadlessUI(View):
+    """ Widok bez wyświetlania
+    """
+
+    def __init__(self, peer_pool: PeerPool, om: OwnershipManager, journal=None, stop_event=None):
+        """
+        :param stop_event: zdarzenie zakończenia pracy (start czeka na nie)
+        """
+        super().__init__(peer_pool, om, journal)
+        self.stop_event = stop_event or Event()
+        self.set_canvas(ImageCanvas())
+        # Ostatnio otrzymana tablica klientów
+        self.clients = None
+
+    def start(self):
+        """ Czeka na zakończenie pracy (zdarzenie stop_event lub Ctrl+C)
+        """
+        logger.info("Running without UI (Ctrl+C to quit)")
+        try:
+            while not self.stop_event.wait(1):
+                pass
+        except KeyboardInterrupt:
+            pass
+
+    def update_clients_info(self, clients: ClientsTable):
+        self.clients = clients
+
+    def can_draw(self):
+        """ Zwraca, czy możemy rysować (tablica nie jest zablokowana przez innego klienta)
+        """
+        return self.clients is None or not self.clients.locked or self.clients.token_owner == own_id
+
+    def draw_local(self, points: [], color='black'):
+        """ Rysuje łamaną tak, jakby narysował ją użytkownik, i wysyła ją do innych klientów
+        :param points: punkty łamanej [(x1, y1), (x2, y2), ...]
+        :param color: kolor
+        :return: True, jeśli narysowano (False - tablica zablokowana)
+        """
+        if not self.can_draw():
+            return False
+        msg = PaintMessage(simplify(points), color)
+        self.paint_local(msg)
+        self.peer_pool.send(msg)
+        return True
+
+    def clean_local(self):
+        """ Czyści obrazek i wysyła komunikat o wyczyszczeniu
+        :return: True, jeśli wyczyszczono (False - tablica zablokowana)
+        """
+        if not self.can_draw():
+            return False
+        msg = CleanMessage(own_id)
+        self.clean(msg)
+        self.peer_pool.send(msg)
+        return True
+
+    def state(self):
+        """ Zwraca stan widoku
+        :return: słownik: wersja obrazka, identyfikatory klientów, posiadacz tokena, blokada
+        """
+        clients = self.clients
+        return {
+            'version': self.canvas.version,
+            'clients': clients.get_client_ids() if clients else [own_id],
+            'token_owner': clients.token_owner if clients else None,
+            'locked': clients.locked if clients else False
+        }
@@ -0,0 +1,121 @@
+""" Upraszczanie rysowanych linii przed wysłaniem: usuwanie powtórzonych punktów i algorytm Ramera-Douglasa-Peuckera
+Zdarzenia ruchu myszy dostarczają punkt co piksel lub dwa - odcinki prawie współliniowe i powtórzenia nie wnoszą
+nic do obrazka, a zajmują miejsce w każdym komunikacie, na każdym połączeniu. Odległości punktów długich
+fragmentów linii liczone są przy użyciu numpy (jeśli jest zainstalowany).
+"""
+from sharedraw.config import config
+from sharedraw.metrics import metrics
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__author__ = 'michalek'
+
+# Liczba punktów przed i po uproszczeniu
+_points_in = metrics.counter('stroke.points_in')
+_points_out = metrics.counter('stroke.points_out')
+metrics.register_source('stroke.reduction_ratio',
+                        lambda: 1 - _points_out.value / _points_in.value if _points_in.value else None)
+
+
+def dedup(points: []):
+    """ Usuwa kolejne powtórzenia punktów
+    :param points: punkty [(x1, y1), (x2, y2), ...]
+    :return: lista punktów
+    """
+    result = points[:1]
+    for point in points[1:]:
+        if point != result[-1]:
+            result.append(point)
+    return result
+
+
+def _farthest(points: [], first: int, last: int, tolerance2: float):
+    """ Szuka punktu pomiędzy first i last najdalszego od odcinka (points[first], points[last])
+    :param tolerance2: kwadrat maksymalnej odległości punktu, który można pominąć
+    :return: indeks punktu lub None, jeśli wszystkie leżą w granicach tolerancji
+    """
+    x1, y1 = points[first]
+    x2, y2 = points[last]
+    dx, dy = x2 - x1, y2 - y1
+    length2 = dx * dx + dy * dy
+    farthest, max_dist2 = None, tolerance2
+    for i in range(first + 1, last):
+        x, y = points[i]
+        if length2:
+            # Kwadrat odległości od prostej
+            cross = dx * (y1 - y) - dy * (x1 - x)
+            dist2 = cross * cross / length2
+        else:
+            dist2 = (x - x1) ** 2 + (y - y1) ** 2
+        if dist2 > max_dist2:
+            farthest, max_dist2 = i, dist2
+    return farthest
+
+
+def _farthest_numpy(xy, first: int, last: int, tolerance2: float):
+    """ Jak _farthest, ale odległości liczone są wektorowo
+    :param xy: punkty jako tablica numpy (n x 2)
+    """
+    start = xy[first]
+    dx, dy = xy[last] - start
+    inner = xy[first + 1:last] - start
+    length2 = dx * dx + dy * dy
+    if length2:
+        dist2 = (dx * inner[:, 1] - dy * inner[:, 0]) ** 2 / length2
+    else:
+        dist2 = (inner ** 2).sum(axis=1)
+    i = int(dist2.argmax())
+    return first + 1 + i if dist2[i] > tolerance2 else None
+
+
+def rdp(points: [], tolerance: float, numpy_min_points=None):
+    """ Upraszcza łamaną algorytmem Ramera-Douglasa-Peuckera
+    :param points: punkty [(x1, y1), (x2, y2), ...]
+    :param tolerance: maksymalna odległość usuniętego punktu od uproszczonej łamanej [px]
+    :param numpy_min_points: liczba punktów, od której fragmenty łamanej przetwarzane są przez numpy
+     (None - bez numpy)
+    :return: lista punktów (podzbiór points, z pierwszym i ostatnim punktem)
+    """
+    if len(points) < 3:
+        return list(points)
+    xy = None
+    if numpy_min_points is not None and len(points) > numpy_min_points:
+        xy = numpy.asarray(points, dtype=numpy.float64)
+    tolerance2 = tolerance * tolerance
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        if xy is not None and last - first > numpy_min_points:
+            farthest = _farthest_numpy(xy, first, last, tolerance2)
+        else:
+            farthest = _farthest(points, first, last, tolerance2)
+        if farthest is not None:
+            keep[farthest] = True
+            stack.append((first, farthest))
+            stack.append((farthest, last))
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+def simplify(points: [], tolerance=None):
+    """ Upraszcza rysowaną łamaną przed wysłaniem (i zlicza usunięte punkty)
+    :param points: punkty [(x1, y1), (x2, y2), ...]
+    :param tolerance: maksymalne odchylenie [px] (domyślnie config.stroke_tolerance; 0 - tylko usuwanie powtórzeń)
+    :return: lista punktów (te same punkty, jeśli upraszczanie jest wyłączone w konfiguracji)
+    """
+    if tolerance is None:
+        tolerance = config.stroke_tolerance
+        if tolerance is None:
+            return points
+    result = dedup(points)
+    if tolerance > 0:
+        result = rdp(result, tolerance, config.stroke_numpy_min_points if numpy is not None else None)
+    _points_in.inc(len(points))
+    _points_out.inc(len(result))
+    return result
@@ -0,0 +1,162 @@
+""" Bufor migawek obrazka wysyłanych nowym klientom
+Obrazek kodowany jest (PNG lub kafelki, oraz base64) co najwyżej raz dla każdej wersji płótna i każdego kodowania,
+w osobnym wątku - kontroler nie czeka na kompresję.
+"""
+import base64
+import io
+import logging
+import sys
+from collections import namedtuple
+from threading import Thread, Condition
+
+from sharedraw.concurrent.offload import get_offload
+from sharedraw.ui.tiledimage import TiledImage
+from sharedraw.ui.tiles import encode_tiles
+
+__author__ = 'michalek'
+logger = logging.getLogger(__name__)
+
+# Kodowania migawek
+SNAPSHOT_PNG = 'png'
+SNAPSHOT_TILES = 'tiles'
+
+# Zakodowany obrazek: wersja płótna, kodowanie, bajty, bajty w base64 (jako str)
+Snapshot = namedtuple('Snapshot', ['version', 'encoding', 'data', 'data_b64'])
+
+
+def encode_png(img):
+    if isinstance(img, TiledImage):
+        img = img.to_image()
+    imgbytearr = io.BytesIO()
+    img.save(imgbytearr, format='PNG')
+    return imgbytearr.getvalue()
+
+
+# Kodowanie -> funkcja kodująca obrazek (PIL lub TiledImage) do bajtów
+encoders = {
+    SNAPSHOT_PNG: encode_png,
+    SNAPSHOT_TILES: encode_tiles
+}
+
+
+class SnapshotCache:
+    """ Przechowuje ostatnią zakodowaną migawkę płótna i koduje nowe w tle
+    Migawka o wersji v jest dobra dla każdego żądania złożonego przy wersji <= v - komunikaty paint, które trafiły
+    do obrazka po żądaniu, zostaną nowemu klientowi wysłane jeszcze raz, a ich ponowne narysowanie niczego nie zmienia.
+    """
+
+    def __init__(self, source):
+        """
+        :param source: funkcja zwracająca (wersja płótna, obrazek PIL lub TiledImage); wersja musi rosnąć przy każdej
+         zmianie
+        """
+        self.__source = source
+        # Kodowanie -> ostatnia migawka
+        self.__snapshots = {}
+        # Oczekujące żądania: (wersja płótna w chwili żądania, kodowanie, funkcja)
+        self.__waiting = []
+        self.__cond = Condition()
+        self.__worker = None
+        # Statystyki
+        self.hits = 0
+        self.encoded = 0
+
+    def request(self, callback, encoding=SNAPSHOT_PNG):
+        """ Żąda migawki aktualnego płótna - nie blokuje
+        :param callback: funkcja f(snapshot) wywoływana od razu (migawka aktualna) lub z wątku kodującego;
+         f(None), jeśli migawki nie udało się zakodować
+        :param encoding: kodowanie migawki
+        """
+        version, img = self.__source()
+        with self.__cond:
+            snapshot = self.__snapshots.get(encoding)
+            if snapshot is None or snapshot.version != version:
+                self.__waiting.append((version, encoding, callback))
+                if self.__worker is None:
+                    self.__worker = Thread(target=self.__run, name='snapshot-encoder')
+                    self.__worker.setDaemon(True)
+                    self.__worker.start()
+                self.__cond.notify()
+                return
+            self.hits += 1
+        callback(snapshot)
+
+    def get(self, encoding=SNAPSHOT_PNG):
+        """ Zwraca migawkę aktualnego płótna, kodując ją w bieżącym wątku, jeśli to konieczne
+        :param encoding: kodowanie migawki
+        :return: Snapshot
+        """
+        version, img = self.__source()
+        snapshot = self.__snapshots.get(encoding)
+        if snapshot is not None and snapshot.version == version:
+            self.hits += 1
+            return snapshot
+        return self.__encode(version, img.copy(), encoding)
+
+    def __run(self):
+        """ Pętla wątku kodującego
+        Błąd kodowania kończy tylko obsługę żądań, których dotyczy (dostają None) - wątek działa dalej, a jeśli
+        mimo to się zakończy, kolejne żądanie uruchomi nowy.
+        """
+        try:
+            while True:
+                with self.__cond:
+                    while not self.__waiting:
+                        self.__cond.wait()
+                try:
+                    version, img = self.__source()
+                    img = img.copy()
+                except Exception:
+                    logger.error("Cannot copy canvas for snapshot: %s" % str(sys.exc_info()))
+                    with self.__cond:
+                        ready, self.__waiting = self.__waiting, []
+                    for v, encoding, callback in ready:
+                        self.__deliver(callback, None)
+                    continue
+                with self.__cond:
+                    ready = [w for w in self.__waiting if w[0] <= version]
+                    self.__waiting = [w for w in self.__waiting if w[0] > version]
+                # Kodowanie -> migawka (None - nie udało się zakodować)
+                snapshots = {}
+                for v, encoding, callback in ready:
+                    if encoding not in snapshots:
+                        try:
+                            snapshots[encoding] = self.__encode(version, img, encoding)
+                        except Exception:
+                            logger.error("Cannot encode snapshot as %s: %s" % (encoding, str(sys.exc_info())))
+                            snapshots[encoding] = None
+                    self.__deliver(callback, snapshots[encoding])
+        finally:
+            with self.__cond:
+                self.__worker = None
+
+    @staticmethod
+    def __deliver(callback, snapshot):
+        try:
+            callback(snapshot)
+        except Exception:
+            logger.error("Cannot deliver snapshot: %s" % str(sys.exc_info()))
+
+    def __encode(self, version: int, img, encoding: str):
+        data = None
+        if isinstance(img, TiledImage) and encoding != SNAPSHOT_TILES:
+            img = img.to_image()
+        # Kafelki kodowane są na miejscu - koszt zależy od zarysowanej powierzchni, a nie od rozmiaru tablicy
+        offload = get_offload() if not isinstance(img, TiledImage) else None
+        if offload:
+            # Kodowanie w osobnym procesie - wątek czeka bez trzymania GIL
+            try:
+                data, data_b64 = offload.encode_image(img, encoding)
+            except Exception:
+                logger.warn("Cannot encode snapshot in worker process, encoding in place: %s" % str(sys.exc_info()))
+        if data is None:
+            data = encoders[encoding](img)
+            data_b64 = str(base64.b64encode(data), encoding='utf8')
+        snapshot = Snapshot(version, encoding, data, data_b64)
+        with self.__cond:
+            self.encoded += 1
+            last = self.__snapshots.get(encoding)
+            if last is None or last.version <= version:
+                self.__snapshots[encoding] = snapshot
+        logger.debug("Snapshot of version %s encoded as %s: %s bytes" % (version, encoding, len(data)))
+        return snapshot
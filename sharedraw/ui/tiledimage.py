@@ -0,0 +1,166 @@
+""" Obrazek tablicy podzielony na kafelki przydzielane dopiero przy pierwszym narysowaniu
+Pamięć i koszt migawek zależą od zarysowanej powierzchni, a nie od rozmiaru tablicy - tablica może mieć rozmiar
+plakatu (np. 8000x6000). Brakujący kafelek jest biały.
+Klasa udostępnia część interfejsu obrazka PIL (size, mode, paste, crop, copy, tobytes) używaną przez resztę
+programu; cały obrazek PIL (np. do PNG) składany jest na żądanie.
+"""
+from PIL import Image, ImageDraw
+
+__author__ = 'michalek'
+
+WHITE = (255, 255, 255)
+
+
+class TiledImage:
+    """ Obrazek RGB z kafelków o boku tile_size
+    Kafelki: (kolumna, wiersz) -> (obrazek PIL, ImageDraw)
+    """
+    mode = 'RGB'
+
+    def __init__(self, width: int, height: int, tile_size: int):
+        self.width = width
+        self.height = height
+        self.size = (width, height)
+        self.tile_size = tile_size
+        self.tiles = {}
+
+    def __tile(self, column: int, row: int):
+        """ Zwraca kafelek, tworząc go, jeśli jeszcze nie istnieje
+        :return: (obrazek PIL, ImageDraw)
+        """
+        tile = self.tiles.get((column, row))
+        if tile is None:
+            left, top = column * self.tile_size, row * self.tile_size
+            img = Image.new(self.mode, (min(self.tile_size, self.width - left), min(self.tile_size, self.height - top)),
+                            WHITE)
+            tile = self.tiles[(column, row)] = (img, ImageDraw.Draw(img))
+        return tile
+
+    def __tiles_in(self, box: tuple):
+        """ Zwraca numery kafelków (kolumna, wiersz) przecinających prostokąt
+        :param box: (x0, y0, x1, y1) - bez prawej i dolnej krawędzi
+        """
+        x0, y0, x1, y1 = max(box[0], 0), max(box[1], 0), min(box[2], self.width), min(box[3], self.height)
+        if x0 >= x1 or y0 >= y1:
+            return []
+        size = self.tile_size
+        return [(column, row) for row in range(y0 // size, (y1 - 1) // size + 1)
+                for column in range(x0 // size, (x1 - 1) // size + 1)]
+
+    def draw_line(self, points: [], fill: tuple):
+        """ Rysuje łamaną (jak ImageDraw.line o szerokości 1) na kafelkach, przez które przechodzi
+        :param points: punkty [(x1, y1), (x2, y2), ...]
+        :param fill: kolor RGB
+        """
+        if len(points) < 2:
+            # Pojedynczy punkt nie jest rysowany
+            return
+        size = self.tile_size
+        xs, ys = zip(*points)
+        x0, y0, x1, y1 = min(xs), min(ys), max(xs), max(ys)
+        column, row = x0 // size, y0 // size
+        if column == x1 // size and row == y1 // size:
+            # Cała łamana na jednym kafelku (najczęstszy przypadek)
+            keys = ((column, row),) if 0 <= x0 < self.width and 0 <= y0 < self.height else ()
+        else:
+            # Kafelki, na których leżą punkty - a dla odcinków przechodzących przez róg kafelka lub dłuższych od niego
+            # także pozostałe kafelki, na które zachodzą prostokąty otaczające te odcinki
+            keys = {(x // size, y // size) for x, y in points}
+            for (x0, y0), (x1, y1) in zip(points, points[1:]):
+                if abs(x0 // size - x1 // size) + abs(y0 // size - y1 // size) > 1:
+                    keys.update(self.__tiles_in((min(x0, x1), min(y0, y1), max(x0, x1) + 1, max(y0, y1) + 1)))
+            keys = [(column, row) for column, row in keys
+                    if 0 <= column * size < self.width and 0 <= row * size < self.height]
+        for column, row in keys:
+            tile = self.tiles.get((column, row))
+            if tile is None:
+                if fill == WHITE:
+                    # Biała linia na brakującym (białym) kafelku niczego nie zmienia
+                    continue
+                tile = self.__tile(column, row)
+            left, top = column * size, row * size
+            # Współrzędne względem kafelka
+            tile[1].line([(x - left, y - top) for x, y in points] if left or top else points, fill=fill)
+
+    def clear(self):
+        """ Czyści obrazek (zwalnia wszystkie kafelki)
+        """
+        self.tiles = {}
+
+    def paste(self, im, box=None):
+        """ Wkleja obrazek lub wypełnia prostokąt kolorem (jak Image.paste)
+        Białe fragmenty wklejanego obrazka nie powodują przydzielenia kafelków.
+        :param im: obrazek PIL lub kolor
+        :param box: (x0, y0) lub (x0, y0, x1, y1); domyślnie (0, 0)
+        """
+        if box is None:
+            box = (0, 0)
+        if isinstance(im, Image.Image):
+            box = tuple(box[:2]) + (box[0] + im.size[0], box[1] + im.size[1])
+        elif im in (WHITE, 255) and tuple(box) == (0, 0) + self.size:
+            self.clear()
+            return
+        size = self.tile_size
+        for column, row in self.__tiles_in(box):
+            left, top = column * size, row * size
+            # Część prostokąta na kafelku - we współrzędnych kafelka
+            part = (max(box[0] - left, 0), max(box[1] - top, 0), min(box[2] - left, size), min(box[3] - top, size))
+            if isinstance(im, Image.Image):
+                piece = im.crop((part[0] + left - box[0], part[1] + top - box[1],
+                                 part[2] + left - box[0], part[3] + top - box[1]))
+                if (column, row) not in self.tiles and piece.convert('L').getextrema() == (255, 255):
+                    continue
+                self.__tile(column, row)[0].paste(piece, part[:2])
+            else:
+                if (column, row) not in self.tiles and im in (WHITE, 255):
+                    continue
+                self.__tile(column, row)[0].paste(im, part)
+
+    def crop(self, box: tuple):
+        """ Składa fragment obrazka
+        :param box: (x0, y0, x1, y1) - bez prawej i dolnej krawędzi
+        :return: obrazek PIL
+        """
+        result = Image.new(self.mode, (box[2] - box[0], box[3] - box[1]), WHITE)
+        size = self.tile_size
+        for key in self.__tiles_in(box):
+            tile = self.tiles.get(key)
+            if tile is not None:
+                left, top = key[0] * size, key[1] * size
+                result.paste(tile[0], (left - box[0], top - box[1]))
+        return result
+
+    def to_image(self):
+        """ Składa cały obrazek
+        :return: obrazek PIL
+        """
+        return self.crop((0, 0) + self.size)
+
+    def tobytes(self):
+        return self.to_image().tobytes()
+
+    def copy(self):
+        """ Kopiuje obrazek (koszt zależy od liczby kafelków)
+        """
+        result = TiledImage(self.width, self.height, self.tile_size)
+        # Kopia listy kafelków - inny wątek może w tym czasie rysować
+        for key, (img, draw) in list(self.tiles.items()):
+            img = img.copy()
+            result.tiles[key] = (img, ImageDraw.Draw(img))
+        return result
+
+    def items(self):
+        """ Zwraca przydzielone kafelki
+        :return: lista par ((x0, y0) - położenie kafelka, obrazek PIL), wierszami
+        """
+        return [((column * self.tile_size, row * self.tile_size), self.tiles[(column, row)][0])
+                for column, row in sorted(list(self.tiles), key=lambda key: (key[1], key[0]))]
+
+    def stats(self):
+        return {
+            'width': self.width,
+            'height': self.height,
+            'tile_size': self.tile_size,
+            'tiles': len(self.tiles),
+            'bytes': sum(img.size[0] * img.size[1] * 3 for img, draw in list(self.tiles.values()))
+        }
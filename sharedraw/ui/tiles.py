@@ -0,0 +1,87 @@
+""" Dwupoziomowa (1 bit na piksel), kafelkowa postać migawki obrazka
+Tablica zawiera wyłącznie piksele czarne i białe, więc zamiast PNG w RGB klientom w Pythonie wysyłamy bitmapę
+podzieloną na kafelki. Puste (białe) kafelki są pomijane, pozostałe kompresowane zlib-em.
+Format jest negocjowany (TILED_SNAPSHOT_CAPABILITY) - pozostali klienci dostają PNG.
+
+Dane: MAGIC | szerokość (u16) | wysokość (u16) | bok kafelka (u16) | liczba kafelków (u32) | kafelki
+Kafelek: numer kafelka (u32, wierszami) | długość (u32) | bitmapa kafelka (mode '1', wierszami) skompresowana zlib-em
+"""
+import struct
+import zlib
+
+from PIL import Image
+
+from sharedraw.ui.tiledimage import TiledImage
+
+__author__ = 'michalek'
+
+MAGIC = b'SDT1'
+TILE_SIZE = 64
+
+_HEADER = struct.Struct('>4sHHHI')
+_TILE = struct.Struct('>II')
+
+
+def is_tiled(data: bytes):
+    """ Zwraca, czy dane są migawką w postaci kafelkowej (w przeciwnym razie - PNG)
+    """
+    return data[:len(MAGIC)] == MAGIC
+
+
+def read_size(data: bytes):
+    """ Zwraca rozmiar obrazka zapisanego w migawce kafelkowej
+    :return: (szerokość, wysokość)
+    """
+    magic, width, height, tile_size, count = _HEADER.unpack_from(data)
+    return width, height
+
+
+def encode_tiles(img, tile_size=TILE_SIZE):
+    """ Koduje obrazek do postaci kafelkowej
+    :param img: obrazek PIL (dowolny tryb - kolory różne od białego stają się czarne) lub TiledImage
+     (kodowane są tylko jego przydzielone kafelki)
+    :param tile_size: bok kafelka [px]
+    :return: bajty
+    """
+    width, height = img.size
+    columns = (width + tile_size - 1) // tile_size
+    if isinstance(img, TiledImage):
+        parts = img.items() if img.tile_size % tile_size == 0 else [((0, 0), img.to_image())]
+    else:
+        parts = [((0, 0), img)]
+    tiles = []
+    for (x0, y0), part in parts:
+        # Bez ditheringu (0 == Image.Dither.NONE) - piksele są albo białe, albo czarne
+        bilevel = part.convert('L').point(lambda v: 255 if v == 255 else 0).convert('1', dither=0)
+        part_width, part_height = bilevel.size
+        for top in range(0, part_height, tile_size):
+            for left in range(0, part_width, tile_size):
+                tile = bilevel.crop((left, top, min(left + tile_size, part_width), min(top + tile_size, part_height)))
+                if tile.getextrema() == (255, 255):
+                    # Pusty kafelek
+                    continue
+                index = ((y0 + top) // tile_size) * columns + (x0 + left) // tile_size
+                data = zlib.compress(tile.tobytes())
+                tiles.append(_TILE.pack(index, len(data)))
+                tiles.append(data)
+    return _HEADER.pack(MAGIC, width, height, tile_size, len(tiles) // 2) + b''.join(tiles)
+
+
+def decode_tiles(data: bytes, img: Image.Image):
+    """ Dekoduje migawkę kafelkową bezpośrednio do obrazka (który jest najpierw czyszczony)
+    :param data: bajty migawki
+    :param img: obrazek docelowy (PIL lub TiledImage)
+    """
+    magic, width, height, tile_size, count = _HEADER.unpack_from(data)
+    columns = (width + tile_size - 1) // tile_size
+    img.paste((255, 255, 255) if img.mode == 'RGB' else 255, (0, 0) + img.size)
+    pos = _HEADER.size
+    for _ in range(count):
+        index, length = _TILE.unpack_from(data, pos)
+        pos += _TILE.size
+        left = (index % columns) * tile_size
+        top = (index // columns) * tile_size
+        size = (min(tile_size, width - left), min(tile_size, height - top))
+        tile = Image.frombytes('1', size, zlib.decompress(data[pos:pos + length]))
+        pos += length
+        img.paste(tile, (left, top))
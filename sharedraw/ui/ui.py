@@ -1,69 +1,60 @@
-import io
+import itertools
+import time
+from threading import Lock
 from tkinter import *
 from tkinter.ttk import Treeview
 
-from PIL import Image, ImageDraw, ImageTk
+from PIL import ImageTk
 
 from sharedraw.cntrl.sync import ClientsTable, OwnershipManager
 from sharedraw.config import config
 from sharedraw.networking.messages import *
 from sharedraw.networking.networking import PeerPool
+from sharedraw.ui.batching import StrokeBatcher
+from sharedraw.ui.canvas import ImageCanvas
+from sharedraw.ui.simplify import simplify
+from sharedraw.ui.view import View
 
 __author__ = 'michalek'
 
-WIDTH, HEIGHT = 640, 480
+# Największy widoczny fragment tablicy [px] - większa tablica jest przewijana
+VIEWPORT_WIDTH, VIEWPORT_HEIGHT = 640, 480
 
+# Znaczniki elementów płótna Tk: podgląd rysowanej linii oraz podgląd już narysowany na obrazku (usuwany po
+# wyświetleniu obrazka)
+_PREVIEW = 'preview'
+_FLUSHED = 'flushed'
 
-class SharedrawUI:
-    """ Fasada widoku aplikacji
+
+class SharedrawUI(View):
+    """ Fasada widoku aplikacji (okno Tk)
     """
 
-    def __init__(self, peer_pool: PeerPool, om: OwnershipManager):
+    def __init__(self, peer_pool: PeerPool, om: OwnershipManager, journal=None):
+        super().__init__(peer_pool, om, journal)
         self.root = Tk()
-        self.peer_pool = peer_pool
-        self.om = om
         self.ui = MainFrame(self)
+        self.set_canvas(self.ui.drawer)
 
     def start(self):
         """ Uruchamia UI
         """
         self.root.mainloop()
 
-    def get_png(self):
-        """ Zwraca piksele jako PNG
-        :return: piksele jako PNG
-        """
-        return self.ui.drawer.as_png()
-
-    def connect(self, ip, port):
-        """ Podłącza do innego klienta
-        :param ip: ip (str)
-        :param port: port (int)
-        :return:
-        """
-        self.peer_pool.connect_to(ip, int(port))
-
-    def paint(self, message: PaintMessage):
-        """ Aktualizuje UI
-        :param message: komunikat
-        :return:
-        """
-        self.ui.drawer.draw(message.changed_pxs, message.color)
+    def update_clients_info(self, clients: ClientsTable):
+        self.ui.update_clients_info(clients)
 
-    def update_image(self, message: ImageMessage):
-        """ Aktualizuje UI
-        :param message: komunikat
-        :return:
+    def set_batching(self, latency_budget_ms=None, byte_budget=None):
+        """ Zmienia parametry grupowania punktów rysowanej linii
+        :param latency_budget_ms: maksymalne opóźnienie wysłania [ms]
+        :param byte_budget: maksymalny rozmiar komunikatu [B]
         """
-        self.ui.drawer.update_with_png(message.rawdata)
+        self.ui.drawer.batcher.set_budgets(latency_budget_ms, byte_budget)
 
-    def clean(self):
-        """ Czyści obrazek
+    def batching_stats(self):
+        """ Zwraca statystyki grupowania punktów rysowanej linii
         """
-        self.ui.drawer.clean_img()
-
-    def update_clients_info(self, clients: ClientsTable):
-        self.ui.update_clients_info(clients)
+        return self.ui.drawer.batcher.stats()
 
 
 class MainFrame(Frame):
@@ -76,7 +67,7 @@ class MainFrame(Frame):
         self.ui = ui
 
         self.parent.title("Sharedraw [%s:%s, id: %s]" % (self.ui.peer_pool.ip, self.ui.peer_pool.port, own_id))
-        self.drawer = Drawer(self.parent, WIDTH, HEIGHT, self.save)
+        self.drawer = Drawer(self.parent, self.save)
         self.clients_table = Treeview(self.parent, columns=('R', 'G', 'from'))
         self.clients_table.heading('#0', text='Id')
         self.clients_table.heading('R', text='R')
@@ -96,6 +87,13 @@ class MainFrame(Frame):
         self.req_btn = self._create_button(text="Chcę przejąć tablicę", func=self._make_request)
         # Rezygnacja z posiadania blokady
         self.resign_btn = self._create_button(text='Zrezygnuj z blokady', func=self._resign)
+        # Wiersze wyświetlane w tabeli klientów: id -> (R, G, od kogo)
+        self.__rows = {}
+        # Wiersze tabeli klientów do naniesienia przy najbliższym odświeżeniu: id -> (R, G, od kogo)
+        self.__pending_rows = {}
+        self.__status = None
+        self.__refresh_id = None
+        self.__refreshed = 0
 
     def _create_button(self, text: str, func):
         """ Tworzy nowy przycisk w bieżącej ramce
@@ -112,7 +110,10 @@ class MainFrame(Frame):
         :return:
         """
         if self.drawer.changed_pxs:
-            msg = PaintMessage(self.drawer.changed_pxs, self.drawer.color)
+            msg = PaintMessage(simplify(self.drawer.changed_pxs), self.drawer.color)
+            # Wysyłany fragment linii (uproszczony, jeśli włączono upraszczanie) rysowany jest na obrazku (zamiast
+            # podglądu) razem z zapisem w dzienniku - obrazek, dziennik i pozostali klienci otrzymują te same punkty
+            self.ui.paint_local(msg)
             self.ui.peer_pool.send(msg)
             # Reset listy punktów
             self.drawer.changed_pxs = []
@@ -121,8 +122,8 @@ class MainFrame(Frame):
         """ Czyści obrazek oraz wysyła komunikat o wyczyszczeniu
         :return:
         """
-        self.drawer.clean_img()
         msg = CleanMessage(own_id)
+        self.ui.clean(msg)
         self.ui.peer_pool.send(msg)
 
     def _make_request(self):
@@ -144,31 +145,61 @@ class MainFrame(Frame):
         self.parent.wait_window(d.top)
 
     def update_clients_info(self, clients: ClientsTable):
-        # Aktualizacja listy klientów
-        for ch in self.clients_table.get_children():
-            self.clients_table.delete(ch)
-        for client in clients.clients:
-            self.clients_table.insert('', 'end', text=client.id,
-                                      values=(client.requested, client.granted, client.received_from_id))
-        # Aktualizacja info o właścicielu tokena i blokadzie
+        # Aktualizacja info o właścicielu tokena i blokadzie - tylko przy zmianie
+        has_token = clients.token_owner == own_id
+        has_requested = clients.find_self().has_requested()
+        status = (clients.locked, clients.token_owner, has_requested, len(clients) <= 1)
+        if status != self.__status:
+            self.__status = status
+            self.__update_status(clients, has_token, has_requested)
+        # Lista klientów odświeżana jest co najwyżej clients_refresh_rate razy na sekundę (w wątku Tk) - zapamiętujemy
+        # kopię wierszy, bo tablica klientów zmienia się w wątku kontrolera
+        self.__pending_rows = {client.id: (client.requested, client.granted, client.received_from_id)
+                               for client in clients.clients}
+        if self.__refresh_id is None:
+            delay = max(int(1000 / config.clients_refresh_rate) - int((time.monotonic() - self.__refreshed) * 1000), 0)
+            self.__refresh_id = self.after(delay, self.__refresh_clients)
+
+    def __update_status(self, clients: ClientsTable, has_token: bool, has_requested: bool):
         self.locked_label.update_text(clients.locked)
         self.token_owner_label.update_text(clients.token_owner)
         # Aktualizacja blokady
-        has_token = clients.token_owner == own_id
         self.__set_lock_state(clients.locked, has_token)
         # Aktualizacja przycisków
         # jeśli zablokowaliśmy, to nie możemy tego zrobić drugi raz
         is_locker = (has_token and clients.locked)
         # tak samo jeśli już zażądaliśmy
-        has_requested = clients.find_self().has_requested()
         self.__set_button_enabled(self.req_btn, not (is_locker or has_requested))
         # jeśli nie zablokowaliśmy, to nie możemy rezygnować
         self.__set_button_enabled(self.resign_btn, is_locker)
         # Możemy się podłączyć, tylko, jeśli nie jesteśmy do nikogo podłączeni
-        self.__set_button_enabled(self.connect_btn, len(clients.clients) <= 1)
+        self.__set_button_enabled(self.connect_btn, len(clients) <= 1)
         # Przycisk czyść aktywny jeśli możemy rysować
         self.__set_button_enabled(self.clean_btn, has_token or not clients.locked)
 
+    def __refresh_clients(self):
+        """ Nanosi na tabelę klientów tylko zmienione wiersze (identyfikatorem wiersza jest id klienta)
+        """
+        self.__refresh_id = None
+        self.__refreshed = time.monotonic()
+        rows = self.__pending_rows
+        # Usunięci klienci
+        for client_id in [client_id for client_id in self.__rows if client_id not in rows]:
+            self.clients_table.delete(client_id)
+            del self.__rows[client_id]
+        for index, (client_id, values) in enumerate(rows.items()):
+            old = self.__rows.get(client_id)
+            if old is None:
+                self.clients_table.insert('', index, iid=client_id, text=client_id, values=values)
+            elif old != values:
+                self.clients_table.item(client_id, values=values)
+            self.__rows[client_id] = values
+        # Kolejność zmienia się tylko po usunięciu i ponownym dodaniu klienta
+        if list(self.__rows) != list(rows):
+            for index, client_id in enumerate(rows):
+                self.clients_table.move(client_id, '', index)
+            self.__rows = {client_id: self.__rows[client_id] for client_id in rows}
+
     @staticmethod
     def __set_button_enabled(btn: Button, enabled: bool):
         btn.configure(state=(NORMAL if enabled else DISABLED))
@@ -186,24 +217,59 @@ class MainFrame(Frame):
         self.parent.configure(bg=color)
 
 
-class Drawer:
+class Drawer(ImageCanvas):
     """ Klasa zawierająca płótno oraz zapis śladu ruchów myszy
+    W trybie 'framebuffer' jedynym stanem obrazka są kafelki PIL, wyświetlane przez jeden PhotoImage, do którego
+    z ograniczoną częstotliwością kopiowany jest tylko zmieniony prostokąt. W trybie 'items' każdy odcinek jest
+    dodatkowo osobnym elementem płótna Tk (elementy usuwane są dopiero przy czyszczeniu).
+    Rysowana właśnie linia jest tylko podglądem (elementy płótna Tk) - na obrazek trafia dopiero przy wysłaniu (po
+    uproszczeniu, jeśli jest włączone).
+    Tablica większa od VIEWPORT_WIDTH x VIEWPORT_HEIGHT jest przewijana; w trybie 'framebuffer' PhotoImage ma rozmiar
+    widocznego fragmentu i jest odświeżany z kafelków obrazka po każdym przewinięciu.
     """
     x, y = None, None
     color = "black"
 
-    def __init__(self, parent, width, height, send):
+    def __init__(self, parent, send, width=None, height=None):
+        super().__init__(width, height)
         self.send = send
-        self.c = Canvas(parent, width=width, height=height, bg="white")
-        self.c.pack()
-        self.img = Image.new("RGB", (width, height), (255, 255, 255))
-        self.img_draw = ImageDraw.Draw(self.img)
+        self.view_width = min(self.width, VIEWPORT_WIDTH)
+        self.view_height = min(self.height, VIEWPORT_HEIGHT)
+        frame = Frame(parent)
+        self.c = Canvas(frame, width=self.view_width, height=self.view_height, bg="white",
+                        scrollregion=(0, 0, self.width, self.height))
+        self.c.grid(row=0, column=0)
+        if self.width > self.view_width:
+            xbar = Scrollbar(frame, orient=HORIZONTAL, command=self.c.xview)
+            xbar.grid(row=1, column=0, sticky=EW)
+            self.c.configure(xscrollcommand=xbar.set)
+            self.c.bind("<Shift-MouseWheel>", lambda e: self.c.xview_scroll(-1 if e.delta > 0 else 1, UNITS))
+        if self.height > self.view_height:
+            ybar = Scrollbar(frame, orient=VERTICAL, command=self.c.yview)
+            ybar.grid(row=0, column=1, sticky=NS)
+            self.c.configure(yscrollcommand=ybar.set)
+            self.c.bind("<MouseWheel>", lambda e: self.c.yview_scroll(-1 if e.delta > 0 else 1, UNITS))
+            self.c.bind("<Button-4>", lambda e: self.c.yview_scroll(-1, UNITS))
+            self.c.bind("<Button-5>", lambda e: self.c.yview_scroll(1, UNITS))
+        frame.pack()
+        self.framebuffer = config.render_mode == 'framebuffer'
+        if self.framebuffer:
+            self.photo = ImageTk.PhotoImage(self.img.crop((0, 0, self.view_width, self.view_height)))
+            self.__photo_item = self.c.create_image(0, 0, anchor=NW, image=self.photo)
+            # Lewy górny róg widocznego fragmentu tablicy
+            self.__origin = (0, 0)
+            # Zmieniony, jeszcze nie wyświetlony prostokąt (x0, y0, x1, y1) lub None
+            self.__dirty = None
+            self.__dirty_lock = Lock()
+            self.__frame_interval = max(int(1000 / config.render_fps), 1)
+            self.c.after(self.__frame_interval, self.__blit)
         self.c.bind("<B1-Motion>", self.__motion_left)
         self.c.bind("<B3-Motion>", self.__motion_right)
         self.c.bind("<ButtonRelease-1>", self.__release)
         self.c.bind("<ButtonRelease-3>", self.__release)
         self.changed_pxs = []
         self.locked = False
+        self.batcher = StrokeBatcher(self.__flush, self.c.after, self.c.after_cancel)
 
     def __motion_left(self, e):
         # Lewy przycisk - czarna linia
@@ -219,24 +285,29 @@ class Drawer:
         if self.locked:
             # Tablica zablokowana przez innego użytkownika - nie rysujemy
             return
-        prevx = self.x if self.x is not None else e.x
-        prevy = self.y if self.y is not None else e.y
-        self.c.create_line(prevx, prevy, e.x, e.y, fill=self.color)
-        self.img_draw.line([prevx, prevy, e.x, e.y], fill=self.color)
-        self.x = e.x
-        self.y = e.y
-        self.changed_pxs.append((e.x, e.y))
-        # Limit w celu zapewnienia płynności
-        if len(self.changed_pxs) > config.line_max_length:
-            # Wysyłamy
-            self.send()
-            # Linia zawiera tylko ostatni punkt
+        # Współrzędne na tablicy (widok może być przewinięty)
+        x, y = int(self.c.canvasx(e.x)), int(self.c.canvasy(e.y))
+        prevx = self.x if self.x is not None else x
+        prevy = self.y if self.y is not None else y
+        self.c.create_line(prevx, prevy, x, y, fill=self.color, tags=_PREVIEW)
+        self.x = x
+        self.y = y
+        self.changed_pxs.append((x, y))
+        # Wysyłamy po upływie budżetu czasu lub rozmiaru
+        self.batcher.add()
+
+    def __flush(self):
+        # Wysyłamy
+        self.send()
+        if self.x is not None:
+            # Linia jest kontynuowana - zawiera tylko ostatni punkt
             self.changed_pxs.append((self.x, self.y))
 
     def __release(self, e):
         self.x = None
         self.y = None
-        self.send()
+        self.batcher.flush()
+        self.changed_pxs = []
 
     def draw(self, points: [], color: str):
         """ Rysuje łamaną przechodzącą przez punkty points
@@ -246,32 +317,98 @@ class Drawer:
         """
         if not points:
             return
-        prevx, prevy = points[0]
-        for x, y in points[1:]:
-            self.c.create_line(prevx, prevy, x, y, fill=color)
-            self.img_draw.line([prevx, prevy, x, y], fill=color)
-            prevx, prevy = x, y
+        super().draw(points, color)
+        self.__show([(points, color)])
+        self.x, self.y = (None, None)
+
+    def draw_local(self, points: [], color: str):
+        """ Rysuje na obrazku wysyłany fragment linii i usuwa jego podgląd
+        :param points: punkty (po uproszczeniu, jeśli jest włączone)
+        :param color: kolor
+        """
+        if points:
+            super().draw(points, color)
+            self.__show([(points, color)])
+        if self.framebuffer:
+            # Podgląd znika dopiero po wyświetleniu obrazka (bez migotania)
+            self.c.addtag_withtag(_FLUSHED, _PREVIEW)
+            self.c.dtag(_PREVIEW, _PREVIEW)
+        else:
+            self.c.delete(_PREVIEW)
+
+    def draw_batch(self, messages: []):
+        """ Rysuje serię komunikatów paint
+        :param messages: lista komunikatów paint
+        """
+        super().draw_batch(messages)
+        self.__show([(message.changed_pxs, message.color) for message in messages if message.changed_pxs])
         self.x, self.y = (None, None)
 
+    def __show(self, lines: []):
+        """ Wyświetla narysowane na obrazku łamane - jeden prostokąt do odświeżenia dla całej serii
+        lub (w trybie 'items') jeden element płótna Tk dla każdej łamanej
+        :param lines: lista par (punkty, kolor)
+        """
+        if not lines:
+            return
+        if self.framebuffer:
+            xs = [x for points, color in lines for x, y in points]
+            ys = [y for points, color in lines for x, y in points]
+            self.__mark_dirty(min(xs), min(ys), max(xs), max(ys))
+        else:
+            for points, color in lines:
+                if len(points) > 1:
+                    self.c.create_line(*itertools.chain.from_iterable(points), fill=color)
+
     def clean_img(self):
         """ Czyści obrazek
         """
-        self.c.delete('all')
-        self.img = Image.new("RGB", (WIDTH, HEIGHT), (255, 255, 255))
-        self.img_draw = ImageDraw.Draw(self.img)
+        super().clean_img()
         self.changed_pxs = []
+        if self.framebuffer:
+            self.__mark_dirty(0, 0, self.width - 1, self.height - 1)
+            self.c.delete(_PREVIEW, _FLUSHED)
+        else:
+            self.c.delete('all')
 
-    def as_png(self):
-        imgbytearr = io.BytesIO()
-        self.img.save(imgbytearr, format='PNG')
-        return imgbytearr.getvalue()
-
-    def update_with_png(self, raw_data: bytes):
-        stream = io.BytesIO(raw_data)
-        png = Image.open(stream).convert('RGB')
-        self.img.paste(png)
-        pi = ImageTk.PhotoImage(image=png, size=(WIDTH, HEIGHT))
-        self.c.create_image(WIDTH / 2, HEIGHT / 2, image=pi)
+    def __mark_dirty(self, x0: int, y0: int, x1: int, y1: int):
+        """ Dołącza prostokąt (włącznie z krawędziami) do obszaru do odświeżenia
+        """
+        with self.__dirty_lock:
+            if self.__dirty:
+                dx0, dy0, dx1, dy1 = self.__dirty
+                x0, y0, x1, y1 = min(x0, dx0), min(y0, dy0), max(x1, dx1), max(y1, dy1)
+            self.__dirty = (x0, y0, x1, y1)
+
+    def __blit(self):
+        """ Kopiuje zmieniony prostokąt obrazka do wyświetlanego PhotoImage (w wątku Tk, co render_fps klatek/s)
+        Kopiowana jest tylko widoczna część prostokąta; po przewinięciu - cały widoczny fragment tablicy.
+        """
+        origin = (int(self.c.canvasx(0)), int(self.c.canvasy(0)))
+        if origin != self.__origin:
+            self.__origin = origin
+            self.c.coords(self.__photo_item, *origin)
+            self.__mark_dirty(origin[0], origin[1], origin[0] + self.view_width - 1, origin[1] + self.view_height - 1)
+        with self.__dirty_lock:
+            dirty, self.__dirty = self.__dirty, None
+        # Podgląd linii narysowanych już na obrazku
+        self.c.delete(_FLUSHED)
+        if dirty:
+            left, top = origin
+            box = (max(dirty[0], left), max(dirty[1], top), min(dirty[2] + 1, left + self.view_width),
+                   min(dirty[3] + 1, top + self.view_height))
+            if box[0] < box[2] and box[1] < box[3]:
+                patch = ImageTk.PhotoImage(self.img.crop(box))
+                self.c.tk.call(str(self.photo), 'copy', str(patch), '-to', box[0] - left, box[1] - top)
+        self.c.after(self.__frame_interval, self.__blit)
+
+    def image_replaced(self, img):
+        super().image_replaced(img)
+        if self.framebuffer:
+            self.__mark_dirty(0, 0, self.width - 1, self.height - 1)
+            return
+        pi = ImageTk.PhotoImage(image=img.to_image(), size=(self.width, self.height))
+        self.c.create_image(self.width / 2, self.height / 2, image=pi)
 
 
 class ConnectDialog:
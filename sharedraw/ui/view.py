@@ -0,0 +1,154 @@
+""" Wspólna część widoków aplikacji - interfejs, przez który kontroler zmienia obrazek i informuje o klientach
+Implementacje: sharedraw.ui.ui.SharedrawUI (okno Tk) i sharedraw.ui.headless.HeadlessUI (bez wyświetlania).
+"""
+import time
+from threading import Lock
+
+from sharedraw.cntrl.sync import ClientsTable, OwnershipManager
+from sharedraw.metrics import metrics
+from sharedraw.networking.messages import *
+from sharedraw.networking.networking import PeerPool
+from sharedraw.ui.canvas import ImageCanvas
+from sharedraw.ui.snapshot import SnapshotCache, SNAPSHOT_PNG
+
+__author__ = 'michalek'
+
+# Czas rysowania serii komunikatów [s] i liczba narysowanych odcinków
+_draw_time = metrics.histogram('render.draw_time')
+_segments = metrics.counter('render.segments')
+
+
+class View:
+    """ Widok aplikacji: obrazek (ImageCanvas lub jego podklasa), migawki dla nowych klientów i dziennik
+    """
+
+    def __init__(self, peer_pool: PeerPool, om: OwnershipManager, journal=None):
+        self.peer_pool = peer_pool
+        self.om = om
+        # Dziennik zmian obrazka (opcjonalny)
+        self.journal = journal
+        # Zmiana obrazka i jej zapis w dzienniku wykonywane są razem (z wątku kontrolera lub UI) - kolejność rekordów
+        # w dzienniku jest kolejnością rysowania
+        self.__lock = Lock()
+        self.canvas = None
+        self.snapshots = None
+
+    def set_canvas(self, canvas: ImageCanvas):
+        """ Ustawia obrazek widoku
+        :param canvas: obrazek
+        """
+        self.canvas = canvas
+        self.snapshots = SnapshotCache(canvas.current_image)
+
+    def start(self):
+        """ Uruchamia widok - blokuje do zakończenia pracy
+        """
+        pass
+
+    def get_png(self):
+        """ Zwraca piksele jako PNG
+        :return: piksele jako PNG
+        """
+        return self.snapshots.get().data
+
+    def current_image(self):
+        """ Zwraca wersję płótna i obrazek
+        :return: (wersja, obrazek PIL)
+        """
+        return self.canvas.current_image()
+
+    def load_image(self, img):
+        """ Zastępuje obrazek podanym (np. odtworzonym z dziennika)
+        :param img: obrazek PIL
+        """
+        self.canvas.load_image(img)
+
+    def paint_local(self, message: PaintMessage):
+        """ Rysuje linię narysowaną przez użytkownika i zapisuje ją w dzienniku
+        :param message: komunikat paint
+        """
+        with self.__lock:
+            self.canvas.draw_local(message.changed_pxs, message.color)
+            if self.journal:
+                self.journal.append(message)
+
+    def request_snapshot(self, callback, encoding=SNAPSHOT_PNG):
+        """ Żąda migawki obrazka bez blokowania wywołującego
+        :param callback: funkcja f(snapshot) wywoływana, gdy migawka jest gotowa (być może z innego wątku);
+         f(None), jeśli nie udało się jej zakodować
+        :param encoding: kodowanie migawki (SNAPSHOT_PNG lub SNAPSHOT_TILES)
+        """
+        self.snapshots.request(callback, encoding)
+
+    def connect(self, ip, port):
+        """ Podłącza do innego klienta
+        :param ip: ip (str)
+        :param port: port (int)
+        :return:
+        """
+        self.peer_pool.connect_to(ip, int(port))
+
+    def paint(self, message: PaintMessage):
+        """ Aktualizuje obrazek
+        :param message: komunikat
+        """
+        self.paint_batch((message,))
+
+    def paint_batch(self, messages: []):
+        """ Aktualizuje obrazek serią komunikatów paint
+        :param messages: lista komunikatów
+        """
+        with self.__lock:
+            start = time.perf_counter()
+            self.canvas.draw_batch(messages)
+            _draw_time.observe(time.perf_counter() - start)
+            if self.journal:
+                self.journal.append_all(messages)
+        _segments.inc(sum(len(message.changed_pxs) - 1 for message in messages if message.changed_pxs))
+
+    def update_image(self, message: ImageMessage):
+        """ Zastępuje obrazek otrzymanym od innego klienta
+        :param message: komunikat
+        """
+        with self.__lock:
+            if message.decoded is not None:
+                self.canvas.load_image(message.decoded)
+            else:
+                self.canvas.update_with_png(message.rawdata)
+            if self.journal:
+                # Obrazek zastąpiony w całości - dotychczasowy dziennik jest zbędny. Obrazka nie ma w dzienniku, więc
+                # punkt kontrolny musi zostać zapisany, zanim trafią do niego kolejne rekordy
+                self.journal.checkpoint(wait=True)
+
+    def clean(self, message: CleanMessage):
+        """ Czyści obrazek i zapisuje to w dzienniku
+        :param message: komunikat clean
+        """
+        with self.__lock:
+            self.canvas.clean_img()
+            if self.journal:
+                self.journal.append(message)
+
+    def update_clients_info(self, clients: ClientsTable):
+        """ Informuje o zmianie tablicy klientów
+        :param clients: tablica klientów
+        """
+        pass
+
+    def set_batching(self, latency_budget_ms=None, byte_budget=None):
+        """ Zmienia parametry grupowania punktów rysowanej linii (widok bez rysowania przez użytkownika nie grupuje
+        punktów - nic nie robi)
+        :param latency_budget_ms: maksymalne opóźnienie wysłania [ms]
+        :param byte_budget: maksymalny rozmiar komunikatu [B]
+        """
+        pass
+
+    def batching_stats(self):
+        """ Zwraca statystyki grupowania punktów rysowanej linii
+        """
+        return {}
+
+    def canvas_stats(self):
+        """ Zwraca rozmiar tablicy oraz liczbę i rozmiar przydzielonych kafelków obrazka
+        """
+        return self.canvas.img.stats()
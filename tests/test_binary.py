@@ -0,0 +1,87 @@
+""" Binarny format komunikatów - format jest wspólny dla wszystkich klientów w Pythonie i zapisywany w dzienniku,
+więc poza zgodnością kodowania i dekodowania sprawdzane są też konkretne bajty
+"""
+import unittest
+
+from sharedraw.networking.binary import *
+from sharedraw.networking.binary import _put_uint as put_uint
+
+__author__ = 'michalek'
+
+# Wartości na granicach varintów (7, 14 bitów) po zakodowaniu zigzag
+EDGE_VALUES = [0, 1, -1, 2, -2, 63, -64, 64, -65, 8191, -8192, 8192, -8193, 2 ** 31 - 1, -2 ** 31, 2 ** 40, -2 ** 40]
+
+
+class BinaryFormatTest(unittest.TestCase):
+
+    def round_trip(self, msg: Message):
+        frame = to_binary(msg)
+        self.assertEqual(frame[0], MAGIC)
+        self.assertEqual(wire_format_of(frame), WIRE_BINARY)
+        decoded = from_binary(frame)
+        self.assertIs(type(decoded), type(msg))
+        return decoded
+
+    def test_paint_deltas(self):
+        # Kolejne punkty dają różnice dodatnie i ujemne każdej wielkości
+        points = [(x, y) for x, y in zip(EDGE_VALUES, reversed(EDGE_VALUES))]
+        for color in ('black', 'white'):
+            msg = self.round_trip(PaintMessage(points, color, 'client-ą'))
+            self.assertEqual(msg.changed_pxs, points)
+            self.assertEqual(msg.color, color)
+            self.assertEqual(msg.client_id, 'client-ą')
+
+    def test_paint_bytes(self):
+        # MAGIC | długość 9 | paint, czarny, "A", 2 punkty: (0, 0), różnica (1, -1) -> zigzag 2, 1
+        frame = to_binary(PaintMessage([(0, 0), (1, -1)], 'black', 'A'))
+        self.assertEqual(frame, b'\xb5\x09\x01\x00\x01A\x02\x00\x00\x02\x01')
+
+    def test_varint(self):
+        for value in (0, 1, 127, 128, 16383, 16384, 2 ** 35):
+            out = bytearray()
+            put_uint(out, value)
+            self.assertEqual(read_uint(out, 0), (value, len(out)))
+        out = bytearray()
+        put_uint(out, 300)
+        self.assertEqual(bytes(out), b'\xac\x02')
+
+    def test_control_messages(self):
+        msg = self.round_trip(CleanMessage('A'))
+        self.assertEqual(msg.client_id, 'A')
+        msg = self.round_trip(RequestTableMessage('A', -5))
+        self.assertEqual((msg.client_id, msg.logical_time), ('A', -5))
+        msg = self.round_trip(ResignMessage('B'))
+        self.assertEqual(msg.client_id, 'B')
+        table = [RicartTableRow('A', 0, 1), RicartTableRow('B', 2 ** 20, -3)]
+        msg = self.round_trip(PassTokenMessage('B', table))
+        self.assertEqual(msg.dest_client_id, 'B')
+        self.assertEqual([tuple(row) for row in msg.ricart_table], [tuple(row) for row in table])
+        msg = self.round_trip(QuitMessage(['A', 'B', 'C'], 'D'))
+        self.assertEqual((msg.client_ids, msg.detected_by), (['A', 'B', 'C'], 'D'))
+
+    def test_messages_without_binary_form(self):
+        msg = JoinMessage('A')
+        self.assertIsNone(to_binary(msg))
+        frame = to_wire(msg, WIRE_BINARY)
+        self.assertEqual(wire_format_of(frame), WIRE_JSON)
+        self.assertIs(type(from_wire(frame)), JoinMessage)
+
+    def test_damaged_frames(self):
+        frame = to_binary(PaintMessage([(1, 2), (3, 4)], 'black', 'A'))
+        for end in range(1, len(frame)):
+            # Ucięta ramka nie może zostać zdekodowana jako inny, poprawny komunikat
+            msg = from_binary(frame[:end])
+            self.assertTrue(msg is None or msg.changed_pxs != [(1, 2), (3, 4)])
+        self.assertIsNone(from_binary(bytes((MAGIC, 1, 99))))
+
+    def test_wire(self):
+        msg = PaintMessage([(1, -2), (3, 4)], 'white', 'A')
+        for wire_format in (WIRE_JSON, WIRE_BINARY):
+            frame = to_wire(msg, wire_format)
+            self.assertEqual(wire_format_of(frame), wire_format)
+            decoded = from_wire(frame.rstrip(b'\n'))
+            self.assertEqual((decoded.changed_pxs, decoded.color, decoded.client_id), (msg.changed_pxs, 'white', 'A'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+""" Sprawdzanie opcji wiersza poleceń
+"""
+import io
+import sys
+import unittest
+from contextlib import redirect_stderr
+from unittest import mock
+
+from sharedraw.cntrl.cntrl import peer_pool_types
+from sharedraw.config import Config, NETWORK_MODES
+
+__author__ = 'michalek'
+
+
+class LoadTest(unittest.TestCase):
+
+    def load(self, *argv):
+        cfg = Config()
+        with mock.patch.object(sys, 'argv', ['sharedraw.py'] + list(argv)):
+            cfg.load()
+        return cfg
+
+    def assert_usage(self, *argv):
+        stderr = io.StringIO()
+        with redirect_stderr(stderr), self.assertRaises(SystemExit) as cm:
+            self.load(*argv)
+        self.assertEqual(2, cm.exception.code)
+        self.assertIn('Usage: sharedraw.py', stderr.getvalue())
+        return stderr.getvalue()
+
+    def test_valid_choices(self):
+        cfg = self.load('-n', 'asyncio', '-s', 'drop', '-r', 'items')
+        self.assertEqual(('asyncio', 'drop', 'items'), (cfg.network_mode, cfg.slow_consumer_policy, cfg.render_mode))
+
+    def test_invalid_choices(self):
+        for opt in ('-n', '-s', '-r'):
+            self.assertIn('Invalid value of %s: bogus' % opt, self.assert_usage(opt, 'bogus'))
+
+    def test_malformed_options(self):
+        self.assert_usage('-x')
+        self.assert_usage('-p', 'abc')
+        self.assert_usage('-n')
+
+    def test_network_modes_match_peer_pools(self):
+        self.assertEqual(set(NETWORK_MODES), set(peer_pool_types))
+
+
+if __name__ == '__main__':
+    unittest.main()
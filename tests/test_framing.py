@@ -0,0 +1,79 @@
+""" Wydzielanie komunikatów JSON i binarnych ze strumienia podzielonego w dowolnych miejscach
+"""
+import random
+import unittest
+
+from sharedraw.networking.binary import to_binary
+from sharedraw.networking.framing import MessageFramer
+from sharedraw.networking.messages import *
+
+__author__ = 'michalek'
+
+
+def frames():
+    """ Ramki JSON (z nawiasami i znakami ucieczki w łańcuchach) przeplatane ramkami binarnymi
+    :return: lista par (ramka do wysłania, ramka oczekiwana po wydzieleniu)
+    """
+    json_frames = [JoinMessage('A').to_bytes(),
+                   PaintMessage([(1, 2), (300, -4)], 'black', 'A').to_bytes(),
+                   b'{"type": "clean", "clientId": "{\\"}\\\\"}\n',
+                   QuitMessage(['A', 'B'], 'C').to_bytes()]
+    binary_frames = [to_binary(PaintMessage([(x, x * 3) for x in range(n)], 'white', 'B')) for n in (1, 50, 200)]
+    binary_frames.append(to_binary(CleanMessage('B' * 200)))
+    result = []
+    for json_frame, binary_frame in zip(json_frames, binary_frames):
+        result.append((json_frame, json_frame.rstrip(b'\n')))
+        result.append((binary_frame, binary_frame))
+    return result
+
+
+def framed(chunks: []):
+    framer = MessageFramer()
+    result = []
+    for chunk in chunks:
+        result += framer.append(chunk).fetch()
+    return result
+
+
+class MessageFramerTest(unittest.TestCase):
+
+    def setUp(self):
+        pairs = frames()
+        self.stream = b''.join(sent for sent, expected in pairs)
+        self.expected = [expected for sent, expected in pairs]
+
+    def test_every_split_point(self):
+        for split in range(len(self.stream) + 1):
+            self.assertEqual(framed([self.stream[:split], self.stream[split:]]), self.expected, split)
+
+    def test_random_chunks(self):
+        rnd = random.Random(1)
+        for _ in range(200):
+            chunks = []
+            pos = 0
+            while pos < len(self.stream):
+                size = rnd.choice((1, 2, 3, 7, 64, 500))
+                chunks.append(self.stream[pos:pos + size])
+                pos += size
+            self.assertEqual(framed(chunks), self.expected)
+
+    def test_byte_by_byte(self):
+        self.assertEqual(framed([bytes((b,)) for b in self.stream]), self.expected)
+
+    def test_without_newlines(self):
+        # Klienty, które nie kończą komunikatów znakiem nowej linii - zliczanie nawiasów
+        stream = b''.join(sent.rstrip(b'\n') for sent in (JoinMessage('A').to_bytes(),
+                                                         b'{"type": "clean", "clientId": "{\\"}"}'))
+        expected = [JoinMessage('A').to_bytes().rstrip(b'\n'), b'{"type": "clean", "clientId": "{\\"}"}']
+        for split in range(len(stream) + 1):
+            self.assertEqual(framed([stream[:split], stream[split:]]), expected, split)
+
+    def test_incomplete_frame_is_kept(self):
+        binary_frame = to_binary(PaintMessage([(1, 1)] * 100, 'black', 'A'))
+        framer = MessageFramer()
+        self.assertEqual(framer.append(binary_frame[:-1]).fetch(), [])
+        self.assertEqual(framer.append(binary_frame[-1:]).fetch(), [binary_frame])
+
+
+if __name__ == '__main__':
+    unittest.main()
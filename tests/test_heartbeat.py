@@ -0,0 +1,83 @@
+""" Wykrywanie awarii peera w czasie dekodowania obrazka w tle
+"""
+import socket
+import unittest
+from concurrent.futures import Future
+from queue import Queue
+from threading import Event
+from unittest import mock
+
+from sharedraw.config import config
+from sharedraw.networking import networking
+from sharedraw.networking.messages import *
+from sharedraw.networking.networking import Peer
+
+__author__ = 'michalek'
+
+
+class StalledDecodeTest(unittest.TestCase):
+
+    def setUp(self):
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        self.client = socket.create_connection(server.getsockname())
+        sock, _ = server.accept()
+        server.close()
+        self.queue = Queue()
+        self.peer = Peer(sock, Event(), self.queue)
+        self.now = 0.0
+        # Dekodowanie obrazka "zawiesza się" do czasu ustawienia wyniku
+        self.decoding = Future()
+        patches = [mock.patch.object(networking.time, 'monotonic', lambda: self.now),
+                   mock.patch.object(networking, 'from_wire_in_background',
+                                     lambda frame: self.decoding if b'"image"' in frame else None)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        self.peer.sock.close()
+        self.client.close()
+
+    def receive(self, at: float, msg: Message):
+        self.now = at
+        self.peer.handle_data(msg.to_bytes())
+
+    def phi(self, at: float):
+        return self.peer.failure_detector.phi(at)
+
+    def test_phi_stays_low_while_image_is_decoded(self):
+        for i in range(10):
+            self.receive(i * config.keep_alive_interval, KeepAliveMessage('B', sent_at=i))
+        self.receive(19, ImageMessage('B', b'image', ['B'], 'B', False))
+        for i in range(10, 16):
+            self.receive(i * config.keep_alive_interval - 0.5, PaintMessage([(i, i), (i + 1, i + 1)], 'black', 'B'))
+            self.receive(i * config.keep_alive_interval, KeepAliveMessage('B', sent_at=i))
+        self.assertLess(self.phi(31), config.phi_threshold)
+        # Odpowiedzi na keepAlive wysłane mimo wstrzymanych ramek
+        self.assertEqual(self.peer.outbound.stats()['depth'], 16)
+        self.assertTrue(self.queue.empty())
+
+        self.decoding.set_result(ImageMessage('B', b'image', ['B'], 'B', False))
+        received = [self.queue.get_nowait().message for _ in range(7)]
+        self.assertIs(type(received[0]), ImageMessage)
+        self.assertEqual([m.changed_pxs[0][0] for m in received[1:]], list(range(10, 16)))
+
+    def test_partial_frame_is_sign_of_life(self):
+        for i in range(10):
+            self.receive(i * config.keep_alive_interval, KeepAliveMessage('B', sent_at=i))
+        frame = ImageMessage('B', b'image' * 1000, ['B'], 'B', False).to_bytes()
+        for i in range(10):
+            self.now = 19 + i
+            self.peer.handle_data(frame[i * 100:(i + 1) * 100])
+        self.assertLess(self.phi(29), config.phi_threshold)
+
+    def test_silent_peer_is_suspected(self):
+        for i in range(10):
+            self.receive(i * config.keep_alive_interval, KeepAliveMessage('B', sent_at=i))
+        self.assertGreater(self.phi(30), config.phi_threshold)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+""" Dziennik zmian obrazka: format rekordów i odtwarzanie po awarii (ucięty lub uszkodzony koniec, przerwany zapis
+punktu kontrolnego)
+"""
+import glob
+import os
+import random
+import shutil
+import struct
+import tempfile
+import unittest
+import zlib
+
+from sharedraw.networking.binary import to_binary
+from sharedraw.networking.messages import *
+from sharedraw.storage.journal import Journal, apply
+from sharedraw.ui.canvas import ImageCanvas
+
+__author__ = 'michalek'
+
+SIZE = (200, 150)
+
+
+def workload(count: int, seed=1):
+    rnd = random.Random(seed)
+    msgs = []
+    for i in range(count):
+        if i % 50 == 49:
+            msgs.append(CleanMessage('A'))
+            continue
+        x, y = rnd.randrange(SIZE[0]), rnd.randrange(SIZE[1])
+        msgs.append(PaintMessage([(x, y), (x + rnd.randint(-40, 40), y + rnd.randint(-40, 40))],
+                                 rnd.choice(('black', 'white')), 'A'))
+    return msgs
+
+
+def drawn(msgs: []):
+    canvas = ImageCanvas(*SIZE)
+    for msg in msgs:
+        apply(canvas, msg)
+    return canvas.img.tobytes()
+
+
+class JournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write(self, msgs: [], checkpoint_records=1000000):
+        canvas = ImageCanvas(*SIZE)
+        journal = Journal(self.directory, canvas.current_image, checkpoint_records=checkpoint_records)
+        for msg in msgs:
+            apply(canvas, msg)
+            journal.append(msg)
+        journal.close()
+        return canvas.img.tobytes()
+
+    def recover(self):
+        journal = Journal(self.directory)
+        try:
+            img = journal.recover(SIZE)
+        finally:
+            journal.close()
+        return img.tobytes() if img is not None else None
+
+    def journal_files(self):
+        return sorted(glob.glob(os.path.join(self.directory, 'journal.*.log')))
+
+    @staticmethod
+    def record_ends(msgs: []):
+        """ Pozycje końców kolejnych rekordów w pliku dziennika
+        """
+        ends = []
+        pos = 0
+        for msg in msgs:
+            pos += 8 + len(to_binary(msg))
+            ends.append(pos)
+        return ends
+
+    def test_record_format(self):
+        msg = PaintMessage([(1, 2), (3, 4)], 'black', 'A')
+        self.write([msg])
+        payload = to_binary(msg)
+        with open(self.journal_files()[0], 'rb') as f:
+            data = f.read(8 + len(payload) + 8)
+        self.assertEqual(data, struct.pack('<II', len(payload), zlib.crc32(payload)) + payload + bytes(8))
+
+    def test_recovery(self):
+        msgs = workload(300)
+        self.assertIsNone(self.recover())
+        self.assertEqual(self.write(msgs), drawn(msgs))
+        self.assertEqual(self.recover(), drawn(msgs))
+
+    def test_truncated_tail(self):
+        msgs = workload(120)
+        self.write(msgs)
+        path = self.journal_files()[0]
+        ends = self.record_ends(msgs)
+        for cut in (ends[-1] - 1, ends[-1] - 8, ends[-2] + 3, ends[50] + 1):
+            with open(path, 'r+b') as f:
+                f.truncate(cut)
+            complete = sum(1 for end in ends if end <= cut)
+            self.assertEqual(self.recover(), drawn(msgs[:complete]), cut)
+
+    def test_corrupted_record(self):
+        msgs = workload(120)
+        self.write(msgs)
+        path = self.journal_files()[0]
+        ends = self.record_ends(msgs)
+        with open(path, 'r+b') as f:
+            # Bajt wewnątrz 61. rekordu - odtwarzanie kończy się na ostatnim poprawnym
+            f.seek(ends[59] + 9)
+            byte = f.read(1)
+            f.seek(ends[59] + 9)
+            f.write(bytes((byte[0] ^ 0xFF,)))
+        self.assertEqual(self.recover(), drawn(msgs[:60]))
+        # Kolejne rekordy dopisywane są za ostatnim poprawnym
+        more = workload(10, seed=2)
+        canvas = ImageCanvas(*SIZE)
+        journal = Journal(self.directory, canvas.current_image)
+        for msg in more:
+            journal.append(msg)
+        journal.close()
+        self.assertEqual(self.recover(), drawn(msgs[:60] + more))
+
+    def test_checkpoints(self):
+        msgs = workload(1000)
+        self.assertEqual(self.write(msgs, checkpoint_records=100), drawn(msgs))
+        self.assertTrue(os.path.exists(os.path.join(self.directory, 'checkpoint.sdt')))
+        self.assertEqual(len(self.journal_files()), 1)
+        self.assertEqual(self.recover(), drawn(msgs))
+
+    def test_interrupted_checkpoint(self):
+        msgs = workload(300)
+        self.write(msgs[:100])
+        first = self.journal_files()[0]
+        with open(first, 'rb') as f:
+            first_data = f.read()
+        canvas = ImageCanvas(*SIZE)
+        for msg in msgs[:100]:
+            apply(canvas, msg)
+        journal = Journal(self.directory, canvas.current_image)
+        journal.checkpoint(wait=True)
+        for msg in msgs[100:]:
+            apply(canvas, msg)
+            journal.append(msg)
+        journal.close()
+        self.assertNotIn(first, self.journal_files())
+        self.assertEqual(self.recover(), drawn(msgs))
+        # Awaria po zapisaniu punktu kontrolnego, przed usunięciem objętego nim pliku - nałożenie go ponownie niczego
+        # nie zmienia
+        with open(first, 'wb') as f:
+            f.write(first_data)
+        self.assertEqual(self.recover(), drawn(msgs))
+        # Awaria przed zapisaniem punktu kontrolnego - odtwarzane są wszystkie pliki
+        os.remove(os.path.join(self.directory, 'checkpoint.sdt'))
+        self.assertEqual(self.recover(), drawn(msgs))
+
+
+if __name__ == '__main__':
+    unittest.main()
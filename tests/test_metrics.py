@@ -0,0 +1,53 @@
+""" Zmiana parametrów w trakcie działania przez serwer HTTP metryk
+"""
+import json
+import unittest
+from urllib.error import HTTPError
+from urllib.request import urlopen, Request
+
+from sharedraw.metrics import metrics, MetricsServer
+
+__author__ = 'michalek'
+
+
+class ControlTest(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+
+        def control(budget=None):
+            budget = int(budget)
+            if budget <= 0:
+                raise ValueError("Budget must be positive")
+            self.calls.append(budget)
+            return {'budget': budget}
+
+        metrics.register_control('test.budget', control)
+        self.server = MetricsServer(0)
+        self.server.start()
+        self.addCleanup(self.server.stop)
+
+    def post(self, path: str):
+        url = 'http://127.0.0.1:%s%s' % (self.server.server.server_port, path)
+        try:
+            with urlopen(Request(url, data=b'', method='POST'), timeout=5) as response:
+                return response.status, json.loads(response.read().decode('utf8'))
+        except HTTPError as e:
+            return e.code, json.loads(e.read().decode('utf8'))
+
+    def test_control_called_with_query_params(self):
+        self.assertEqual((200, {'budget': 512}), self.post('/test.budget?budget=512'))
+        self.assertEqual([512], self.calls)
+
+    def test_invalid_values_rejected(self):
+        self.assertEqual(400, self.post('/test.budget?budget=-1')[0])
+        self.assertEqual(400, self.post('/test.budget?budget=abc')[0])
+        self.assertEqual(400, self.post('/test.budget?unknown=1')[0])
+        self.assertEqual([], self.calls)
+
+    def test_unknown_control(self):
+        self.assertEqual(404, self.post('/no.such.control')[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+""" Kolejka wychodząca: progi, polityki wolnego odbiorcy, rezerwacje i przekazanie sesji nowemu połączeniu
+"""
+import unittest
+
+from sharedraw.networking.messages import *
+from sharedraw.networking.outbound import *
+
+__author__ = 'michalek'
+
+
+def encode(msg: Message):
+    return msg.to_bytes()
+
+
+def paint(x: int, length=10):
+    """ Odcinek o długości length zaczynający się w punkcie (x, 0) - kolejne odcinki są kontynuacją poprzednich
+    """
+    return PaintMessage([(x, 0), (x + length, 0)], 'black', 'A')
+
+
+def drain(queue: OutboundQueue):
+    frames = []
+    while True:
+        data = queue.pop()
+        if data is None:
+            return frames
+        frames.append(data)
+
+
+class WatermarkTest(unittest.TestCase):
+
+    def queue(self, policy: str):
+        return OutboundQueue(encode, high_watermark=1000, low_watermark=300, max_size=5000, policy=policy)
+
+    def fill_over_high_watermark(self, queue: OutboundQueue):
+        data = b'x' * 100
+        for _ in range(11):
+            queue.put(data)
+        self.assertFalse(queue.congested)
+        # Próg sprawdzany jest przed wstawieniem - przeciążenie zaczyna się przy kolejnej ramce
+        queue.put(data)
+        self.assertTrue(queue.congested)
+
+    def test_congestion_ends_under_low_watermark(self):
+        queue = self.queue(POLICY_DROP)
+        self.fill_over_high_watermark(queue)
+        while queue.queued_bytes > 300:
+            self.assertTrue(queue.congested)
+            queue.pop()
+        self.assertFalse(queue.congested)
+        self.assertEqual(queue.congestion_count, 1)
+
+    def test_drop(self):
+        queue = self.queue(POLICY_DROP)
+        self.fill_over_high_watermark(queue)
+        depth = len(queue)
+        queue.put(paint(0).to_bytes(), paint(0))
+        self.assertEqual(len(queue), depth)
+        self.assertEqual(queue.dropped_frames, 1)
+        # Pozostałe komunikaty nie są odrzucane
+        queue.put(CleanMessage('A').to_bytes(), CleanMessage('A'))
+        self.assertEqual(len(queue), depth + 1)
+
+    def test_merge(self):
+        queue = self.queue(POLICY_MERGE)
+        self.fill_over_high_watermark(queue)
+        depth = len(queue)
+        for i in range(5):
+            queue.put(paint(i * 10).to_bytes(), paint(i * 10))
+        # Pierwszy komunikat wstawiony, kolejne doklejone do niego
+        self.assertEqual(len(queue), depth + 1)
+        self.assertEqual(queue.merged_frames, 4)
+        # Inny kolor - nie jest kontynuacją
+        white = PaintMessage([(50, 0), (60, 0)], 'white', 'A')
+        queue.put(white.to_bytes(), white)
+        self.assertEqual(len(queue), depth + 2)
+        frames = drain(queue)
+        self.assertEqual(frames[-2], PaintMessage([(x, 0) for x in range(0, 60, 10)], 'black', 'A').to_bytes())
+        self.assertEqual(queue.queued_bytes, 0)
+
+    def test_disconnect(self):
+        queue = self.queue(POLICY_DISCONNECT)
+        for _ in range(11):
+            queue.put(b'x' * 100)
+        with self.assertRaises(SlowConsumerError):
+            queue.put(b'x' * 100)
+        self.assertTrue(queue.closed)
+        with self.assertRaises(SlowConsumerError):
+            queue.put(b'x')
+
+    def test_max_size(self):
+        queue = self.queue(POLICY_MERGE)
+        queue.put(b'x' * 6000)
+        with self.assertRaises(SlowConsumerError):
+            queue.put(b'x')
+
+    def test_reservation(self):
+        queue = self.queue(POLICY_MERGE)
+        reservation = queue.reserve()
+        queue.put(b'after')
+        self.assertIsNone(queue.pop())
+        queue.fill(reservation, b'image')
+        self.assertEqual(drain(queue), [b'image', b'after'])
+        reservation = queue.reserve()
+        queue.put(b'after')
+        queue.cancel(reservation)
+        self.assertEqual(drain(queue), [b'after'])
+
+
+class HandOverTest(unittest.TestCase):
+    FRAMES = [b'aaaa', b'bbbbbb', b'cc']
+
+    def old_queue(self):
+        """ Kolejka z historią: wysłany keepAlive i dwie pierwsze ramki, pozostałe czekają w kolejce
+        """
+        queue = OutboundQueue(encode)
+        keep_alive = KeepAliveMessage('A', 1)
+        queue.put(keep_alive.to_bytes(), keep_alive)
+        queue.keep_history(1000)
+        for data in self.FRAMES:
+            queue.put(data)
+        for _ in range(3):
+            queue.pop()
+        queue.put(b'unsent')
+        return queue
+
+    def test_offsets(self):
+        stream = b''.join(self.FRAMES) + b'unsent'
+        for offset in range(len(stream) + 1):
+            old = self.old_queue()
+            old.close()
+            new = OutboundQueue(encode)
+            self.assertTrue(old.hand_over(new, offset), offset)
+            # Dane za pozycją odebraną przez drugą stronę (keepAlive nie jest liczony), a potem nowe dane
+            old.put(b'later')
+            self.assertEqual(b''.join(drain(new)), stream[offset:] + b'later', offset)
+            self.assertEqual(new.history.end, len(stream) + len(b'later'))
+
+    def test_open_queue(self):
+        # Nowe połączenie może pojawić się, zanim stare zostanie uznane za zerwane
+        old = self.old_queue()
+        new = OutboundQueue(encode)
+        self.assertTrue(old.hand_over(new, 4))
+        self.assertEqual(b''.join(drain(new)), b'bbbbbbccunsent')
+
+    def test_unavailable_offset(self):
+        old = self.old_queue()
+        old.close()
+        self.assertFalse(old.can_resume(100))
+        self.assertFalse(old.hand_over(OutboundQueue(encode), 100))
+        self.assertFalse(OutboundQueue(encode).hand_over(OutboundQueue(encode), 0))
+
+    def test_history_capacity(self):
+        queue = OutboundQueue(encode)
+        queue.keep_history(8)
+        for data in self.FRAMES:
+            queue.put(data)
+            queue.pop()
+        self.assertFalse(queue.can_resume(0))
+        self.assertTrue(queue.can_resume(4))
+        self.assertEqual(queue.history.since(5), b'bbbbbcc')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+""" Wyszukiwanie następnego posiadacza tokena w porównaniu z pierwotnym przeglądaniem pierścienia
+"""
+import random
+import unittest
+
+from sharedraw.cntrl.sync import ClientsTable
+from sharedraw.config import own_id
+
+__author__ = 'michalek'
+
+
+def linear_next_requester(clients: ClientsTable, client_id: str):
+    """ Pierwotny algorytm: pierwszy klient na prawo od podanego (w kolejności dodania), dla którego R > G
+    """
+    ordered = clients.clients
+    own_idx = next((i for i, c in enumerate(ordered) if c.id == client_id), None)
+    if own_idx is None:
+        return None
+    size = len(ordered)
+    iterator = map(lambda i: ordered[(i + own_idx) % size], range(1, size))
+    return next(filter(lambda c: c.has_requested(), iterator), None)
+
+
+class FindNextRequesterTest(unittest.TestCase):
+
+    def test_against_linear_scan(self):
+        rnd = random.Random(1)
+        for _ in range(20):
+            clients = ClientsTable()
+            clients.add(own_id)
+            names = 0
+            for _ in range(500):
+                ids = clients.get_client_ids()
+                op = rnd.random()
+                if op < 0.3 or len(ids) < 3:
+                    names += 1
+                    parent = rnd.choice(ids + [None])
+                    clients.add('c%s' % names, parent if parent != own_id else None)
+                elif op < 0.4:
+                    victim = rnd.choice(ids)
+                    if victim != own_id:
+                        if rnd.random() < 0.5:
+                            clients.remove(victim)
+                        else:
+                            clients.remove_remote([victim], own_id)
+                elif op < 0.7:
+                    client = clients[rnd.choice(ids)]
+                    client.requested += 1
+                elif op < 0.9:
+                    client = clients[rnd.choice(ids)]
+                    client.granted = client.requested
+                else:
+                    # Tablica Ricart-Agrawala otrzymana wraz z tokenem
+                    table = clients.to_ricart()
+                    table = [row._replace(g=row.r if rnd.random() < 0.5 else row.g) for row in table]
+                    clients.update_with_ricart(table)
+                for client_id in clients.get_client_ids():
+                    self.assertIs(clients.find_next_requester(client_id), linear_next_requester(clients, client_id))
+            self.assertIsNone(clients.find_next_requester('unknown'))
+
+    def test_only_self_requests(self):
+        clients = ClientsTable()
+        clients.add(own_id)
+        clients.add('A')
+        clients[own_id].requested = 1
+        self.assertIsNone(clients.find_next_requester(own_id))
+        self.assertIs(clients.find_next_requester('A'), clients[own_id])
+
+
+if __name__ == '__main__':
+    unittest.main()